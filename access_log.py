@@ -0,0 +1,531 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import atexit
+import collections
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import and_, exc, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+# log_date format of the spill files
+SPILL_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# usage rollup periods, finest first
+ROLLUP_PERIODS = ('minute', 'hour', 'day')
+
+
+def bucket_start(period, log_date):
+    """
+    The start of the rollup bucket holding a log date
+    :param period: string minute, hour or day
+    :param log_date: datetime
+    :return: datetime
+    """
+    if period == 'minute':
+        return log_date.replace(second=0, microsecond=0)
+    if period == 'hour':
+        return log_date.replace(minute=0, second=0, microsecond=0)
+    return log_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_counts(rows):
+    """
+    Count log rows per user, period, bucket and resource
+    :param rows: list of dicts with user_id, resource and log_date
+    :return: Counter
+    """
+    counts = collections.Counter()
+
+    for row in rows:
+        for period in ROLLUP_PERIODS:
+            counts[(row['user_id'], period, bucket_start(period, row['log_date']), row['resource'])] += 1
+
+    return counts
+
+
+def upsert_rollups(connection, table, counts):
+    """
+    Add counts to the usage rollup rows.  MySQL takes them in one
+    INSERT ... ON DUPLICATE KEY UPDATE, other databases update each
+    row and insert the ones that do not exist yet.  Rows are written
+    in key order so concurrent writers lock them in the same order
+    :param connection: sqlalchemy Connection
+    :param table: usage rollup Table
+    :param counts: Counter from rollup_counts
+    :return: none
+    """
+    rows = [
+        {'user_id': user_id, 'period': period, 'bucket': bucket, 'resource': resource, 'count': count}
+        for (user_id, period, bucket, resource), count in sorted(counts.items())
+    ]
+    if not rows:
+        return
+
+    if connection.dialect.name == 'mysql':
+        statement = mysql_insert(table)
+        connection.execute(statement.on_duplicate_key_update(count=table.c.count + statement.inserted.count), rows)
+        return
+
+    for row in rows:
+        updated = connection.execute(table.update().where(and_(
+            table.c.user_id == row['user_id'],
+            table.c.period == row['period'],
+            table.c.bucket == row['bucket'],
+            table.c.resource == row['resource']
+        )).values(count=table.c.count + row['count']))
+
+        if not updated.rowcount:
+            connection.execute(table.insert(), row)
+
+
+def prune(engine, log_table, rollup_table, log_cutoff, rollup_cutoffs, batch_size=10000):
+    """
+    Delete the log rows and rollup buckets past their retention window
+    Log rows are deleted batch_size at a time to keep transactions short
+    :param engine: sqlalchemy Engine
+    :param log_table: access log Table
+    :param rollup_table: usage rollup Table
+    :param log_cutoff: datetime, older log rows are deleted
+    :param rollup_cutoffs: dict of period to datetime, older buckets are deleted
+    :param batch_size: int
+    :return: dict of deleted row counts
+    """
+    deleted = collections.OrderedDict([('log', 0)])
+    oldest = select([log_table.c.id]).where(log_table.c.log_date < log_cutoff).order_by(log_table.c.id)
+
+    while True:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(oldest.limit(batch_size))]
+            if not ids:
+                break
+            connection.execute(log_table.delete().where(log_table.c.id.in_(ids)))
+
+        deleted['log'] += len(ids)
+
+    with engine.begin() as connection:
+        for period, cutoff in sorted(rollup_cutoffs.items()):
+            deleted[period] = connection.execute(rollup_table.delete().where(and_(
+                rollup_table.c.period == period,
+                rollup_table.c.bucket < cutoff
+            ))).rowcount
+
+    return deleted
+
+
+def read_spill(f):
+    """
+    The log rows of a spill or journal file.  A line is [user_id,
+    resource, log_date] or, in a journal, [user_id, resource, log_date,
+    count].  Lines that do not parse, e.g. the last line of a journal
+    whose process was killed mid write, are skipped
+    :param f: file object
+    :return: list of dicts
+    """
+    rows = []
+
+    for line in f:
+        try:
+            values = json.loads(line)
+            row = {
+                'user_id': values[0],
+                'resource': values[1],
+                'log_date': datetime.strptime(values[2], SPILL_DATE_FORMAT)
+            }
+            count = int(values[3]) if len(values) > 3 else 1
+        except (IndexError, TypeError, ValueError):
+            continue
+
+        rows.extend([row] * count)
+
+    return rows
+
+
+class AccessLogWriter(object):
+    """
+    Buffered API access log.  Requests queue their log records in
+    memory and a background thread writes them with multi-row inserts
+    every batch_size records or interval seconds, whichever comes
+    first.  Each write also adds its rows to the usage rollups in the
+    same transaction
+
+    With a spill_dir every record is also appended to a journal file
+    of the process before log returns, so a killed worker loses none.
+    The writer starts a new journal whenever it takes the queue and
+    deletes the old one once its rows are committed, or turns it into
+    a spill file when the database is down.  A queue of max_queue
+    records is moved to a spill file the same way, so memory stays
+    bounded during an outage.  Journals are locked by their process;
+    the journals of dead processes and the spill files are replayed
+    after every successful flush
+    """
+
+    def __init__(self, engine, table, rollup_table=None, batch_size=500, interval=1.0, spill_dir=None,
+                 max_queue=100000):
+        self.engine = engine
+        self.table = table
+        self.rollup_table = rollup_table
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spill_dir = spill_dir
+        self.max_queue = max_queue
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.errors = 0
+        self._queue = collections.deque()
+        self._journal = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def log(self, user_id, resource, count=1):
+        """
+        Queue count access log rows.  Never touches the database, the
+        record is appended to the journal and the queue under a lock
+        held for one write to the page cache
+        :param user_id: int
+        :param resource: string
+        :param count: int
+        :return: none
+        """
+        if self._pid != os.getpid():
+            self.start()
+
+        record = (user_id, resource, datetime.now(), count)
+
+        with self._log_lock:
+            if self._journal is not None:
+                self._append_journal(record)
+            self._queue.append(record)
+            queued = len(self._queue)
+
+        if queued >= self.max_queue:
+            self.spill_queue()
+        elif queued >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        """
+        Start the writer thread and journal of this process.  A forked
+        WSGI or celery worker starts its own with an empty queue, the
+        records queued before the fork belong to the parent
+        :return: none
+        """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+
+            # the parent's journal stays locked by the parent
+            if self._journal is not None:
+                os.close(self._journal[0])
+
+            self._queue = collections.deque()
+            self._journal = self._open_journal()
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._log_lock = threading.Lock()
+            self._flush_lock = threading.Lock()
+            self._thread = threading.Thread(target=self._run, name='access-log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        self.replay()
+
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+            errors = self.errors
+            self.flush()
+            if self.errors == errors:
+                self.replay()
+
+    def _take_queue(self):
+        """
+        Take every queued record and start a new journal for the next
+        ones.  The old journal, still locked, holds the records taken
+        :return: tuple (list of records, journal or None)
+        """
+        with self._log_lock:
+            records = list(self._queue)
+            self._queue.clear()
+
+            journal = None
+            if records:
+                journal, self._journal = self._journal, self._open_journal()
+
+            return records, journal
+
+    def flush(self):
+        """
+        Write every queued record, spilling them to disk when the
+        database is unavailable
+        :return: int rows written
+        """
+        with self._flush_lock:
+            records, journal = self._take_queue()
+            if not records:
+                return 0
+
+            rows = [
+                {'user_id': user_id, 'resource': resource, 'log_date': log_date}
+                for user_id, resource, log_date, count in records for i in range(count)
+            ]
+
+            try:
+                self.write(rows)
+
+            except exc.SQLAlchemyError as db_err:
+                self.errors += 1
+                print('Error writing access log data: {}'.format(str(db_err)))
+                if journal is not None:
+                    self._close_journal(journal, spill=True)
+                    self.spilled += len(rows)
+                else:
+                    self.spill(rows)
+                return 0
+
+            if journal is not None:
+                self._close_journal(journal)
+            self.written += len(rows)
+            return len(rows)
+
+    def spill_queue(self):
+        """
+        Move the queue to disk without writing it, when it is full
+        :return: none
+        """
+        records, journal = self._take_queue()
+        rows = [
+            {'user_id': user_id, 'resource': resource, 'log_date': log_date}
+            for user_id, resource, log_date, count in records for i in range(count)
+        ]
+
+        if journal is not None:
+            self._close_journal(journal, spill=True)
+            self.spilled += len(rows)
+        elif rows:
+            self.spill(rows)
+
+    def write(self, rows):
+        """
+        Insert log rows and add them to the usage rollups in one
+        transaction, batch_size log rows per statement
+        :param rows: list of dicts
+        :return: none
+        """
+        with self.engine.begin() as connection:
+            for start in range(0, len(rows), self.batch_size):
+                connection.execute(self.table.insert(), rows[start:start + self.batch_size])
+
+            if self.rollup_table is not None:
+                upsert_rollups(connection, self.rollup_table, rollup_counts(rows))
+
+    def _spill_path(self):
+        """
+        A new spill file name of this process
+        :return: string
+        """
+        return os.path.join(self.spill_dir, 'spill-{}-{}.ndjson'.format(os.getpid(), int(time.time() * 1000000)))
+
+    def _open_journal(self):
+        """
+        Create and lock a new journal file of this process
+        :return: tuple (fd, path) or None without a spill directory
+        """
+        if not self.spill_dir:
+            return None
+
+        try:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+
+            path = os.path.join(
+                self.spill_dir, 'journal-{}-{}.ndjson'.format(os.getpid(), int(time.time() * 1000000)))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd, path
+
+        except (IOError, OSError) as io_err:
+            self.errors += 1
+            print('Error opening the access log journal: {}'.format(str(io_err)))
+            return None
+
+    def _append_journal(self, record):
+        """
+        Append a record to the journal, one write call per line
+        :param record: tuple (user_id, resource, log_date, count)
+        :return: none
+        """
+        user_id, resource, log_date, count = record
+
+        try:
+            os.write(self._journal[0], (json.dumps(
+                [user_id, resource, log_date.strftime(SPILL_DATE_FORMAT), count]) + '\n').encode('utf-8'))
+
+        except (IOError, OSError) as io_err:
+            self.errors += 1
+            print('Error writing the access log journal: {}'.format(str(io_err)))
+
+    def _close_journal(self, journal, spill=False):
+        """
+        Delete a journal whose rows are committed, or keep it as a
+        spill file, and release its lock
+        :param journal: tuple (fd, path)
+        :param spill: bool
+        :return: none
+        """
+        fd, path = journal
+
+        try:
+            if spill:
+                os.fsync(fd)
+                os.rename(path, self._spill_path())
+            else:
+                os.remove(path)
+
+        except (IOError, OSError) as io_err:
+            print('Error closing the access log journal {}: {}'.format(path, str(io_err)))
+
+        finally:
+            os.close(fd)
+
+    def spill(self, rows):
+        """
+        Append log rows to a new spill file of this process, synced to disk
+        :param rows: list of dicts
+        :return: none
+        """
+        if not self.spill_dir:
+            print('Dropped {} access log rows, no spill directory'.format(len(rows)))
+            return
+
+        try:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+
+            with open(self._spill_path(), 'w') as f:
+                for row in rows:
+                    f.write(json.dumps([row['user_id'], row['resource'], row['log_date'].strftime(SPILL_DATE_FORMAT)]))
+                    f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.spilled += len(rows)
+
+        except (IOError, OSError) as io_err:
+            print('Error spilling {} access log rows: {}'.format(len(rows), str(io_err)))
+
+    def _claim_journal(self, path):
+        """
+        Claim the journal of a dead process for replay.  A live process
+        holds the lock of its journals, and a journal deleted or renamed
+        after it was opened here belongs to nobody
+        :param path: string
+        :return: bool
+        """
+        try:
+            with open(path) as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    return False
+                os.rename(path, path + '.replay')
+                return True
+
+        except (IOError, OSError):
+            return False
+
+    def replay(self):
+        """
+        Write the rows of every spill file and of the journals left by
+        dead processes.  A file is claimed by renaming it, so only one
+        process replays it, and is put back as a spill file when the
+        database is still unavailable
+        :return: int rows replayed
+        """
+        if not self.spill_dir:
+            return 0
+
+        replayed = 0
+        spills = sorted(glob.glob(os.path.join(self.spill_dir, 'spill-*.ndjson')))
+        journals = sorted(glob.glob(os.path.join(self.spill_dir, 'journal-*.ndjson')))
+
+        for path in spills + journals:
+            claimed = path + '.replay'
+
+            if path in journals:
+                if not self._claim_journal(path):
+                    continue
+            else:
+                try:
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+
+            try:
+                with open(claimed) as f:
+                    rows = read_spill(f)
+
+                if rows:
+                    self.write(rows)
+                os.remove(claimed)
+                replayed += len(rows)
+
+            except exc.SQLAlchemyError as db_err:
+                self.errors += 1
+                print('Error replaying access log spill {}: {}'.format(path, str(db_err)))
+                os.rename(claimed, self._spill_path() if path in journals else path)
+                break
+
+            except (IOError, OSError) as err:
+                print('Error reading access log spill {}: {}'.format(path, str(err)))
+
+        self.replayed += replayed
+        return replayed
+
+    def close(self):
+        """
+        Stop the writer thread, write or spill what is still queued
+        and delete the empty journal.  Registered with atexit
+        :return: none
+        """
+        if self._pid != os.getpid():
+            return
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2 + 1)
+
+        self.flush()
+
+        with self._log_lock:
+            journal, self._journal = self._journal, None
+        if journal is not None:
+            self._close_journal(journal, spill=bool(self._queue))
+
+    def stats(self):
+        """
+        Queue length and row counters of the writer
+        :return: dict
+        """
+        return {
+            'queued': len(self._queue),
+            'written': self.written,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'errors': self.errors
+        }
@@ -0,0 +1,195 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+
+# USPS street suffix abbreviations (Publication 28, appendix C1)
+STREET_SUFFIXES = {
+    'ALLEY': 'ALY', 'ANNEX': 'ANX', 'ARCADE': 'ARC', 'AVENUE': 'AVE', 'AV': 'AVE', 'AVEN': 'AVE',
+    'BAYOU': 'BYU', 'BEACH': 'BCH', 'BEND': 'BND', 'BLUFF': 'BLF', 'BOULEVARD': 'BLVD', 'BOUL': 'BLVD',
+    'BRANCH': 'BR', 'BRIDGE': 'BRG', 'BROOK': 'BRK', 'BYPASS': 'BYP', 'CAUSEWAY': 'CSWY', 'CENTER': 'CTR',
+    'CENTRE': 'CTR', 'CIRCLE': 'CIR', 'CIRC': 'CIR', 'CLIFF': 'CLF', 'CLUB': 'CLB', 'COMMON': 'CMN',
+    'CORNER': 'COR', 'COURSE': 'CRSE', 'COURT': 'CT', 'COVE': 'CV', 'CREEK': 'CRK', 'CRESCENT': 'CRES',
+    'CROSSING': 'XING', 'DRIVE': 'DR', 'DRV': 'DR', 'ESTATE': 'EST', 'ESTATES': 'ESTS', 'EXPRESSWAY': 'EXPY',
+    'EXTENSION': 'EXT', 'FALLS': 'FLS', 'FERRY': 'FRY', 'FIELD': 'FLD', 'FIELDS': 'FLDS', 'FOREST': 'FRST',
+    'FORK': 'FRK', 'FORT': 'FT', 'FREEWAY': 'FWY', 'GARDEN': 'GDN', 'GARDENS': 'GDNS', 'GATEWAY': 'GTWY',
+    'GLEN': 'GLN', 'GREEN': 'GRN', 'GROVE': 'GRV', 'HARBOR': 'HBR', 'HAVEN': 'HVN', 'HEIGHTS': 'HTS',
+    'HIGHWAY': 'HWY', 'HIGHWY': 'HWY', 'HILL': 'HL', 'HILLS': 'HLS', 'HOLLOW': 'HOLW', 'ISLAND': 'IS',
+    'JUNCTION': 'JCT', 'KEY': 'KY', 'KNOLL': 'KNL', 'LAKE': 'LK', 'LAKES': 'LKS', 'LANDING': 'LNDG',
+    'LANE': 'LN', 'LIGHT': 'LGT', 'LOOP': 'LOOP', 'MANOR': 'MNR', 'MEADOW': 'MDW', 'MEADOWS': 'MDWS',
+    'MILL': 'ML', 'MISSION': 'MSN', 'MOUNT': 'MT', 'MOUNTAIN': 'MTN', 'PARKWAY': 'PKWY', 'PKY': 'PKWY',
+    'PASSAGE': 'PSGE', 'PIKE': 'PIKE', 'PINES': 'PNES', 'PLACE': 'PL', 'PLAIN': 'PLN', 'PLAINS': 'PLNS',
+    'PLAZA': 'PLZ', 'POINT': 'PT', 'POINTE': 'PT', 'PORT': 'PRT', 'PRAIRIE': 'PR', 'RANCH': 'RNCH',
+    'RIDGE': 'RDG', 'RIVER': 'RIV', 'ROAD': 'RD', 'ROUTE': 'RTE', 'SHORE': 'SHR', 'SHORES': 'SHRS',
+    'SPRING': 'SPG', 'SPRINGS': 'SPGS', 'SQUARE': 'SQ', 'STATION': 'STA', 'STREET': 'ST', 'STR': 'ST',
+    'SUMMIT': 'SMT', 'TERRACE': 'TER', 'TRACE': 'TRCE', 'TRAIL': 'TRL', 'TRAILS': 'TRL', 'TURNPIKE': 'TPKE',
+    'VALLEY': 'VLY', 'VIEW': 'VW', 'VILLAGE': 'VLG', 'VISTA': 'VIS', 'WALK': 'WALK', 'WAY': 'WAY',
+    'WELLS': 'WLS',
+}
+
+# USPS directional abbreviations
+DIRECTIONALS = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+    'N': 'N', 'S': 'S', 'E': 'E', 'W': 'W', 'NE': 'NE', 'NW': 'NW', 'SE': 'SE', 'SW': 'SW',
+}
+
+# USPS secondary unit designators (Publication 28, appendix C2)
+UNIT_DESIGNATORS = {
+    'APARTMENT': 'APT', 'APT': 'APT', 'BUILDING': 'BLDG', 'BLDG': 'BLDG', 'DEPARTMENT': 'DEPT', 'DEPT': 'DEPT',
+    'FLOOR': 'FL', 'FL': 'FL', 'HANGAR': 'HNGR', 'HNGR': 'HNGR', 'LOT': 'LOT', 'PIER': 'PIER', 'ROOM': 'RM',
+    'RM': 'RM', 'SLIP': 'SLIP', 'SPACE': 'SPC', 'SPC': 'SPC', 'STOP': 'STOP', 'SUITE': 'STE', 'STE': 'STE',
+    'TRAILER': 'TRLR', 'TRLR': 'TRLR', 'UNIT': 'UNIT', '#': '#',
+}
+
+# designators that also begin street names, e.g. "5 Pier Ave"
+STREET_NAME_DESIGNATORS = frozenset((
+    'FLOOR', 'FL', 'HANGAR', 'HNGR', 'LOT', 'PIER', 'SLIP', 'SPACE', 'SPC', 'STOP', 'TRAILER', 'TRLR',
+))
+
+# every spelling of a street suffix, full and abbreviated
+STREET_SUFFIX_WORDS = frozenset(STREET_SUFFIXES) | frozenset(STREET_SUFFIXES.values())
+
+ADDRESS_PUNCTUATION_RE = re.compile(r'[.,;:\'"()]')
+ZIP_CODE_RE = re.compile(r'\b(\d{5})(?:-?\d{4})?\s*$')
+
+
+def address_tokens(value):
+    """
+    Upper case words of an address line, with # split from unit numbers
+    :param value: string
+    :return: list of strings
+    """
+    value = ADDRESS_PUNCTUATION_RE.sub(' ', (value or '').upper()).replace('#', ' # ')
+    return value.split()
+
+
+def is_unit_designator(tokens, i):
+    """
+    Whether the word at i of an address line starts its unit.  Words
+    like PIER and SPACE also begin street names, e.g. "5 Pier Ave", so
+    they only count after the street: after its suffix or a post
+    directional, and not themselves followed by a street suffix.
+    Any other designator, APT, STE, # and so on, always starts the unit
+    :param tokens: list of strings
+    :param i: int
+    :return: bool
+    """
+    if i == 0 or i + 1 >= len(tokens) or tokens[i] not in UNIT_DESIGNATORS:
+        return False
+
+    if tokens[i] not in STREET_NAME_DESIGNATORS:
+        return True
+
+    before = tokens[i - 1]
+    after_street = before in STREET_SUFFIX_WORDS or (i > 2 and before in DIRECTIONALS)
+    return after_street and tokens[-1] not in STREET_SUFFIX_WORDS
+
+
+def standardize_street(address1, address2=None):
+    """
+    Standardize a street address the way USPS does: upper case,
+    no punctuation, abbreviated suffix, directionals and unit designator
+    A unit found on the first line, e.g. "12 Main St Apt 4", counts the
+    same as one on the second line
+    :param address1: string
+    :param address2: string
+    :return: tuple (street, unit designator, unit number)
+    """
+    tokens = address_tokens(address1)
+    unit = address_tokens(address2)
+
+    for i in range(1, len(tokens)):
+        if is_unit_designator(tokens, i):
+            tokens, unit = tokens[:i], tokens[i:] + unit
+            break
+
+    # the suffix is the last word, or the one before a post directional
+    last = len(tokens) - 1
+    if last > 1 and tokens[last] in DIRECTIONALS:
+        tokens[last] = DIRECTIONALS[tokens[last]]
+        last -= 1
+    if last > 0:
+        tokens[last] = STREET_SUFFIXES.get(tokens[last], tokens[last])
+    if len(tokens) > 2 and tokens[1] in DIRECTIONALS:
+        tokens[1] = DIRECTIONALS[tokens[1]]
+
+    designator = ''
+    if unit and unit[0] in UNIT_DESIGNATORS:
+        designator = UNIT_DESIGNATORS[unit[0]]
+        unit = unit[1:]
+    elif unit:
+        designator = '#'
+
+    return ' '.join(tokens), designator, ' '.join(token for token in unit if token != '#')
+
+
+def zip5(value):
+    """
+    The 5 digit zip code at the end of a zip, zip+4 or address line
+    :param value: string
+    :return: string or None
+    """
+    match = ZIP_CODE_RE.search(str(value or ''))
+    return match.group(1) if match else None
+
+
+def address_key(address1, address2, zip_code):
+    """
+    The indexed lookup key of an address, stored in IPData.addr_key
+    It hashes the standardized street, the unit number and the 5 digit
+    zip code.  Unit designators are left out, vendors and mailing lists
+    disagree on APT, UNIT and # far more often than on the number
+    :param address1: string
+    :param address2: string
+    :param zip_code: string zip or zip+4
+    :return: string sha1 hex or None
+    """
+    street, designator, unit = standardize_street(address1, address2)
+    zip_code = zip5(zip_code)
+
+    if not (street and zip_code):
+        return None
+
+    return hashlib.sha1('{}|{}|{}'.format(street, unit, zip_code).encode('utf-8')).hexdigest()
+
+
+def format_address(address1, address2=None, city=None, state=None, zip_code=None, zip_4=None):
+    """
+    The standardized one line form of an address, e.g.
+    "12 N MAIN ST APT 4, ORLANDO FL 32801-1234"
+    :return: string or None without a street
+    """
+    street, designator, unit = standardize_street(address1, address2)
+    if not street:
+        return None
+
+    if unit:
+        street = '{} {} {}'.format(street, designator, unit)
+
+    zip_code = zip5(zip_code)
+    if zip_code and zip_4:
+        zip_code = '{}-{:04d}'.format(zip_code, int(zip_4))
+
+    place = ' '.join(part for part in ((city or '').strip().upper(), (state or '').strip().upper(), zip_code) if part)
+    return '{}, {}'.format(street, place) if place else street
+
+
+def parse_address(value, zip_code=None):
+    """
+    Split a one line address, "12 Main St Apt 4, Orlando FL 32801",
+    into its street line and zip code.  The street ends at the first
+    comma and the zip code, unless given, ends the line
+    :param value: string
+    :param zip_code: string
+    :return: tuple (street line, zip code or None)
+    """
+    value = str(value or '')
+    street = value.split(',')[0]
+
+    if zip_code is None and ',' not in value:
+        # no city part, the street line may still end with a zip code
+        street = ZIP_CODE_RE.sub('', street)
+
+    return street.strip(), zip5(zip_code if zip_code is not None else value)
@@ -1,15 +1,26 @@
-from flask import Flask, Response, abort, request, jsonify, g, url_for, render_template, flash
+from flask import Flask, Response, abort, request, jsonify, g, url_for, render_template, flash, send_file, \
+    stream_with_context
 from flask_mail import Mail, Message
 from flask_sslify import SSLify
 from flask_sqlalchemy import SQLAlchemy
 from flask_httpauth import HTTPTokenAuth
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from sqlalchemy import exc, and_, desc
+from sqlalchemy import bindparam, event, exc, and_, or_, desc, func, tuple_
 from celery import Celery
-from datetime import datetime
+from kombu.exceptions import OperationalError as BrokerError
+from datetime import datetime, timedelta
 from db import db_session
-from models import User, IPData, APILog
+from models import User, IPData, IPDataDoc, APILog, AppendJob, DataVersion, AudienceSummary, UsageRollup, \
+    DOCUMENT_COLUMNS, DOCUMENT_PROFILES, SUMMARY_DIMENSIONS, ipdata_document, flatten_document, document_json, \
+    query_profile, name_key, zip_area, city_area
+from werkzeug.utils import secure_filename
 from twilio.rest import Client
+from access_log import AccessLogWriter, ROLLUP_PERIODS, bucket_start, prune
+from cache import LRUCache, RedisCache, TokenCache
+from address import address_key, format_address, parse_address
+from geo import bounding_box, cell_ranges, haversine
+from name_index import NameQuery, rank_candidates
+from phone_meta import PhoneMetaTable
 import config
 import json
 import random
@@ -17,8 +28,16 @@ import ipaddress
 import phonenumbers
 from phonenumbers import geocoder, carrier, timezone
 import hashlib
+import heapq
 import hmac
 import time
+import itertools
+import operator
+import csv
+import os
+import tempfile
+import uuid
+import base64
 
 
 # debug
@@ -28,7 +47,12 @@ debug = config.DEBUG
 app = Flask(__name__)
 # sslify = SSLify(app)
 app.config['SECRET_KEY'] = config.SECRET_KEY
-token_serializer = Serializer(app.config['SECRET_KEY'], expires_in=3600)
+
+# bearer tokens expire after token_expires_in seconds and stored tokens
+# are re-signed when they expire within token_refresh_window seconds
+token_expires_in = getattr(config, 'TOKEN_EXPIRES_IN', 3600)
+token_refresh_window = getattr(config, 'TOKEN_REFRESH_WINDOW', 600)
+token_serializer = Serializer(app.config['SECRET_KEY'], expires_in=token_expires_in)
 
 # Flask-Mail configuration
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
@@ -65,19 +89,151 @@ auth = HTTPTokenAuth('Bearer')
 # mailgun_api_key
 mailgun_api_key = config.MAILGUN_API_KEY
 
+# batch lookups: max items per request and max keys per IN (...) query
+api_batch_limit = getattr(config, 'API_BATCH_LIMIT', 10000)
+api_batch_chunk = getattr(config, 'API_BATCH_CHUNK', 1000)
+
+# append jobs: upload directory shared by the web and celery workers,
+# the hours a result file is kept after the job finishes, and
+# the default key column(s) and the access log resource of each type
+append_job_dir = getattr(config, 'APPEND_JOB_DIR', os.path.join(tempfile.gettempdir(), 'm3data_jobs'))
+append_job_retention_hours = getattr(config, 'APPEND_JOB_RETENTION_HOURS', 24)
+append_job_columns = {'ip': 'ip', 'sms': 'phone', 'name': 'first_name,last_name'}
+append_job_resources = {'ip': 'ipdata', 'sms': 'sms', 'name': 'name'}
+
+# max rows in one page of a subnet lookup
+cidr_limit = getattr(config, 'CIDR_LIMIT', 1000)
+
+# the largest radius of a radius search, and the radius of the first
+# ring searched for a page, doubled until the page is full
+radius_max_km = getattr(config, 'RADIUS_MAX_KM', 50)
+radius_ring_km = getattr(config, 'RADIUS_RING_KM', 1.0)
+
+# default and max page size of the multi-row lookups
+api_page_size = getattr(config, 'API_PAGE_SIZE', 100)
+api_page_limit = getattr(config, 'API_PAGE_LIMIT', 1000)
+
+# rows fetched per round trip from the server side cursor of an NDJSON stream
+api_stream_batch = getattr(config, 'API_STREAM_BATCH', 500)
+
+# buffered access log: rows are written by a background thread every
+# ACCESS_LOG_BATCH records or ACCESS_LOG_INTERVAL_MS, journaled in
+# ACCESS_LOG_SPILL_DIR until then, and spilled there when the database
+# is unavailable or ACCESS_LOG_MAX_QUEUE records are waiting
+access_log = AccessLogWriter(
+    db_session.get_bind(),
+    APILog.__table__,
+    rollup_table=UsageRollup.__table__,
+    batch_size=getattr(config, 'ACCESS_LOG_BATCH', 500),
+    interval=getattr(config, 'ACCESS_LOG_INTERVAL_MS', 1000) / 1000.0,
+    spill_dir=getattr(config, 'ACCESS_LOG_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'm3data_access_log')),
+    max_queue=getattr(config, 'ACCESS_LOG_MAX_QUEUE', 100000)
+)
+
+# usage reports: the length and default report span of each rollup
+# period, the max buckets per report, and the retention windows of the
+# raw log and the minute and hour rollups in days.  Day rollups are kept
+usage_periods = {
+    'minute': (timedelta(minutes=1), timedelta(hours=2)),
+    'hour': (timedelta(hours=1), timedelta(days=2)),
+    'day': (timedelta(days=1), timedelta(days=31)),
+}
+usage_max_buckets = getattr(config, 'USAGE_MAX_BUCKETS', 5000)
+log_retention_days = getattr(config, 'LOG_RETENTION_DAYS', 90)
+usage_rollup_retention_days = getattr(config, 'USAGE_ROLLUP_RETENTION_DAYS', {'minute': 2, 'hour': 90})
+
+# verified bearer tokens, held until they expire or for at most
+# TOKEN_CACHE_TTL seconds, which bounds how long another process
+# keeps accepting the tokens of a deactivated user
+token_cache = TokenCache(
+    maxsize=getattr(config, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(config, 'TOKEN_CACHE_TTL', 300)
+)
+
+# phone metadata by NPA-NXX, built with `python phone_meta.py`
+# numbers not in the table, or without one, use the phonenumbers library
+phone_meta = PhoneMetaTable.load(
+    getattr(config, 'PHONE_META_PATH', os.path.join(tempfile.gettempdir(), 'm3data_phone_meta.pickle'))
+)
+
+# fuzzy name matching: the candidate rows read per name, the time spent
+# scoring them, the time spent fuzzy matching the names of one batch
+# request, the lowest score returned and the max candidates returned
+name_match_candidates = getattr(config, 'NAME_MATCH_CANDIDATES', 2000)
+name_match_budget = getattr(config, 'NAME_MATCH_BUDGET_MS', 50) / 1000.0
+name_match_batch_budget = getattr(config, 'NAME_MATCH_BATCH_BUDGET_MS', 5000) / 1000.0
+name_match_min_score = getattr(config, 'NAME_MATCH_MIN_SCORE', 0.6)
+name_match_limit = getattr(config, 'NAME_MATCH_LIMIT', 25)
+
+# response cache of the single ip and sms lookups, keyed by the exploded
+# IP address or E.164 number.  "No data found" responses are cached for
+# a shorter time.  The cache is cleared when the importer bumps the data
+# version, which is checked at most every data_version_interval seconds
+lookup_cache = LRUCache(
+    maxsize=getattr(config, 'LOOKUP_CACHE_SIZE', 10000),
+    ttl=getattr(config, 'LOOKUP_CACHE_TTL', 300)
+)
+lookup_cache_negative_ttl = getattr(config, 'LOOKUP_CACHE_NEGATIVE_TTL', 60)
+data_version_interval = getattr(config, 'DATA_VERSION_INTERVAL', 30)
+data_version = {'version': None, 'checked': 0}
+
+# serve the pre-rendered append documents built by converter.py --build-docs
+response_docs = getattr(config, 'RESPONSE_DOCS', False)
+
+# optional redis cache shared by every WSGI process behind lookup_cache
+# redis keys carry the data version and a cold key is filled only once
+shared_cache = None
+if getattr(config, 'REDIS_URL', None):
+    shared_cache = RedisCache.from_url(
+        config.REDIS_URL,
+        prefix=getattr(config, 'REDIS_CACHE_PREFIX', 'm3data'),
+        ttl=lookup_cache.ttl,
+        negative_ttl=lookup_cache_negative_ttl,
+        lock_timeout=getattr(config, 'REDIS_LOCK_TIMEOUT', 5)
+    )
+
 
 @auth.verify_token
 def verify_token(token):
+    """
+    Verify a bearer token, from the token cache when it was verified
+    before.  The signature of a new token is checked and its user must
+    still be active
+    :param token: string
+    :return: bool
+    """
     g.user = None
-    try:
-        data = token_serializer.loads(token)
-    except Exception:
-        return False
-    if 'username' in data:
-        g.user = data['username']
-        g.user_id = data['user_id']
-        return True
-    return False
+    identity = token_cache.get(token)
+
+    if identity is None:
+        try:
+            data, header = token_serializer.loads(token, return_header=True)
+        except Exception:
+            return False
+        if 'username' not in data:
+            return False
+
+        try:
+            active = db_session.query(User.active).filter(User.id == data['user_id']).scalar()
+        except exc.SQLAlchemyError:
+            return False
+        if not active:
+            return False
+
+        identity = (data['username'], data['user_id'])
+        token_cache.set(token, identity, header.get('exp', 0))
+
+    g.user, g.user_id = identity
+    return True
+
+
+@event.listens_for(User.active, 'set')
+def revoke_user_tokens(user, value, oldvalue, initiator):
+    """
+    Stop accepting the cached tokens of a user as soon as it is deactivated
+    """
+    if not value and user.id is not None:
+        token_cache.revoke(user.id)
 
 
 # clear all db sessions at the end of each request
@@ -113,6 +269,199 @@ def multiply():
     return x * y
 
 
+@celery.task()
+def run_append_job(job_id):
+    """
+    Background task to enrich an uploaded list against ipdata
+    The file is streamed and resolved in chunks with the batch
+    lookups, and progress is committed after every chunk.  The
+    upload is deleted when the job finishes, and the result file
+    by expire_append_jobs after the retention period
+    :param job_id: string
+    :return: matched rows
+    """
+    with app.app_context():
+        job = db_session.query(AppendJob).get(job_id)
+        if job is None:
+            return None
+
+        lookups = {'ip': lookup_ips, 'sms': lookup_phones, 'name': lookup_names}
+        key_columns = job.key_columns.split(',')
+
+        try:
+            job.status = 'running'
+            # count records the way they are read, quoted fields may span lines
+            with open(job.input_path, 'r', newline='', encoding='utf-8', errors='replace') as f1:
+                job.total_rows = sum(1 for row in csv.DictReader(f1))
+            db_session.commit()
+
+            with open(job.input_path, 'r', newline='', encoding='utf-8', errors='replace') as f1, \
+                    open(job.output_path, 'w', newline='', encoding='utf-8') as f2:
+                reader = csv.DictReader(f1)
+                writer = csv.writer(f2)
+                fieldnames = reader.fieldnames or []
+
+                missing = [name for name in key_columns if name not in fieldnames]
+                if missing:
+                    raise ValueError('Missing column(s): {}'.format(', '.join(missing)))
+
+                # appended columns are prefixed so they never collide with the upload
+                writer.writerow(fieldnames + ['m3_match'] + ['m3_{}'.format(name) for name in DOCUMENT_COLUMNS])
+
+                for rows in chunks(reader, api_batch_chunk):
+                    keys = [append_job_key(job.kind, key_columns, row) for row in rows]
+                    matches = lookups[job.kind](key for key in keys if key)
+                    matched = 0
+
+                    for row, key in zip(rows, keys):
+                        data = matches.get(key) if key else None
+                        values = [row.get(name) for name in fieldnames]
+                        if data:
+                            writer.writerow(values + [1] + flatten_document(ipdata_document(data)))
+                            matched += 1
+                        else:
+                            writer.writerow(values + [0])
+
+                    job.processed_rows += len(rows)
+                    job.matched_rows += matched
+                    db_session.commit()
+
+            job.status = 'complete'
+
+            if job.matched_rows:
+                write_log(job.user_id, append_job_resources[job.kind], job.matched_rows)
+
+        except (IOError, ValueError, csv.Error, exc.SQLAlchemyError) as err:
+            db_session.rollback()
+            job.status = 'failed'
+            job.error = str(err)
+            print('Append job {} failed: {}'.format(job_id, str(err)))
+            remove_file(job.output_path)
+
+        remove_file(job.input_path)
+        job.finished_date = datetime.now()
+        db_session.commit()
+        matched_rows = job.matched_rows
+        db_session.remove()
+
+        return matched_rows
+
+
+@celery.task()
+def refresh_expiring_tokens():
+    """
+    Re-sign the stored tokens of active users that expire within the
+    refresh window.  The new tokens are written with one executemany
+    UPDATE per batch of users and committed once.  Run by celery beat
+    :return: int tokens refreshed
+    """
+    cutoff = datetime.now() - timedelta(seconds=token_expires_in - token_refresh_window)
+    users = User.__table__
+    statement = users.update().where(users.c.id == bindparam('user_id')).values(
+        token=bindparam('new_token'),
+        token_last_update=bindparam('updated')
+    )
+    refreshed = 0
+
+    try:
+        expiring = db_session.query(User.id, User.username).filter(
+            User.active == 1,
+            User.token.isnot(None),
+            User.token_last_update < cutoff
+        ).order_by(User.id).all()
+
+        updated = datetime.now()
+        for batch in chunks(expiring, api_batch_chunk):
+            db_session.execute(statement, [
+                {'user_id': row.id, 'new_token': sign_token(row.id, row.username), 'updated': updated}
+                for row in batch
+            ])
+            refreshed += len(batch)
+
+        db_session.commit()
+        print('Refreshed {} tokens.'.format(refreshed))
+
+    except exc.SQLAlchemyError as err:
+        db_session.rollback()
+        refreshed = 0
+        print('Database error updating tokens: {}'.format(str(err)))
+
+    finally:
+        db_session.remove()
+
+    return refreshed
+
+
+@celery.task()
+def prune_access_log():
+    """
+    Delete the access log rows and the minute and hour usage rollups
+    past their retention windows.  Run hourly by celery beat
+    :return: dict of deleted row counts
+    """
+    now = datetime.now()
+    deleted = dict()
+
+    try:
+        deleted = prune(
+            db_session.get_bind(),
+            APILog.__table__,
+            UsageRollup.__table__,
+            now - timedelta(days=log_retention_days),
+            dict((period, now - timedelta(days=days)) for period, days in usage_rollup_retention_days.items())
+        )
+        print('Pruned access log: {}'.format(', '.join('{} {}'.format(count, name) for name, count in deleted.items())))
+
+    except exc.SQLAlchemyError as db_err:
+        print('Database error pruning the access log: {}'.format(str(db_err)))
+
+    return deleted
+
+
+@celery.task()
+def expire_append_jobs():
+    """
+    Delete the result files of the append jobs that finished more
+    than the retention period ago and mark the jobs expired.  Run
+    hourly by celery beat
+    :return: int jobs expired
+    """
+    cutoff = datetime.now() - timedelta(hours=append_job_retention_hours)
+    expired = 0
+
+    try:
+        jobs = db_session.query(AppendJob).filter(
+            AppendJob.status.in_(('complete', 'failed')),
+            AppendJob.finished_date < cutoff
+        ).all()
+
+        for job in jobs:
+            remove_file(job.input_path)
+            remove_file(job.output_path)
+            job.status = 'expired'
+            expired += 1
+
+        db_session.commit()
+        print('Expired {} append jobs.'.format(expired))
+
+    except exc.SQLAlchemyError as db_err:
+        db_session.rollback()
+        expired = 0
+        print('Database error expiring append jobs: {}'.format(str(db_err)))
+
+    finally:
+        db_session.remove()
+
+    return expired
+
+
+celery.conf.beat_schedule = {
+    'prune-access-log': {'task': prune_access_log.name, 'schedule': 3600.0},
+    'expire-append-jobs': {'task': expire_append_jobs.name, 'schedule': 3600.0},
+    'refresh-expiring-tokens': {'task': refresh_expiring_tokens.name, 'schedule': token_refresh_window / 2.0}
+}
+
+
 '''
 ******************************
 ********* Web Pages **********
@@ -215,12 +564,75 @@ def contact():
 def login():
     """
     Template for Login page
+    POST the username (or email) and password, as JSON or a form,
+    for a bearer token
     :return:
     """
-    return render_template(
-        'login.html',
-        today=get_date()
-    )
+    if request.method == 'GET':
+        return render_template(
+            'login.html',
+            today=get_date()
+        )
+
+    credentials = request.get_json(silent=True)
+    if not isinstance(credentials, dict):
+        credentials = request.form
+
+    username = credentials.get('username')
+    password = credentials.get('password')
+
+    if not (isinstance(username, str) and isinstance(password, str) and username and password):
+        resp = {"Invalid Login": "A username and password are required"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    try:
+        user = db_session.query(User).filter(or_(User.username == username, User.email == username)).first()
+
+        if user is None or not user.active or not user.check_password(password):
+            if user is not None:
+                user.fail_login_count = (user.fail_login_count or 0) + 1
+                db_session.commit()
+
+            resp = {"Invalid Login": "Unknown user or wrong password"}
+            return Response(json.dumps(resp), status=401, mimetype='application/json')
+
+        user.last_login = datetime.now()
+        user.login_count = (user.login_count or 0) + 1
+        token, expires = user_token(user)
+        db_session.commit()
+
+    except exc.SQLAlchemyError as db_err:
+        db_session.rollback()
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    return jsonify(token_response(token, expires)), 200
+
+
+@app.route('/api/v1.0/auth/refresh', methods=['POST'])
+@auth.login_required
+def refresh_token():
+    """
+    A new bearer token for the authenticated user
+    The current token stays valid until it expires
+    :return: dict, type(json)
+    """
+    try:
+        user = db_session.query(User).get(g.user_id)
+
+        if user is None or not user.active:
+            resp = {"Invalid Login": "Unknown or inactive user"}
+            return Response(json.dumps(resp), status=401, mimetype='application/json')
+
+        token, expires = user_token(user, reuse=False)
+        db_session.commit()
+
+    except exc.SQLAlchemyError as db_err:
+        db_session.rollback()
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    return jsonify(token_response(token, expires)), 200
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -265,13 +677,25 @@ def index():
     """
     api_routes = dict()
     api_routes['login'] = '/api/v1.0/auth/login'
+    api_routes['refresh'] = '/api/v1.0/auth/refresh'
     api_routes['ipaddr'] = '/api/v1.0/ipaddr/<string:ip_addr>'
+    api_routes['ipaddr_batch'] = '/api/v1.0/ipaddr/batch'
+    api_routes['cidr'] = '/api/v1.0/cidr/<path:network>'
     api_routes['sms'] = '/api/v1.0/sms/<string:sms_number>'
+    api_routes['sms_batch'] = '/api/v1.0/sms/batch'
     api_routes['addr'] = '/api/v1.0/addr/<string:addr>'
+    api_routes['addr_batch'] = '/api/v1.0/addr/batch'
     api_routes['latlng'] = '/api/v1.0/lat/<string:lat>/lng/<string:lng>'
+    api_routes['radius'] = '/api/v1.0/lat/<string:lat>/lng/<string:lng>/radius/<string:km>'
     api_routes['name'] = '/api/v1.0/name/first/<string:f_name>/last/<string:l_name>'
+    api_routes['name_batch'] = '/api/v1.0/name/batch'
     api_routes['zipcode'] = '/api/v1.0/zipcode/<string:zip_code>'
     api_routes['city'] = '/api/v1.0/city/<string:city_name>/limit/<int:limit>'
+    api_routes['jobs'] = '/api/v1.0/jobs'
+    api_routes['job_status'] = '/api/v1.0/jobs/<string:job_id>'
+    api_routes['job_result'] = '/api/v1.0/jobs/<string:job_id>/result'
+    api_routes['cache'] = '/api/v1.0/cache'
+    api_routes['usage'] = '/api/v1.0/usage'
 
     # return the response
     return render_template(
@@ -294,81 +718,14 @@ def get_ip_data(ip_addr):
     if request.method == 'GET':
 
         try:
-            ip_address = ipaddress.IPv4Address(ip_addr)
+            ip_address = ipaddress.ip_address(ip_addr)
+            sections = read_fields()
 
             try:
-                data = db_session.query(IPData).filter(IPData.ip == ip_address).first()
-
-                if data:
-
-                    # write the access log
-                    try:
-                        write_log(g.user_id, 'ipdata')
-                    except Exception as e:
-                        print('Error writing log...')
-
-                    # return a successful response
-                    return jsonify({
-                        'created_date': data.created_date,
-                        'last_seen': data.last_seen,
-                        'ip': data.ip,
-                        'person': {
-                            'first_name': data.first_name,
-                            'last_name': data.last_name,
-                            'address1': data.address1,
-                            'address2': data.address2,
-                            'city': data.city,
-                            'state': data.state.upper(),
-                            'zip_code': data.zip_code,
-                            'home_phone': data.home_phone,
-                            'cell_phone': data.cell_phone,
-                            'birth_year': data.birth_year,
-                            'credit_range': data.credit_range,
-                            'income_range': data.income_range,
-                            'home_owner_renter': data.home_owner_renter
-                        },
-                        'geo': {
-                            'latitude': data.latitude,
-                            'longitude': data.longitude,
-                            'time_zone': data.time_zone,
-                            'metro_code': data.metro_code,
-                            'country_name': data.country_name,
-                            'country_code': data.country_code,
-                            'country_code3': data.country_code3,
-                            'dma_code': data.dma_code,
-                            'area_code': data.area_code,
-                            'region': data.region,
-                            'region_name': data.region_name
-                        },
-                        'auto': {
-                            'car_year': data.car_year,
-                            'car_make': data.car_make,
-                            'car_model': data.car_model,
-                            'ppm_type': data.ppm_type,
-                            'ppm_indicator': data.ppm_indicator,
-                            'ppm_segment': data.ppm_segment,
-                            'auto_trans_date': data.auto_trans_date,
-                            'auto_purchase_type': data.auto_purchase_type
-                        },
-                        'network': {
-                            'ip_address': ip_address.exploded,
-                            'ip_version': ip_address.version,
-                            'compressed': ip_address.compressed,
-                            'exploded': ip_address.exploded,
-                            'reverse': ip_address.reverse_pointer,
-                            'multicast': ip_address.is_multicast,
-                            'private': ip_address.is_private,
-                            'global': ip_address.is_global,
-                            'loopback': ip_address.is_loopback,
-
-                        }
-                    }), 200
-
-                # return no data found for IP
-                else:
-                    resp = {"Response": "No data found for IP: {}".format(str(ip_address.exploded))}
-                    data = json.dumps(resp)
-                    return Response(data, status=200, mimetype='application/json')
+                found, data = cached_response(
+                    'ip:' + ip_address.exploded + fields_key(sections),
+                    lambda: ip_response(ip_address, find_document(sections, ip_criteria(ip_address)), sections)
+                )
 
             # database exception
             except exc.SQLAlchemyError as err:
@@ -376,8 +733,18 @@ def get_ip_data(ip_addr):
                 data = json.dumps(resp)
                 return Response(data, status=500, mimetype='application/json')
 
+            # write the access log
+            if found:
+                try:
+                    write_log(g.user_id, 'ipdata')
+                except Exception as e:
+                    print('Error writing log...')
+
+            # return the response
+            return Response(data, status=200, mimetype='application/json')
+
         # catch ip address formatting error
-        except ipaddress.AddressValueError as address_error:
+        except ValueError as address_error:
             resp = {"Invalid IP Address Format": str(address_error)}
             data = json.dumps(resp)
             return Response(data, status=201, mimetype='application/json')
@@ -389,6 +756,122 @@ def get_ip_data(ip_addr):
         return Response(data, status=405, mimetype='application/json')
 
 
+@app.route('/api/v1.0/ipaddr/batch', methods=['POST'])
+@auth.login_required
+def get_ip_batch_data():
+    """
+    Append data to a list of IP Addresses
+    Accepts a JSON list, {"ips": [...]} or NDJSON with one IP per line
+    Cached responses are used first, the rest are resolved in bulk
+    Return the results in input order
+    :return: list(obj(Person)), type(json)
+    """
+    ips = read_batch_input('ips', 'ip')
+    sections = read_fields()
+    suffix = fields_key(sections)
+
+    if ips is None:
+        resp = {"Invalid Batch": "Expected a JSON list, {\"ips\": [...]} or NDJSON"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    if len(ips) > api_batch_limit:
+        resp = {"Batch Too Large": "Limit is {} items per request".format(api_batch_limit)}
+        return Response(json.dumps(resp), status=413, mimetype='application/json')
+
+    # parse every input once
+    addresses = []
+    for ip_addr in ips:
+        try:
+            addresses.append(ipaddress.ip_address(str(ip_addr).strip()))
+        except ValueError:
+            addresses.append(None)
+
+    keys = dict((address, 'ip:' + address.exploded + suffix) for address in addresses if address)
+
+    try:
+        entries = cached_responses(set(keys.values()))
+        missing = [address for address, key in keys.items() if key not in entries]
+        matches = lookup_ips(missing, sections)
+
+    except exc.SQLAlchemyError as err:
+        resp = {"Database Error": str(err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    # cache the responses resolved from the database
+    filled = dict()
+    for address in missing:
+        filled[keys[address]] = ip_response(address, matches.get(address), sections)
+    cache_responses(filled)
+    entries.update(filled)
+
+    results = []
+    matched = 0
+
+    for ip_addr, address in zip(ips, addresses):
+        if address is None:
+            results.append({'input': ip_addr, 'match': False, 'error': 'Invalid IP Address Format'})
+            continue
+
+        found, data = entries[keys[address]]
+        if found:
+            results.append({'input': ip_addr, 'match': True, 'data': json.loads(data)})
+            matched += 1
+        else:
+            results.append({'input': ip_addr, 'match': False})
+
+    # write one access log entry per match in a single insert
+    if matched:
+        try:
+            write_log(g.user_id, 'ipdata', matched)
+        except Exception as e:
+            print('Error writing log...')
+
+    return jsonify({
+        'count': len(results),
+        'matched': matched,
+        'results': results
+    }), 200
+
+
+@app.route('/api/v1.0/cidr/<path:network>', methods=['GET'])
+@auth.login_required
+def get_cidr_data(network):
+    """
+    Append data to every visitor in a subnet, e.g. /cidr/10.1.0.0/16
+    The subnet is one index range scan on the integer or binary IP
+    and the rows are returned in address order, paged with ?limit=
+    and ?cursor=, or streamed as NDJSON with ?format=ndjson
+    :param: string: network
+    :return: list(obj(Person)), type(json)
+    """
+    try:
+        subnet = ipaddress.ip_network(network, strict=False)
+        limit = read_limit(cidr_limit, cidr_limit)
+        cursor = read_cursor(2)
+
+    except ValueError as err:
+        resp = {"Invalid Network": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    sections = read_fields()
+
+    if subnet.version == 4:
+        column, first, last = IPData.ip_int, int(subnet.network_address), int(subnet.broadcast_address)
+    else:
+        column, first, last = IPData.ip6, subnet.network_address.packed, subnet.broadcast_address.packed
+
+    query = query_profile(db_session, sections, (column.key, 'id')).filter(column.between(first, last))
+
+    try:
+        return paged_response(query, (column, IPData.id), cursor, limit, sections, 'cidr', {
+            'network': subnet.with_prefixlen
+        })
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+
 @app.route('/api/v1.0/sms/<string:phone_number>', methods=['GET'])
 @auth.login_required
 def get_sms_data(phone_number):
@@ -398,98 +881,39 @@ def get_sms_data(phone_number):
     :param: string: phone_number
     :return: obj(Person), type(json)
     """
-    geo, carrier, time_zone, city_geocode = range(4)
 
     try:
         phone = phonenumbers.parse('+1' + phone_number, None)
 
         if phone:
-
-            # check the phone number geocoder
-            geo = geocode_phone_number(str(phone.national_number))
-
-            if geo:
-                carrier = geo['carrier']
-                time_zone = geo['timezone']
-                city_geocode = geo['geocode']
+            sections = read_fields()
 
             try:
-                data = db_session.query(IPData).filter(
-                    IPData.cell_phone == phone.national_number
-                ).first()
-
-                if data:
-
-                    # write the access log
-                    try:
-                        write_log(g.user_id, 'sms')
-                    except Exception as e:
-                        print('Error writing log...')
-
-                    # return a successful response
-                    return jsonify({
-                        'created_date': data.created_date,
-                        'sms_match': '+1' + str(data.cell_phone),
-                        'verified': True,
-                        'last_seen': data.last_seen,
-                        'ip': data.ip,
-                        'person': {
-                            'first_name': data.first_name,
-                            'last_name': data.last_name,
-                            'address1': data.address1,
-                            'address2': data.address2,
-                            'city': data.city,
-                            'state': data.state.upper(),
-                            'zip_code': data.zip_code,
-                            'home_phone': data.home_phone,
-                            'cell_phone': data.cell_phone,
-                            'birth_year': data.birth_year,
-                            'credit_range': data.credit_range,
-                            'income_range': data.income_range,
-                            'home_owner_renter': data.home_owner_renter
-                        },
-                        'geo': {
-                            'latitude': data.latitude,
-                            'longitude': data.longitude,
-                            'time_zone': data.time_zone,
-                            'metro_code': data.metro_code,
-                            'country_name': data.country_name,
-                            'country_code': data.country_code,
-                            'country_code3': data.country_code3,
-                            'dma_code': data.dma_code,
-                            'area_code': data.area_code,
-                            'region': data.region,
-                            'region_name': data.region_name
-                        },
-                        'auto': {
-                            'car_year': data.car_year,
-                            'car_make': data.car_make,
-                            'car_model': data.car_model,
-                            'ppm_type': data.ppm_type,
-                            'ppm_indicator': data.ppm_indicator,
-                            'ppm_segment': data.ppm_segment,
-                            'auto_trans_date': data.auto_trans_date,
-                            'auto_purchase_type': data.auto_purchase_type
-                        },
-                        'phone_network': {
-                            'number': '+1' + str(phone.national_number),
-                            'carrier': carrier,
-                            'timezone': time_zone,
-                            'city': city_geocode
-                        }
-                    }), 200
-
-                # phone number not found
-                else:
-                    resp = {"Number Not Found": '+1' + str(phone.national_number), 'GeoData': geo}
-                    data = json.dumps(resp)
-                    return Response(data, status=200, mimetype='application/json')
+                found, data = cached_response(
+                    'sms:+1' + str(phone.national_number) + fields_key(sections),
+                    lambda: sms_response(
+                        phone.national_number,
+                        phone_metadata(phone),
+                        find_document(sections, phone_criteria(phone)),
+                        sections
+                    )
+                )
 
             except exc.SQLAlchemyError as db_err:
                 resp = {"Database Error": str(db_err)}
                 data = json.dumps(resp)
                 return Response(data, status=500, mimetype='application/json')
 
+            # write the access log
+            if found:
+                try:
+                    write_log(g.user_id, 'sms')
+                except Exception as e:
+                    print('Error writing log...')
+
+            # return the response
+            return Response(data, status=200, mimetype='application/json')
+
         # phone number parser returned False
         else:
             resp = {"Unidentifiable Phone Number:": str(phone_number)}
@@ -502,246 +926,1842 @@ def get_sms_data(phone_number):
         return Response(data, status=400, mimetype='application/json')
 
 
-@app.route('/api/v1.0/lat/<string:lat>/lng/<string:lng>', methods=['GET'])
+@app.route('/api/v1.0/sms/batch', methods=['POST'])
 @auth.login_required
-def get_location_data(lat, lng):
+def get_sms_batch_data():
     """
-    Append data to latitude and longitude
-    Return the Person obj by latitude and longitude
-    :param: string: lat (float), lng (float)
-    :return: obj(Person), type(json)
+    Append data to a list of Mobile Numbers
+    Accepts a JSON list, {"numbers": [...]} or NDJSON with one number per line
+    Each distinct number is parsed once, cached responses are used first
+    and the rest are geocoded once and resolved in bulk
+    Return the results in input order
+    :return: list(obj(Person)), type(json)
     """
+    numbers = read_batch_input('numbers', 'number')
+    sections = read_fields()
+    suffix = fields_key(sections)
 
-    persons = []
-
-    try:
-        lat = float(lat)
-        lng = float(lng)
+    if numbers is None:
+        resp = {"Invalid Batch": "Expected a JSON list, {\"numbers\": [...]} or NDJSON"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
 
-        try:
-            location = db_session.query(IPData).filter(
-                IPData.latitude == lat,
-                IPData.longitude == lng
-            ).all()
+    if len(numbers) > api_batch_limit:
+        resp = {"Batch Too Large": "Limit is {} items per request".format(api_batch_limit)}
+        return Response(json.dumps(resp), status=413, mimetype='application/json')
 
-            if location:
+    # parse each distinct input once
+    parsed = dict()
+    phones = dict()
 
-                for rec in location:
-                    persons.append(rec)
+    for number in numbers:
+        key = str(number).strip()
+        if key in parsed:
+            continue
 
-                resp = {"Data found for location": persons}
-                data = json.dumps(resp, default=convert_datetime_object)
-                return Response(data, status=200, mimetype='application/json')
+        try:
+            phone = phonenumbers.parse('+1' + key, None)
+            parsed[key] = phone.national_number
+            phones.setdefault(phone.national_number, phone)
+        except phonenumbers.NumberParseException as npe:
+            parsed[key] = npe
 
-            else:
-                resp = {"No data matching": "Lat: {} Lng: {}".format(str(lat), str(lng))}
-                data = json.dumps(resp)
-                return Response(data, status=200, mimetype='application/json')
+    keys = dict((national_number, 'sms:+1' + str(national_number) + suffix) for national_number in phones)
 
-        except exc.SQLAlchemyError as err:
-            resp = {"Database Error": str(err)}
-            data = json.dump(resp)
-            return Response(data, status=500, mimetype='application/json')
+    try:
+        entries = cached_responses(keys.values())
+        missing = [national_number for national_number, key in keys.items() if key not in entries]
+        matches = lookup_phones((str(national_number) for national_number in missing), sections)
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    # geocode and cache the responses resolved from the database
+    filled = dict()
+    for national_number in missing:
+        filled[keys[national_number]] = sms_response(
+            national_number, phone_metadata(phones[national_number]), matches.get(str(national_number)), sections
+        )
+    cache_responses(filled)
+    entries.update(filled)
+
+    results = []
+    matched = 0
+
+    for number in numbers:
+        national_number = parsed[str(number).strip()]
+
+        if isinstance(national_number, phonenumbers.NumberParseException):
+            results.append({'input': number, 'match': False, 'error': str(national_number)})
+            continue
+
+        found, data = entries[keys[national_number]]
+        resp = json.loads(data)
+
+        if found:
+            results.append({'input': number, 'match': True, 'data': resp})
+            matched += 1
+        else:
+            results.append({
+                'input': number,
+                'match': False,
+                'phone_network': phone_network(national_number, resp['GeoData'])
+            })
+
+    # write one access log entry per match in a single insert
+    if matched:
+        try:
+            write_log(g.user_id, 'sms', matched)
+        except Exception as e:
+            print('Error writing log...')
 
-    except TypeError as type_err:
-        resp = {"Error": str(type_err)}
-        data = json.dumps(resp)
-        return Response(data, status=400, mimetype='application/json')
+    return jsonify({
+        'count': len(results),
+        'matched': matched,
+        'results': results
+    }), 200
 
 
-@app.route('/api/v1.0/first/<string:f_name>/last/<string:l_name>', methods=['GET'])
+@app.route('/api/v1.0/addr/<string:addr>', methods=['GET'])
 @auth.login_required
-def get_name_data(f_name, l_name):
+def get_addr_data(addr):
     """
-    Append data to Person first_name and last_name
-    Return the Person obj by first name and last name
-    :param: string: f_name (string), l_name (string>
+    Append data to a street address
+    Return the Person obj at the standardized address.  The address is
+    one line, "12 Main St Apt 4, Orlando FL 32801", or the street line
+    with ?zip=.  One probe of the addr_key index
+    :param: string: addr
     :return: obj(Person), type(json)
     """
+    street, zip_code = parse_address(addr, request.args.get('zip'))
+    key = address_key(street, None, zip_code)
+
+    if key is None:
+        resp = {"Invalid Address": "A street address and a 5 digit zip code are required"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    sections = read_fields()
 
     try:
-        first = str(f_name)
-        last = str(l_name)
+        found, data = cached_response(
+            'addr:' + key + fields_key(sections),
+            lambda: addr_response(
+                format_address(street, zip_code=zip_code), find_document(sections, IPData.addr_key == key), sections
+            )
+        )
 
-        try:
-            data = db_session.query(IPData).filter(
-                IPData.first_name == first,
-                IPData.last_name == last
-            ).first()
-
-            if data:
-                # return a successful response
-                return jsonify({
-                    'created_date': data.created_date,
-                    'last_seen': data.last_seen,
-                    'ip': data.ip,
-                    'person': {
-                        'first_name': data.first_name,
-                        'last_name': data.last_name,
-                        'address1': data.address1,
-                        'address2': data.address2,
-                        'city': data.city,
-                        'state': data.state.upper(),
-                        'zip_code': data.zip_code,
-                        'home_phone': data.home_phone,
-                        'cell_phone': data.cell_phone,
-                        'birth_year': data.birth_year,
-                        'credit_range': data.credit_range,
-                        'income_range': data.income_range,
-                        'home_owner_renter': data.home_owner_renter
-                    },
-                    'geo': {
-                        'latitude': data.latitude,
-                        'longitude': data.longitude,
-                        'time_zone': data.time_zone,
-                        'metro_code': data.metro_code,
-                        'country_name': data.country_name,
-                        'country_code': data.country_code,
-                        'country_code3': data.country_code3,
-                        'dma_code': data.dma_code,
-                        'area_code': data.area_code,
-                        'region': data.region,
-                        'region_name': data.region_name
-                    },
-                    'auto': {
-                        'car_year': data.car_year,
-                        'car_make': data.car_make,
-                        'car_model': data.car_model,
-                        'ppm_type': data.ppm_type,
-                        'ppm_indicator': data.ppm_indicator,
-                        'ppm_segment': data.ppm_segment,
-                        'auto_trans_date': data.auto_trans_date,
-                        'auto_purchase_type': data.auto_purchase_type
-                    }
-                }), 200
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
 
-            else:
-                resp = {"No data found": str(f_name) + ' ' + str(l_name)}
-                data = json.dumps(resp)
-                return Response(data, status=200, mimetype='application/json')
+    # write the access log
+    if found:
+        try:
+            write_log(g.user_id, 'addr')
+        except Exception as e:
+            print('Error writing log...')
 
-        except exc.SQLAlchemyError as db_err:
-            resp = {"Database Error": str(db_err)}
-            data = json.dumps(resp, default=convert_datetime_object)
-            return Response(data, status=500, mimetype='application/json')
+    return Response(data, status=200, mimetype='application/json')
 
-    except TypeError as e:
-        return Response(e, status=400, mimetype='application/json')
 
+@app.route('/api/v1.0/addr/batch', methods=['POST'])
+@auth.login_required
+def get_addr_batch_data():
+    """
+    Append data to a mailing list of street addresses
+    Accepts a JSON list, {"addresses": [...]} or NDJSON with one address
+    per line.  An address is a one line string or an object with
+    address1, optional address2 and zip_code.  Each distinct address
+    is standardized once, cached responses are used first and the rest
+    are resolved in bulk on the addr_key index
+    Return the results in input order
+    :return: list(obj(Person)), type(json)
+    """
+    items = read_batch_input('addresses', None)
+    sections = read_fields()
+    suffix = fields_key(sections)
 
-'''
-******************************
-***** Utility Functions *****
-******************************
-'''
+    if items is None:
+        resp = {"Invalid Batch": "Expected a JSON list, {\"addresses\": [...]} or NDJSON"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
 
+    if len(items) > api_batch_limit:
+        resp = {"Batch Too Large": "Limit is {} items per request".format(api_batch_limit)}
+        return Response(json.dumps(resp), status=413, mimetype='application/json')
 
-@app.before_first_request
-def create_user_tokens():
-    # write the user tokens to the appropriate db fields
-    counter = 0
+    # the addr_key and standardized form of each input
+    parsed = [batch_address(item) for item in items]
+    addresses = dict((addr_key, standardized) for addr_key, standardized in parsed if addr_key)
+    keys = dict((addr_key, 'addr:' + addr_key + suffix) for addr_key in addresses)
 
     try:
-        users = db_session.query(User).filter(
-            User.active == 1
-        ).all()
+        entries = cached_responses(keys.values())
+        missing = [addr_key for addr_key, key in keys.items() if key not in entries]
+        matches = lookup_rows(IPData.addr_key, missing, ('addr_key',), sections)
 
-        for user in users:
-            token = token_serializer.dumps({'username': user.username, 'user_id': user.id}).decode('utf-8')
-            user.token = token
-            user.token_last_update = datetime.now()
-            db_session.commit()
-            db_session.flush()
-            print('*** token for {} ***: {}\n'.format(user.username, token))
-            counter += 1
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
 
-        print('Updated {} tokens.'.format(str(counter)))
+    filled = dict(
+        (keys[addr_key], addr_response(addresses[addr_key], matches.get(addr_key), sections)) for addr_key in missing
+    )
+    cache_responses(filled)
+    entries.update(filled)
+
+    results = []
+    matched = 0
+
+    for item, (addr_key, standardized) in zip(items, parsed):
+        if addr_key is None:
+            results.append({
+                'input': item,
+                'match': False,
+                'error': 'A street address and a 5 digit zip code are required'
+            })
+            continue
+
+        found, data = entries[keys[addr_key]]
+
+        if found:
+            results.append({'input': item, 'match': True, 'address': standardized, 'data': json.loads(data)})
+            matched += 1
+        else:
+            results.append({'input': item, 'match': False, 'address': standardized})
 
-    except exc.SQLAlchemyError as err:
-        print('Database error updating tokens: {}'.format(str(err)))
+    # write one access log entry per match in a single insert
+    if matched:
+        try:
+            write_log(g.user_id, 'addr', matched)
+        except Exception as e:
+            print('Error writing log...')
+
+    return jsonify({
+        'count': len(results),
+        'matched': matched,
+        'results': results
+    }), 200
 
 
-def write_log(user_id, resource):
+@app.route('/api/v1.0/jobs', methods=['POST'])
+@auth.login_required
+def create_append_job():
     """
-    Write the resource user access log to
-    the database table for analytics and reporting
-    :param user_id:
-    :param resource:
-    :return: none
+    Upload a CSV list with a header row for an asynchronous append
+    Form fields: file, type (ip, sms or name) and optional columns,
+    the comma separated header name(s) of the key column(s)
+    :return: obj(AppendJob), type(json)
     """
-    id = None
-    res = None
+    upload = request.files.get('file')
+    kind = request.form.get('type', '')
+
+    if upload is None or kind not in append_job_columns:
+        resp = {"Invalid Job": "Expected a CSV file and a type of ip, sms or name"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    # a name job is keyed on the first and last name, the others on one column
+    key_columns = [name.strip() for name in (request.form.get('columns') or append_job_columns[kind]).split(',')]
+    expected = len(append_job_columns[kind].split(','))
+
+    if len(key_columns) != expected or not all(key_columns):
+        resp = {"Invalid Job": "A {} job needs {} key column name{}, not {}".format(
+            kind, expected, '' if expected == 1 else 's', request.form.get('columns'))}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    job_id = str(uuid.uuid4())
 
     try:
-        id = int(user_id)
-        res = str(resource)
+        if not os.path.isdir(append_job_dir):
+            os.makedirs(append_job_dir)
+
+        input_path = os.path.join(append_job_dir, '{}.csv'.format(job_id))
+        upload.save(input_path)
+
+        job = AppendJob(
+            id=job_id,
+            user_id=g.user_id,
+            kind=kind,
+            key_columns=','.join(key_columns),
+            filename=secure_filename(upload.filename or 'upload.csv'),
+            input_path=input_path,
+            output_path=os.path.join(append_job_dir, '{}.out.csv'.format(job_id))
+        )
+        db_session.add(job)
+        db_session.commit()
+
+    except IOError as io_err:
+        resp = {"Upload Error": str(io_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    except exc.SQLAlchemyError as db_err:
+        remove_file(input_path)
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
 
-        try:
-            _log = APILog(
-                user_id=id,
-                resource=res
-            )
+    try:
+        run_append_job.delay(job_id)
+
+    except BrokerError as broker_err:
+        job.status = 'failed'
+        job.error = 'The job could not be queued: {}'.format(str(broker_err))
+        job.finished_date = datetime.now()
+        remove_file(input_path)
 
-            db_session.add(_log)
+        try:
             db_session.commit()
-            db_session.flush()
-            print('Log write for: {} on: {}'.format(str(id), res))
+        except exc.SQLAlchemyError:
+            db_session.rollback()
 
-        except exc.SQLAlchemyError as db_err:
-            print('Error writing access log data: {}'.format(str(db_err)))
+        resp = {"Queue Error": str(broker_err)}
+        return Response(json.dumps(resp), status=503, mimetype='application/json')
 
-    except TypeError as error:
-        print('Invalid data type {} in write_log function.'.format(str(error)))
+    return jsonify(append_job_status(job)), 202
 
-    return id, res
 
+@app.route('/api/v1.0/jobs/<string:job_id>', methods=['GET'])
+@auth.login_required
+def get_append_job(job_id):
+    """
+    Status and progress of an append job
+    :param: string: job_id
+    :return: obj(AppendJob), type(json)
+    """
+    try:
+        job = db_session.query(AppendJob).filter(
+            AppendJob.id == job_id,
+            AppendJob.user_id == g.user_id
+        ).first()
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
 
-def check_phone_number(phone_number):
+    if job is None:
+        resp = {"Job Not Found": str(job_id)}
+        return Response(json.dumps(resp), status=404, mimetype='application/json')
+
+    return jsonify(append_job_status(job)), 200
+
+
+@app.route('/api/v1.0/jobs/<string:job_id>/result', methods=['GET'])
+@auth.login_required
+def get_append_job_result(job_id):
     """
-    Parse the sms phone number using the phone numbers library and return true or false
-    :param phone_number:
-    :return: bool
+    Stream the enriched CSV file of a completed append job
+    :param: string: job_id
+    :return: file, type(csv)
     """
     try:
-        phone = phonenumbers.parse('+1' + phone_number, None)
-        if phone:
-            return True
-    except phonenumbers.NumberParseException:
-        return False
+        job = db_session.query(AppendJob).filter(
+            AppendJob.id == job_id,
+            AppendJob.user_id == g.user_id
+        ).first()
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    if job is None:
+        resp = {"Job Not Found": str(job_id)}
+        return Response(json.dumps(resp), status=404, mimetype='application/json')
+
+    if job.status == 'expired':
+        resp = {"Job Expired": "The result of job {} was deleted after {} hours".format(
+            job.id, append_job_retention_hours)}
+        return Response(json.dumps(resp), status=410, mimetype='application/json')
+
+    if job.status != 'complete':
+        resp = {"Job Not Complete": append_job_status(job)}
+        data = json.dumps(resp, default=convert_datetime_object)
+        return Response(data, status=409, mimetype='application/json')
+
+    return send_file(
+        job.output_path,
+        mimetype='text/csv',
+        as_attachment=True,
+        attachment_filename='enriched_{}'.format(job.filename)
+    )
 
 
-def geocode_phone_number(phone_number):
+@app.route('/api/v1.0/cache', methods=['GET'])
+@auth.login_required
+def get_cache_stats():
     """
-    Geocode the phone number to include in the Response
-    :param phone_number:
-    :return: type(json)
+    Size and hit/miss counters of the lookup caches
+    :return: dict, type(json)
     """
-    resp = dict()
+    resp = lookup_cache.stats()
+    resp['negative_ttl'] = lookup_cache_negative_ttl
+    resp['data_version'] = data_version['version']
 
-    try:
-        phone = phonenumbers.parse('+1' + phone_number, None)
-        if phone:
-            resp['geocode'] = geocoder.description_for_number(phone, "en")
-            resp['carrier'] = carrier.name_for_number(phone, "en")
-            resp['timezone'] = timezone.time_zones_for_number(phone)
-    except phonenumbers.NumberParseException as npe:
-        resp['error'] = '{}'.format(str(npe))
+    if shared_cache is not None:
+        resp['shared'] = shared_cache.stats()
 
-    return resp
+    resp['tokens'] = token_cache.stats()
+    resp['phone_meta'] = phone_meta is not None
 
+    return jsonify(resp), 200
 
-def convert_datetime_object(o):
-    if isinstance(o, datetime):
-        return o.__str__()
 
+@app.route('/api/v1.0/usage', methods=['GET'])
+@auth.login_required
+def get_usage():
+    """
+    Request counts of the calling user per resource, read only from
+    the usage rollups.  ?period=minute, hour or day (the default),
+    ?start= and ?end= as YYYY-MM-DD or YYYY-MM-DDTHH:MM and
+    ?resource= to count a single resource
+    :return: dict, type(json)
+    """
+    period = request.args.get('period', 'day')
+    resource = request.args.get('resource')
 
-def get_date():
-    # set the current date time for each page
-    today = datetime.now().strftime('%c')
-    return '{}'.format(today)
+    try:
+        if period not in usage_periods:
+            raise ValueError('The period is one of {}'.format(', '.join(ROLLUP_PERIODS)))
 
+        length, span = usage_periods[period]
+        end = read_datetime('end') or datetime.now()
+        start = bucket_start(period, read_datetime('start') or end - span)
 
-def verify(api_key, token, timestamp, signature):
+        if start > end:
+            raise ValueError('The start is after the end')
+        if (end - start) / length > usage_max_buckets:
+            raise ValueError('More than {} {} buckets, narrow the range'.format(usage_max_buckets, period))
+
+    except ValueError as err:
+        resp = {"Error": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    criteria = [
+        UsageRollup.user_id == g.user_id,
+        UsageRollup.period == period,
+        UsageRollup.bucket.between(start, end)
+    ]
+    if resource:
+        criteria.append(UsageRollup.resource == resource)
+
+    try:
+        rows = db_session.query(UsageRollup.bucket, UsageRollup.resource, UsageRollup.count).filter(
+            *criteria
+        ).order_by(UsageRollup.bucket, UsageRollup.resource).all()
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    resources = dict()
+    for row in rows:
+        resources[row.resource] = resources.get(row.resource, 0) + row.count
+
+    return jsonify({
+        'user': g.user,
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total': sum(resources.values()),
+        'resources': resources,
+        'buckets': [
+            {'bucket': row.bucket.isoformat(), 'resource': row.resource, 'count': row.count} for row in rows
+        ]
+    }), 200
+
+
+@app.route('/api/v1.0/lat/<string:lat>/lng/<string:lng>', methods=['GET'])
+@auth.login_required
+def get_location_data(lat, lng):
+    """
+    Append data to latitude and longitude
+    Return the Person objs at the exact latitude and longitude in id
+    order, paged with ?limit= and ?cursor=, or every match streamed
+    as NDJSON with ?format=ndjson
+    :param: string: lat (float), lng (float)
+    :return: list(obj(Person)), type(json)
+    """
+    try:
+        lat = float(lat)
+        lng = float(lng)
+        limit = read_limit(api_page_size, api_page_limit)
+        cursor = read_cursor(1)
+
+    except ValueError as err:
+        resp = {"Error": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    sections = read_fields()
+    query = query_profile(db_session, sections, ('id',)).filter(
+        IPData.latitude == lat,
+        IPData.longitude == lng
+    )
+
+    try:
+        return paged_response(query, (IPData.id,), cursor, limit, sections, 'latlng', {'lat': lat, 'lng': lng})
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+
+@app.route('/api/v1.0/lat/<string:lat>/lng/<string:lng>/radius/<string:km>', methods=['GET'])
+@auth.login_required
+def get_radius_data(lat, lng, km):
+    """
+    Append data to every visitor within km of a point, nearest first
+    The page is found by nearest_rows, which reads only the rows of a
+    ring around the point that grows until the page is full, and only
+    the rows of the page are loaded.  Paged with ?limit= and ?cursor=
+    :param: string: lat (float), lng (float), km (float)
+    :return: list(obj(Person)), type(json)
+    """
+    try:
+        lat = float(lat)
+        lng = float(lng)
+        km = float(km)
+        limit = read_limit(api_page_size, api_page_limit)
+        cursor = read_cursor(2)
+
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0 and 0 < km <= radius_max_km):
+            raise ValueError('Latitude, longitude or radius out of range, the max radius is {} km'.format(
+                radius_max_km))
+
+        if cursor is not None:
+            cursor = (float(cursor[0]), int(cursor[1]))
+
+    except (TypeError, ValueError) as err:
+        resp = {"Invalid Location": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    sections = read_fields()
+
+    try:
+        nearby = nearest_rows(lat, lng, km, cursor, limit)
+        page = nearby[:limit]
+        rows = dict()
+
+        if page:
+            rows = dict((row.id, row) for row in query_profile(db_session, sections, ('id',)).filter(
+                IPData.id.in_([row_id for distance, row_id in page])
+            ))
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    results = [
+        {'distance_km': round(distance, 3), 'data': ipdata_document(rows[row_id], sections)}
+        for distance, row_id in page if row_id in rows
+    ]
+
+    # write one access log entry per match in a single insert
+    if results:
+        try:
+            write_log(g.user_id, 'radius', len(results))
+        except Exception as e:
+            print('Error writing log...')
+
+    return jsonify({
+        'lat': lat,
+        'lng': lng,
+        'radius_km': km,
+        'count': len(results),
+        'limit': limit,
+        'next_cursor': encode_cursor(list(page[-1])) if len(nearby) > limit else None,
+        'results': results
+    }), 200
+
+
+@app.route('/api/v1.0/zipcode/<string:zip_code>', methods=['GET'])
+@auth.login_required
+def get_zip_data(zip_code):
+    """
+    Append data to every visitor in a zip code, in id order
+    Paged with ?limit= and ?cursor=, streamed as NDJSON with
+    ?format=ndjson, or with ?summary=1 only the precomputed
+    counts by income range, credit range and car make
+    :param: string: zip_code (zip or zip+4)
+    :return: list(obj(Person)), type(json)
+    """
+    zip_code = zip_code.strip().split('-')[0]
+
+    try:
+        if not (len(zip_code) == 5 and zip_code.isdigit()):
+            raise ValueError('A zip code is 5 digits: {}'.format(zip_code))
+        limit = read_limit(api_page_size, api_page_limit)
+        cursor = read_cursor(1)
+
+    except ValueError as err:
+        resp = {"Error": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    meta = {'zip_code': zip_code}
+
+    try:
+        if read_summary():
+            return summary_response(zip_area(zip_code), AudienceSummary.area == zip_area(zip_code), 'zipcode', meta)
+
+        sections = read_fields()
+        query = query_profile(db_session, sections, ('id',)).filter(IPData.zip_code == zip_code)
+        return paged_response(query, (IPData.id,), cursor, limit, sections, 'zipcode', meta)
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+
+@app.route('/api/v1.0/city/<string:city_name>/limit/<int:limit>', methods=['GET'])
+@auth.login_required
+def get_city_data(city_name, limit):
+    """
+    Append data to every visitor in a city, in id order, optionally
+    only in one ?state=.  The limit is the page size, paged with
+    ?cursor=, streamed as NDJSON with ?format=ndjson, or with
+    ?summary=1 only the precomputed counts by income range,
+    credit range and car make
+    :param: string: city_name, int: limit
+    :return: list(obj(Person)), type(json)
+    """
+    city = city_name.strip()
+    state = request.args.get('state', '').strip().upper() or None
+
+    try:
+        if not city:
+            raise ValueError('A city name is required')
+        if state is not None and not (len(state) == 2 and state.isalpha()):
+            raise ValueError('A state is a 2 letter USPS code: {}'.format(state))
+        limit = max(min(limit, api_page_limit), 1)
+        cursor = read_cursor(1)
+
+    except ValueError as err:
+        resp = {"Error": str(err)}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    meta = {'city': city, 'state': state}
+    criteria = [IPData.city == city]
+    area = city_area(city, state)
+
+    # without a state the city's summary areas in every state are summed
+    if state is None:
+        summary_criterion = AudienceSummary.area.startswith(area, autoescape=True)
+    else:
+        summary_criterion = AudienceSummary.area == area
+        criteria.append(IPData.state == state)
+
+    try:
+        if read_summary():
+            return summary_response(area + ('*' if state is None else ''), summary_criterion, 'city', meta)
+
+        sections = read_fields()
+        query = query_profile(db_session, sections, ('id',)).filter(*criteria)
+        return paged_response(query, (IPData.id,), cursor, limit, sections, 'city', meta)
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+
+@app.route('/api/v1.0/first/<string:f_name>/last/<string:l_name>', methods=['GET'])
+@app.route('/api/v1.0/name/first/<string:f_name>/last/<string:l_name>', methods=['GET'])
+@auth.login_required
+def get_name_data(f_name, l_name):
+    """
+    Append data to Person first_name and last_name
+    Return the Person obj by first name and last name, else the
+    closest fuzzy match with its match_score.  With ?candidates=N
+    return up to N ranked matches instead
+    :param: string: f_name (string), l_name (string>
+    :return: obj(Person), type(json)
+    """
+
+    try:
+        first = str(f_name)
+        last = str(l_name)
+        sections = read_fields()
+
+        # names are matched on their case-normalized keys
+        first_key = name_key(first)
+        last_key = name_key(last)
+        key = 'name:{}|{}'.format(first_key, last_key)
+
+        # a blank key would match every row without a name
+        if not (first_key and last_key):
+            resp = {"Error": "A first and last name are required"}
+            return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+        try:
+            if request.args.get('candidates'):
+                limit = max(min(int(request.args['candidates']), name_match_limit), 1)
+                found, data = cached_response(
+                    key + '?candidates={}'.format(limit) + fields_key(sections),
+                    lambda: name_candidates_response(first, last, limit, sections)
+                )
+            else:
+                found, data = cached_response(
+                    key + fields_key(sections),
+                    lambda: resolve_name(first, last, find_document(
+                        sections,
+                        IPData.first_name_key == first_key,
+                        IPData.last_name_key == last_key
+                    ), sections)
+                )
+
+            if found:
+                try:
+                    write_log(g.user_id, 'name')
+                except Exception as e:
+                    print('Error writing log...')
+
+            # return the response
+            return Response(data, status=200, mimetype='application/json')
+
+        except ValueError as err:
+            resp = {"Error": str(err)}
+            return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+        except exc.SQLAlchemyError as db_err:
+            resp = {"Database Error": str(db_err)}
+            data = json.dumps(resp, default=convert_datetime_object)
+            return Response(data, status=500, mimetype='application/json')
+
+    except TypeError as e:
+        return Response(e, status=400, mimetype='application/json')
+
+
+@app.route('/api/v1.0/name/batch', methods=['POST'])
+@auth.login_required
+def get_name_batch_data():
+    """
+    Append data to a list of names
+    Accepts a JSON list, {"names": [...]} or NDJSON with one name per
+    line.  A name is {"first_name": ..., "last_name": ...}, a
+    [first, last] pair or a "first last" string.  Cached responses are
+    used first, exact matches are resolved in bulk and the rest are
+    matched fuzzily, unless ?fuzzy=0.  Fuzzy matching stops after
+    name_match_batch_budget, and the names left are returned
+    unresolved; a retry of the batch continues from the cache
+    Return the results in input order
+    :return: list(obj(Person)), type(json)
+    """
+    items = read_batch_input('names', None)
+    sections = read_fields()
+    fuzzy = request.args.get('fuzzy', '1') != '0'
+    suffix = ('' if fuzzy else '?exact') + fields_key(sections)
+
+    if items is None:
+        resp = {"Invalid Batch": "Expected a JSON list, {\"names\": [...]} or NDJSON"}
+        return Response(json.dumps(resp), status=400, mimetype='application/json')
+
+    if len(items) > api_batch_limit:
+        resp = {"Batch Too Large": "Limit is {} items per request".format(api_batch_limit)}
+        return Response(json.dumps(resp), status=413, mimetype='application/json')
+
+    # the first and last name and the name keys of each input
+    parsed = [batch_name(item) for item in items]
+    names = dict()
+
+    for first, last, keys in parsed:
+        if keys is not None:
+            names.setdefault(keys, (first, last))
+
+    keys = dict((name, 'name:{}|{}'.format(*name) + suffix) for name in names)
+
+    try:
+        entries = cached_responses(keys.values())
+        missing = [name for name, key in keys.items() if key not in entries]
+        matches = lookup_names(missing, sections)
+
+        deadline = time.time() + name_match_batch_budget
+        filled = dict()
+        unresolved = set()
+
+        for name in missing:
+            first, last = names[name]
+            data = matches.get(name)
+            if data or not fuzzy:
+                filled[keys[name]] = name_response(first, last, data, sections)
+            elif time.time() < deadline:
+                filled[keys[name]] = resolve_name(first, last, None, sections)
+            else:
+                unresolved.add(name)
+
+    except exc.SQLAlchemyError as db_err:
+        resp = {"Database Error": str(db_err)}
+        return Response(json.dumps(resp), status=500, mimetype='application/json')
+
+    cache_responses(filled)
+    entries.update(filled)
+
+    results = []
+    matched = 0
+    pending = 0
+
+    for item, (first, last, name) in zip(items, parsed):
+        if name is None:
+            results.append({'input': item, 'match': False, 'error': 'A first and last name are required'})
+            continue
+
+        if name in unresolved:
+            results.append({'input': item, 'match': False, 'error': 'Not matched within the batch time limit, retry'})
+            pending += 1
+            continue
+
+        found, data = entries[keys[name]]
+
+        if found:
+            results.append({'input': item, 'match': True, 'data': json.loads(data)})
+            matched += 1
+        else:
+            results.append({'input': item, 'match': False})
+
+    # write one access log entry per match in a single insert
+    if matched:
+        try:
+            write_log(g.user_id, 'name', matched)
+        except Exception as e:
+            print('Error writing log...')
+
+    return jsonify({
+        'count': len(results),
+        'matched': matched,
+        'unresolved': pending,
+        'results': results
+    }), 200
+
+
+'''
+******************************
+***** Utility Functions *****
+******************************
+'''
+
+
+def sign_token(user_id, username):
+    """
+    Sign a new bearer token
+    :param user_id: int
+    :param username: string
+    :return: string
+    """
+    return token_serializer.dumps({'username': username, 'user_id': user_id}).decode('utf-8')
+
+
+def user_token(user, reuse=True):
+    """
+    The bearer token of a user.  The stored token is reused while it is
+    valid for longer than the refresh window, else a new token is signed
+    and stored on the user, to be committed by the caller
+    :param user: User
+    :param reuse: bool
+    :return: tuple (token, expiry as a unix timestamp)
+    """
+    if reuse and user.token:
+        try:
+            data, header = token_serializer.loads(user.token, return_header=True)
+            if data.get('user_id') == user.id and header.get('exp', 0) - time.time() > token_refresh_window:
+                return user.token, header['exp']
+        except Exception:
+            pass
+
+    user.token = sign_token(user.id, user.username)
+    user.token_last_update = datetime.now()
+    return user.token, int(time.time()) + token_expires_in
+
+
+def token_response(token, expires):
+    """
+    The JSON body of an issued token
+    :param token: string
+    :param expires: unix timestamp
+    :return: dict
+    """
+    return {
+        'token': token,
+        'token_type': 'Bearer',
+        'expires_in': max(int(expires - time.time()), 0)
+    }
+
+
+def lookup_queries():
+    """
+    A representative query of each lookup route, for EXPLAIN.  Routes
+    with a criteria helper are checked through it, so a filter the
+    index cannot serve shows up here as it would in the route
+    :return: dict of route name to sqlalchemy Query
+    """
+    query = query_profile(db_session)
+
+    return {
+        'ipaddr': query.filter(ip_criteria(ipaddress.ip_address('127.0.0.1'))),
+        'cidr': query.filter(IPData.ip_int.between(167772160, 167837695)).order_by(IPData.ip_int, IPData.id),
+        'sms': query.filter(phone_criteria(phonenumbers.parse('+14075551234', None))),
+        'name': query.filter(IPData.first_name_key == 'john', IPData.last_name_key == 'smith'),
+        'name_fuzzy': query.filter(IPData.name_phonetic.startswith('S530')),
+        'addr': query.filter(IPData.addr_key == address_key('12 Main St', None, '32801')),
+        'latlng': query.filter(IPData.latitude == 28.5383, IPData.longitude == -81.3792).order_by(IPData.id),
+        'radius': query.filter(IPData.geo_cell.between(4266985, 4266987)),
+        'zipcode': query.filter(IPData.zip_code == '32801').order_by(IPData.id),
+        'city': query.filter(IPData.city == 'Orlando', IPData.state == 'FL').order_by(IPData.id),
+        'summary': db_session.query(AudienceSummary).filter(AudienceSummary.area == zip_area('32801')),
+    }
+
+
+def check_query_plans():
+    """
+    EXPLAIN the query of each lookup route and warn when MySQL would
+    scan the whole table, e.g. when a migration has not been applied
+    Called at startup from app.wsgi and __main__
+    :return: list of the routes that would scan
+    """
+    bind = db_session.get_bind()
+    scans = []
+
+    if bind.dialect.name != 'mysql':
+        return scans
+
+    try:
+        for route, query in sorted(lookup_queries().items()):
+            sql = query.limit(1).statement.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True})
+
+            for plan in db_session.execute('EXPLAIN {}'.format(sql)):
+                if plan['type'] == 'ALL' and route not in scans:
+                    scans.append(route)
+                    app.logger.warning('Lookup route {} would scan table {}: {}'.format(route, plan['table'], sql))
+
+    except exc.SQLAlchemyError as db_err:
+        app.logger.warning('Error checking the lookup query plans: {}'.format(str(db_err)))
+
+    finally:
+        db_session.remove()
+
+    return scans
+
+
+def write_log(user_id, resource, count=1):
+    """
+    Write the resource user access log to
+    the database table for analytics and reporting
+    Batch lookups write one row per match.  The rows are queued
+    and written in bulk by the access_log background writer
+    :param user_id:
+    :param resource:
+    :param count: number of log rows
+    :return: none
+    """
+    id = None
+    res = None
+
+    try:
+        id = int(user_id)
+        res = str(resource)
+        access_log.log(id, res, int(count))
+
+    except TypeError as error:
+        print('Invalid data type {} in write_log function.'.format(str(error)))
+
+    return id, res
+
+
+def check_data_version():
+    """
+    Clear the lookup cache and move the shared cache to a new key
+    version when the importer has loaded new data
+    The data version is read at most every data_version_interval seconds
+    :return: none
+    """
+    now = time.time()
+    if now - data_version['checked'] < data_version_interval:
+        return
+
+    data_version['checked'] = now
+
+    try:
+        version = db_session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+
+    except exc.SQLAlchemyError as db_err:
+        db_session.rollback()
+        print('Error reading the data version: {}'.format(str(db_err)))
+        return
+
+    if version != data_version['version']:
+        lookup_cache.clear()
+        data_version['version'] = version
+
+        if shared_cache is not None:
+            shared_cache.version = version or 0
+
+
+def cached_response(key, fill):
+    """
+    A lookup response from the in-process cache, then the shared
+    cache, else from fill(), which is cached in both
+    :param key: string
+    :param fill: function returning (found, body)
+    :return: tuple (found, body)
+    """
+    check_data_version()
+    entry = lookup_cache.get(key)
+
+    if entry is None:
+        entry = shared_cache.get_or_fill(key, fill) if shared_cache is not None else fill()
+        lookup_cache.set(key, entry, None if entry[0] else lookup_cache_negative_ttl)
+
+    return entry
+
+
+def cached_responses(keys):
+    """
+    The cached lookup responses of many keys, from the in-process
+    cache, then one pipelined round trip to the shared cache
+    :param keys: iterable of strings
+    :return: dict of key to (found, body) for the cached keys
+    """
+    check_data_version()
+    entries = dict()
+    missing = []
+
+    for key in keys:
+        entry = lookup_cache.get(key)
+        if entry is None:
+            missing.append(key)
+        else:
+            entries[key] = entry
+
+    if shared_cache is not None and missing:
+        shared = shared_cache.get_many(missing)
+        for key, entry in shared.items():
+            lookup_cache.set(key, entry, None if entry[0] else lookup_cache_negative_ttl)
+        entries.update(shared)
+
+    return entries
+
+
+def cache_responses(entries):
+    """
+    Cache many lookup responses, misses for the negative ttl
+    :param entries: dict of key to (found, body)
+    :return: none
+    """
+    for key, entry in entries.items():
+        lookup_cache.set(key, entry, None if entry[0] else lookup_cache_negative_ttl)
+
+    if shared_cache is not None:
+        shared_cache.set_many(entries)
+
+
+def find_document(sections, *criteria):
+    """
+    The columns of the response profile of the first IPData row
+    matching the criteria.  For full documents with response_docs,
+    its pre-rendered document is returned instead when it is current
+    :param sections: tuple of section names, None for all
+    :param criteria: IPData filter expressions
+    :return: named row, bytes or None
+    """
+    if sections is not None or not response_docs:
+        return query_profile(db_session, sections).filter(*criteria).first()
+
+    row = db_session.query(IPData.id, IPDataDoc.doc).outerjoin(IPDataDoc, and_(
+        IPDataDoc.ipdata_id == IPData.id,
+        IPDataDoc.row_hash == IPData.row_hash
+    )).filter(*criteria).order_by(IPData.id).first()
+
+    if row is None:
+        return None
+    if row.doc is not None:
+        return row.doc
+
+    return query_profile(db_session).filter(IPData.id == row.id).first()
+
+
+def render_document(data, sections=None, **extra):
+    """
+    Serialize the append document of an IPData row with extra top
+    level fields.  Pre-rendered documents have the fields spliced in
+    before their closing brace
+    :param data: IPData, named row or bytes
+    :param sections: tuple of section names, None for all
+    :param extra: extra top level fields
+    :return: bytes
+    """
+    if isinstance(data, bytes):
+        body = data.rstrip()[:-1]
+        for name, value in extra.items():
+            body += b',' + document_json(name) + b':' + document_json(value)
+        return body + b'}'
+
+    resp = ipdata_document(data, sections)
+    resp.update(extra)
+    return document_json(resp)
+
+
+def ip_response(ip_address, data, sections=None):
+    """
+    The cacheable response of an IP Address lookup
+    :param ip_address: ipaddress.IPv4Address or IPv6Address
+    :param data: IPData, named row, pre-rendered document or None
+    :param sections: tuple of section names, None for all
+    :return: tuple (found, body)
+    """
+    if data:
+        return True, render_document(data, sections, network=ip_network_info(ip_address))
+
+    resp = {"Response": "No data found for IP: {}".format(str(ip_address.exploded))}
+    return False, json.dumps(resp)
+
+
+def sms_response(national_number, geo, data, sections=None):
+    """
+    The cacheable response of a Mobile Number lookup
+    :param national_number: int
+    :param geo: dict from phone_metadata
+    :param data: IPData, named row, pre-rendered document or None
+    :param sections: tuple of section names, None for all
+    :return: tuple (found, body)
+    """
+    if data:
+        return True, render_document(
+            data,
+            sections,
+            sms_match='+1' + str(national_number),
+            verified=True,
+            phone_network=phone_network(national_number, geo)
+        )
+
+    resp = {"Number Not Found": '+1' + str(national_number), 'GeoData': geo}
+    return False, json.dumps(resp)
+
+
+def name_response(first, last, data, sections=None, **extra):
+    """
+    The cacheable response of a first and last name lookup
+    :param first: string
+    :param last: string
+    :param data: IPData, named row, pre-rendered document or None
+    :param sections: tuple of section names, None for all
+    :param extra: extra top level fields
+    :return: tuple (found, body)
+    """
+    if data:
+        return True, render_document(data, sections, **extra)
+
+    resp = {"No data found": first + ' ' + last}
+    return False, json.dumps(resp)
+
+
+def match_name(first, last, limit=1):
+    """
+    Rank the rows with names similar to first and last.  Candidates
+    come from the name_phonetic index: the rows with the same phonetic
+    key, then if none of them scores high enough every row sharing
+    the key of the last name.  Scoring stops after name_match_budget
+    :param first: string
+    :param last: string
+    :param limit: int
+    :return: tuple (list of (score, id), bool every candidate was scored)
+    """
+    query = NameQuery(first, last)
+    if not query.phonetic:
+        return [], True
+
+    deadline = time.time() + name_match_budget
+    candidates = db_session.query(IPData.id, IPData.first_name, IPData.last_name)
+    complete = True
+
+    for block in (IPData.name_phonetic == query.phonetic, IPData.name_phonetic.startswith(query.last_phonetic)):
+        rows = candidates.filter(block).limit(name_match_candidates).all()
+        ranked, scored = rank_candidates(query, rows, limit, name_match_min_score, deadline)
+        complete = scored and len(rows) < name_match_candidates
+
+        if ranked or not scored:
+            return ranked, complete
+
+    return [], complete
+
+
+def resolve_name(first, last, data, sections=None):
+    """
+    The cacheable response of a name lookup, the exact match if there
+    is one, else the best fuzzy match with its match_score
+    :param first: string
+    :param last: string
+    :param data: the exact match or None
+    :param sections: tuple of section names, None for all
+    :return: tuple (found, body)
+    """
+    if not data:
+        ranked, complete = match_name(first, last)
+
+        if ranked:
+            score, row_id = ranked[0]
+            data = find_document(sections, IPData.id == row_id)
+            return name_response(first, last, data, sections, match_score=round(score, 3))
+
+    return name_response(first, last, data, sections)
+
+
+def name_candidates_response(first, last, limit, sections=None):
+    """
+    The cacheable ranked fuzzy matches of a name
+    :param first: string
+    :param last: string
+    :param limit: int
+    :param sections: tuple of section names, None for all
+    :return: tuple (found, body)
+    """
+    ranked, complete = match_name(first, last, limit)
+    rows = dict()
+
+    if ranked:
+        rows = dict((row.id, row) for row in query_profile(db_session, sections, ('id',)).filter(
+            IPData.id.in_([row_id for score, row_id in ranked])
+        ))
+
+    results = [
+        {'match_score': round(score, 3), 'data': ipdata_document(rows[row_id], sections)}
+        for score, row_id in ranked if row_id in rows
+    ]
+
+    return bool(results), document_json({
+        'first_name': first,
+        'last_name': last,
+        'count': len(results),
+        'complete': complete,
+        'results': results
+    })
+
+
+def batch_name(item):
+    """
+    The first and last name of a name batch item and its name keys
+    :param item: dict, list or string
+    :return: tuple (first, last, (first_name_key, last_name_key) or None)
+    """
+    if isinstance(item, dict):
+        first, last = item.get('first_name'), item.get('last_name')
+    elif isinstance(item, list) and len(item) == 2:
+        first, last = item
+    elif isinstance(item, str) and len(item.split()) > 1:
+        first, last = item.rsplit(None, 1)
+    else:
+        return None, None, None
+
+    if not (isinstance(first, str) and isinstance(last, str) and name_key(first) and name_key(last)):
+        return None, None, None
+
+    return first, last, (name_key(first), name_key(last))
+
+
+def addr_response(address, data, sections=None):
+    """
+    The cacheable response of an address lookup
+    :param address: string standardized address
+    :param data: IPData, named row, pre-rendered document or None
+    :param sections: tuple of section names, None for all
+    :return: tuple (found, body)
+    """
+    if data:
+        return True, render_document(data, sections)
+
+    resp = {"No data found": address}
+    return False, json.dumps(resp)
+
+
+def batch_address(item):
+    """
+    The addr_key and standardized form of an address batch item
+    :param item: string or dict with address1, address2 and zip_code
+    :return: tuple (addr_key, standardized address), None for invalid items
+    """
+    if isinstance(item, dict):
+        address1, address2, zip_code = item.get('address1'), item.get('address2'), item.get('zip_code')
+    elif isinstance(item, str):
+        address1, zip_code = parse_address(item)
+        address2 = None
+    else:
+        return None, None
+
+    try:
+        return address_key(address1, address2, zip_code), format_address(address1, address2, zip_code=zip_code)
+    except AttributeError:
+        return None, None
+
+
+def read_datetime(name):
+    """
+    A date or date and time query argument
+    :param name: string
+    :return: datetime or None when absent
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+
+    for date_format in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+
+    raise ValueError('Invalid {}, expected YYYY-MM-DD or YYYY-MM-DDTHH:MM: {}'.format(name, value))
+
+
+def read_fields():
+    """
+    The document sections requested with ?fields=person,geo,auto
+    An empty value returns only the top level fields, which is
+    enough to tell whether a match exists
+    :return: tuple of section names, None for all
+    """
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+
+    requested = set(name.strip().lower() for name in fields.split(',') if name.strip())
+    unknown = requested.difference(DOCUMENT_PROFILES)
+
+    if unknown:
+        resp = {"Invalid Fields": sorted(unknown), "Fields": list(DOCUMENT_PROFILES)}
+        abort(Response(json.dumps(resp), status=400, mimetype='application/json'))
+
+    return tuple(name for name in DOCUMENT_PROFILES if name in requested)
+
+
+def fields_key(sections):
+    """
+    The cache key suffix of a response profile
+    :param sections: tuple of section names, None for all
+    :return: string
+    """
+    return '' if sections is None else '?fields=' + ','.join(sections)
+
+
+def read_limit(default, maximum):
+    """
+    The page size requested with ?limit=, between 1 and maximum
+    :param default: int
+    :param maximum: int
+    :return: int
+    """
+    return max(min(int(request.args.get('limit', default)), maximum), 1)
+
+
+def encode_cursor(values):
+    """
+    The opaque ?cursor= token of a keyset position, the sort key
+    values of the last row of a page.  Binary values are hex encoded
+    :param values: list
+    :return: string
+    """
+    values = [{'hex': value.hex()} if isinstance(value, bytes) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def read_cursor(size):
+    """
+    The keyset position of ?cursor=, None for the first page
+    :param size: number of sort key values
+    :return: list or None
+    """
+    token = request.args.get('cursor')
+    if not token:
+        return None
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        values = [bytes.fromhex(value['hex']) if isinstance(value, dict) else value for value in values]
+    except (TypeError, KeyError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+
+    return values
+
+
+def keyset_after(order, values):
+    """
+    The rows after a keyset position, written as OR'ed prefix matches
+    which MySQL turns into index ranges, unlike a row comparison
+    :param order: tuple of columns
+    :param values: list of the sort key values of the last row
+    :return: sqlalchemy clause
+    """
+    return or_(*[
+        and_(*[column == value for column, value in zip(order[:i], values)] + [order[i] > values[i]])
+        for i in range(len(order))
+    ])
+
+
+def nearest_rows(lat, lng, km, after, limit):
+    """
+    The (distance, id) of the rows nearest a point within km, in
+    order, after a (distance, id) keyset position.  The search starts
+    with a ring radius_ring_km past the position and doubles it until
+    more than limit rows are inside it or it reaches km.  Candidates
+    come from the geo_cell index ranges of the ring's bounding box and
+    are streamed, so at most limit + 1 of them are held at once
+    :param lat: float
+    :param lng: float
+    :param km: float
+    :param after: tuple (distance, id) of the last row of the previous page, None for the first page
+    :param limit: int page size
+    :return: list of at most limit + 1 (distance, id) tuples
+    """
+    ring = min(km, (after[0] if after else 0) + radius_ring_km)
+
+    while True:
+        box = bounding_box(lat, lng, ring)
+        min_lat, max_lat, min_lng, max_lng = box
+        candidates = db_session.query(IPData.id, IPData.latitude, IPData.longitude).filter(
+            or_(*[IPData.geo_cell.between(first, last) for first, last in cell_ranges(box)]),
+            IPData.latitude.between(min_lat, max_lat),
+            IPData.longitude.between(min_lng, max_lng)
+        ).execution_options(stream_results=True).yield_per(api_stream_batch)
+
+        # every row within the ring is inside its box, so the nearest
+        # rows of the ring are the next rows of the whole radius
+        nearby = heapq.nsmallest(limit + 1, (
+            key for key in ((haversine(lat, lng, row.latitude, row.longitude), row.id) for row in candidates)
+            if key[0] <= ring and (after is None or key > after)
+        ))
+
+        if len(nearby) > limit or ring >= km:
+            return nearby
+
+        ring = min(ring * 2, km)
+
+
+def wants_ndjson():
+    """
+    Whether the client asked for an NDJSON stream, with
+    ?format=ndjson or an application/x-ndjson Accept header
+    :return: bool
+    """
+    if request.args.get('format') == 'ndjson':
+        return True
+
+    return request.accept_mimetypes.best in ('application/x-ndjson', 'application/ndjson')
+
+
+def paged_response(query, order, cursor, limit, sections, resource, meta):
+    """
+    One page of append documents in keyset order with the cursor of
+    the next page, or with ?format=ndjson every row after the cursor
+    streamed one document per line
+    :param query: query_profile query including the order columns
+    :param order: tuple of IPData columns unique together, ending with IPData.id
+    :param cursor: list of sort key values to start after, None for the first page
+    :param limit: int page size
+    :param sections: tuple of section names, None for all
+    :param resource: access log resource
+    :param meta: dict of fields added to the page
+    :return: Response
+    """
+    if cursor is not None:
+        query = query.filter(keyset_after(order, cursor))
+    query = query.order_by(*order)
+
+    if wants_ndjson():
+        return stream_documents(query, sections, resource)
+
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+    results = [ipdata_document(row, sections) for row in page]
+
+    # write one access log entry per match in a single insert
+    if results:
+        try:
+            write_log(g.user_id, resource, len(results))
+        except Exception as e:
+            print('Error writing log...')
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([getattr(page[-1], column.key) for column in order])
+
+    resp = dict(meta)
+    resp.update({
+        'count': len(results),
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'results': results
+    })
+    return jsonify(resp), 200
+
+
+def read_summary():
+    """
+    Whether ?summary=1 asked for the audience counts instead of rows
+    :return: bool
+    """
+    return request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+
+
+def summary_response(key, criterion, resource, meta):
+    """
+    The precomputed audience counts of the summary areas matching
+    criterion, summed.  One index range read of audience_summary,
+    cached like the single lookups until the next import
+    :param key: cache key of the areas
+    :param criterion: filter on AudienceSummary.area
+    :param resource: access log resource
+    :param meta: dict of fields added to the response
+    :return: Response
+    """
+    def fill():
+        counts = dict((dimension, {}) for dimension in SUMMARY_DIMENSIONS)
+        total = 0
+
+        rows = db_session.query(
+            AudienceSummary.dimension, AudienceSummary.value, func.sum(AudienceSummary.count)
+        ).filter(criterion).group_by(AudienceSummary.dimension, AudienceSummary.value)
+
+        for dimension, value, count in rows:
+            if dimension == 'total':
+                total += int(count)
+            elif dimension in counts:
+                counts[dimension][value] = int(count)
+
+        resp = dict(meta)
+        resp['total'] = total
+        resp.update(counts)
+        return total > 0, json.dumps(resp)
+
+    found, data = cached_response('summary:' + key, fill)
+
+    if found:
+        try:
+            write_log(g.user_id, resource)
+        except Exception as e:
+            print('Error writing log...')
+
+    return Response(data, status=200, mimetype='application/json')
+
+
+def stream_documents(query, sections, resource):
+    """
+    Stream the append documents of a query as NDJSON.  Rows are read
+    from a server side cursor api_stream_batch at a time, so memory
+    stays flat and the first document is sent as soon as it is fetched.
+    A database error after the response started is sent as a final line
+    :param query: sqlalchemy Query
+    :param sections: tuple of section names, None for all
+    :param resource: access log resource
+    :return: Response
+    """
+    def generate():
+        count = 0
+
+        try:
+            for row in query.execution_options(stream_results=True).yield_per(api_stream_batch):
+                count += 1
+                yield document_json(ipdata_document(row, sections)) + b'\n'
+
+        except exc.SQLAlchemyError as db_err:
+            db_session.rollback()
+            yield document_json({"Database Error": str(db_err)}) + b'\n'
+
+        if count:
+            try:
+                write_log(g.user_id, resource, count)
+            except Exception as e:
+                print('Error writing log...')
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/x-ndjson')
+
+
+def read_batch_input(list_key, item_key):
+    """
+    Read the items of a batch request.  The body may be a JSON list,
+    a JSON object holding the list under list_key, or NDJSON with one
+    item per line.  Object items are reduced to their item_key value
+    :param list_key: string
+    :param item_key: string, None to keep object items whole
+    :return: list or None
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            return None
+    else:
+        items = request.get_json(force=True, silent=True)
+        if isinstance(items, dict):
+            items = items.get(list_key)
+
+    if not isinstance(items, list):
+        return None
+
+    if item_key is None:
+        return items
+
+    return [item.get(item_key) if isinstance(item, dict) else item for item in items]
+
+
+def remove_file(path):
+    """
+    Delete a file if it exists
+    :param path: string
+    :return: none
+    """
+    try:
+        if path:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def chunks(items, size):
+    """
+    Split a list or iterator into lists of at most size items
+    :param items: iterable
+    :param size: int
+    :return: generator
+    """
+    items = iter(items)
+    chunk = list(itertools.islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, size))
+
+
+def lookup_rows(key_column, keys, key_names, sections=None):
+    """
+    Resolve many keys with one IN (...) query per chunk, loading only
+    the key columns and the columns of the response profile
+    The first IPData row by id wins for each key
+    :param key_column: IPData column or tuple_ of columns
+    :param keys: iterable of column values
+    :param key_names: tuple of the key column names
+    :param sections: tuple of section names, None for all
+    :return: dict of key to named row
+    """
+    matches = dict()
+    row_key = operator.attrgetter(*key_names)
+
+    for chunk in chunks(sorted(set(keys)), api_batch_chunk):
+        rows = query_profile(db_session, sections, key_names).filter(
+            key_column.in_(chunk)
+        ).order_by(IPData.id)
+
+        for row in rows:
+            matches.setdefault(row_key(row), row)
+
+    return matches
+
+
+def lookup_ips(addresses, sections=None):
+    """
+    Resolve IP addresses to IPData rows, IPv4 on ip_int and IPv6 on ip6
+    :param addresses: iterable of ipaddress.IPv4Address or IPv6Address
+    :param sections: tuple of section names, None for all
+    :return: dict of address to named row
+    """
+    addresses = set(addresses)
+    matches = dict()
+
+    ipv4 = lookup_rows(IPData.ip_int, (int(address) for address in addresses if address.version == 4),
+                       ('ip_int',), sections)
+    for ip_int, row in ipv4.items():
+        matches[ipaddress.IPv4Address(ip_int)] = row
+
+    ipv6 = lookup_rows(IPData.ip6, (address.packed for address in addresses if address.version == 6),
+                       ('ip6',), sections)
+    for ip6, row in ipv6.items():
+        matches[ipaddress.IPv6Address(ip6)] = row
+
+    return matches
+
+
+def lookup_phones(phones, sections=None):
+    """
+    Resolve 10 digit national numbers to IPData rows
+    :param phones: iterable of strings
+    :param sections: tuple of section names, None for all
+    :return: dict of cell_phone to named row
+    """
+    return lookup_rows(IPData.cell_phone, phones, ('cell_phone',), sections)
+
+
+def lookup_names(names, sections=None):
+    """
+    Resolve (first_name, last_name) pairs of name keys to IPData rows
+    :param names: iterable of tuples
+    :param sections: tuple of section names, None for all
+    :return: dict of (first_name_key, last_name_key) to named row
+    """
+    return lookup_rows(
+        tuple_(IPData.first_name_key, IPData.last_name_key), names, ('first_name_key', 'last_name_key'), sections
+    )
+
+
+def append_job_key(kind, key_columns, row):
+    """
+    The lookup key of an uploaded row, None when it can not be resolved
+    :param kind: string: ip, sms or name
+    :param key_columns: list
+    :param row: dict
+    :return: string or tuple
+    """
+    try:
+        if kind == 'ip':
+            return ipaddress.ip_address(row[key_columns[0]].strip())
+        if kind == 'sms':
+            return str(phonenumbers.parse('+1' + row[key_columns[0]].strip(), None).national_number)
+        keys = tuple(name_key(row[name]) for name in key_columns)
+        return keys if all(keys) else None
+
+    except (KeyError, AttributeError, ValueError, phonenumbers.NumberParseException):
+        return None
+
+
+def append_job_status(job):
+    """
+    The status response of an append job
+    :param job: AppendJob
+    :return: dict
+    """
+    resp = {
+        'job_id': job.id,
+        'type': job.kind,
+        'columns': job.key_columns,
+        'status': job.status,
+        'filename': job.filename,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'matched_rows': job.matched_rows,
+        'created_date': job.created_date,
+        'finished_date': job.finished_date,
+        'status_url': url_for('get_append_job', job_id=job.id)
+    }
+
+    if job.status == 'complete':
+        resp['result_url'] = url_for('get_append_job_result', job_id=job.id)
+    if job.error:
+        resp['error'] = job.error
+
+    return resp
+
+
+def ip_criteria(ip_address):
+    """
+    The indexed IPData filter of an IP address
+    :param ip_address: ipaddress.IPv4Address or IPv6Address
+    :return: sqlalchemy expression
+    """
+    if ip_address.version == 4:
+        return IPData.ip_int == int(ip_address)
+
+    return IPData.ip6 == ip_address.packed
+
+
+def phone_criteria(phone):
+    """
+    The indexed IPData filter of a phone number.  cell_phone is a
+    string column, and comparing it with an integer would make MySQL
+    cast every row instead of using the index
+    :param phone: phonenumbers.PhoneNumber
+    :return: sqlalchemy expression
+    """
+    return IPData.cell_phone == str(phone.national_number)
+
+
+def ip_network_info(ip_address):
+    """
+    The network section of the IP Address append response
+    :param ip_address: ipaddress.IPv4Address or IPv6Address
+    :return: dict
+    """
+    return {
+        'ip_address': ip_address.exploded,
+        'ip_version': ip_address.version,
+        'compressed': ip_address.compressed,
+        'exploded': ip_address.exploded,
+        'reverse': ip_address.reverse_pointer,
+        'multicast': ip_address.is_multicast,
+        'private': ip_address.is_private,
+        'global': ip_address.is_global,
+        'loopback': ip_address.is_loopback,
+    }
+
+
+def check_phone_number(phone_number):
+    """
+    Parse the sms phone number using the phone numbers library and return true or false
+    :param phone_number:
+    :return: bool
+    """
+    try:
+        phone = phonenumbers.parse('+1' + phone_number, None)
+        if phone:
+            return True
+    except phonenumbers.NumberParseException:
+        return False
+
+
+def geocode_phone_number(phone_number):
+    """
+    Geocode the phone number to include in the Response
+    :param phone_number:
+    :return: type(json)
+    """
+    resp = dict()
+
+    try:
+        phone = phonenumbers.parse('+1' + phone_number, None)
+        if phone:
+            resp = phone_metadata(phone)
+    except phonenumbers.NumberParseException as npe:
+        resp['error'] = '{}'.format(str(npe))
+
+    return resp
+
+
+def phone_metadata(phone):
+    """
+    Geocode, carrier and timezone of an already parsed phone number
+    One probe of the NPA-NXX table, the library resolves the rest
+    :param phone: phonenumbers.PhoneNumber
+    :return: dict
+    """
+    if phone_meta is not None:
+        geo = phone_meta.get(phone)
+        if geo is not None:
+            return geo
+
+    return {
+        'geocode': geocoder.description_for_number(phone, "en"),
+        'carrier': carrier.name_for_number(phone, "en"),
+        'timezone': timezone.time_zones_for_number(phone)
+    }
+
+
+def phone_network(national_number, geo):
+    """
+    The phone network section of the Mobile Number append response
+    :param national_number: int
+    :param geo: dict from phone_metadata
+    :return: dict
+    """
+    return {
+        'number': '+1' + str(national_number),
+        'carrier': geo['carrier'],
+        'timezone': geo['timezone'],
+        'city': geo['geocode']
+    }
+
+
+def convert_datetime_object(o):
+    if isinstance(o, datetime):
+        return o.__str__()
+
+
+def get_date():
+    # set the current date time for each page
+    today = datetime.now().strftime('%c')
+    return '{}'.format(today)
+
+
+def verify(api_key, token, timestamp, signature):
     hmac_digest = hmac.new(key=mailgun_api_key,
                            msg='{}{}'.format(timestamp, token).encode('utf-8'),
                            digestmod=hashlib.sha256).hexdigest()
@@ -842,6 +2862,9 @@ def flash_errors(form):
 if __name__ == '__main__':
     port = 5880
 
+    # warn about lookup routes without a usable index
+    check_query_plans()
+
     # start the application
     app.run(
         debug=debug,
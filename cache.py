@@ -0,0 +1,405 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import redis
+    REDIS_ERRORS = (redis.RedisError,)
+except ImportError:
+    redis = None
+    REDIS_ERRORS = ()
+
+# delete a fill lock only while it still holds this process's token,
+# a lock that expired during a slow fill may belong to another process
+UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LRUCache(object):
+    """
+    Bounded in-process cache with least recently used eviction
+    and a time to live on every entry.  Safe to share between threads
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value, or default when missing or expired
+        :param key:
+        :param default:
+        :return: value
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires = entry
+            if expires <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache a value, evicting the least recently used entries when full
+        :param key:
+        :param value:
+        :param ttl: seconds, defaults to the cache ttl
+        :return: none
+        """
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Drop a cached value
+        :param key:
+        :return: none
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every cached value
+        :return: none
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Size and hit/miss counters of the cache
+        :return: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.time()
+
+
+class TokenCache(object):
+    """
+    Verified bearer tokens keyed by their sha256 digest, so the
+    signature of a token is checked once until it expires or the
+    cache ttl caps it.  The entries of a user can be revoked
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.cache = LRUCache(maxsize, ttl)
+        self.revocations = 0
+        self._users = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        """
+        The cache key of a token, the token itself is never stored
+        :param token: string or bytes
+        :return: bytes
+        """
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        """
+        The identity of a verified token, or None
+        :param token: string or bytes
+        :return: tuple (username, user_id)
+        """
+        return self.cache.get(self.digest(token))
+
+    def set(self, token, identity, expires):
+        """
+        Cache the identity of a verified token until it expires
+        :param token: string or bytes
+        :param identity: tuple (username, user_id)
+        :param expires: token expiry as a unix timestamp
+        :return: none
+        """
+        ttl = min(expires - time.time(), self.cache.ttl)
+        if ttl <= 0:
+            return
+
+        digest = self.digest(token)
+        self.cache.set(digest, identity, ttl)
+
+        with self._lock:
+            # forget the evicted and expired tokens of the user
+            digests = set(key for key in self._users.get(identity[1], ()) if key in self.cache)
+            digests.add(digest)
+            self._users[identity[1]] = digests
+
+    def revoke(self, user_id):
+        """
+        Drop every cached token of a user
+        :param user_id: int
+        :return: none
+        """
+        with self._lock:
+            digests = self._users.pop(user_id, ())
+
+        for digest in digests:
+            self.cache.delete(digest)
+        self.revocations += 1
+
+    def stats(self):
+        """
+        Size and hit/miss counters of the cache
+        :return: dict
+        """
+        stats = self.cache.stats()
+        stats['revocations'] = self.revocations
+        return stats
+
+
+class RedisCache(object):
+    """
+    Lookup responses shared by every WSGI process through redis
+    Entries are (found, body) pairs.  Keys carry the data version,
+    so bumping the version invalidates every entry in one step and
+    the orphaned keys age out with their ttl.  Redis errors are
+    counted and treated as cache misses
+    """
+
+    def __init__(self, client, prefix='m3data', ttl=300, negative_ttl=60, lock_timeout=5, poll_interval=0.05):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.waits = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Connect to the redis server at url
+        :param url: redis://host:port/db
+        :param kwargs: RedisCache options
+        :return: RedisCache
+        """
+        if redis is None:
+            raise ImportError('redis is required for the shared lookup cache')
+
+        return cls(redis.Redis.from_url(url, socket_timeout=1), **kwargs)
+
+    def key(self, key):
+        """
+        The versioned redis key of a lookup key
+        :param key: string
+        :return: string
+        """
+        return '{}:{}:{}'.format(self.prefix, self.version, key)
+
+    @staticmethod
+    def pack(entry):
+        """
+        Serialize a (found, body) entry
+        :param entry: tuple
+        :return: bytes
+        """
+        found, body = entry
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return (b'1' if found else b'0') + body
+
+    @staticmethod
+    def unpack(raw):
+        """
+        Deserialize a (found, body) entry
+        :param raw: bytes
+        :return: tuple
+        """
+        return raw[:1] == b'1', raw[1:]
+
+    def _get(self, key):
+        try:
+            raw = self.client.get(self.key(key))
+        except REDIS_ERRORS:
+            self.errors += 1
+            return None
+
+        return None if raw is None else self.unpack(raw)
+
+    def get(self, key):
+        """
+        A cached entry or None
+        :param key: string
+        :return: tuple (found, body)
+        """
+        entry = self._get(key)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return entry
+
+    def get_many(self, keys):
+        """
+        Fetch many entries in one pipelined round trip
+        :param keys: iterable of strings
+        :return: dict of key to (found, body) for the cached keys
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(self.key(key))
+            values = pipe.execute()
+        except REDIS_ERRORS:
+            self.errors += 1
+            return {}
+
+        entries = dict((key, self.unpack(raw)) for key, raw in zip(keys, values) if raw is not None)
+        self.hits += len(entries)
+        self.misses += len(keys) - len(entries)
+
+        return entries
+
+    def set(self, key, entry):
+        """
+        Cache an entry, misses for the negative ttl
+        :param key: string
+        :param entry: tuple (found, body)
+        :return: none
+        """
+        self.set_many({key: entry})
+
+    def set_many(self, entries):
+        """
+        Cache many entries in one pipelined round trip
+        :param entries: dict of key to (found, body)
+        :return: none
+        """
+        if not entries:
+            return
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, entry in entries.items():
+                pipe.set(self.key(key), self.pack(entry), ex=self.ttl if entry[0] else self.negative_ttl)
+            pipe.execute()
+        except REDIS_ERRORS:
+            self.errors += 1
+
+    def get_or_fill(self, key, fill):
+        """
+        A cached entry, else the entry returned by fill(), which is cached
+        Only the process holding the fill lock of a cold key calls fill,
+        the others wait up to lock_timeout for its value to appear.  The
+        lock holds a random token and is released only if it still does
+        :param key: string
+        :param fill: function returning (found, body)
+        :return: tuple (found, body)
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        lock = self.key(key) + ':lock'
+        token = uuid.uuid4().hex.encode('ascii')
+
+        try:
+            locked = self.client.set(lock, token, nx=True, px=int(self.lock_timeout * 1000))
+        except REDIS_ERRORS:
+            self.errors += 1
+            return fill()
+
+        if not locked:
+            self.waits += 1
+            deadline = time.time() + self.lock_timeout
+
+            while time.time() < deadline:
+                time.sleep(self.poll_interval)
+                entry = self._get(key)
+                if entry is not None:
+                    return entry
+
+        try:
+            entry = fill()
+            self.fills += 1
+            self.set(key, entry)
+        finally:
+            if locked:
+                try:
+                    self.client.eval(UNLOCK_SCRIPT, 1, lock, token)
+                except REDIS_ERRORS:
+                    self.errors += 1
+
+        return entry
+
+    def stats(self):
+        """
+        Hit/miss counters of the cache
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'version': self.version,
+            'ttl': self.ttl,
+            'negative_ttl': self.negative_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'fills': self.fills,
+            'waits': self.waits,
+            'errors': self.errors,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0
+        }
@@ -1,13 +1,303 @@
 #!.env/bin/python
 # -*- coding: utf-8 -*-
 
+import argparse
+import config
 import csv
+import hashlib
+import json
+import multiprocessing
+import operator
+import os
+import re
+import socket
+import struct
+import tempfile
+import time
+from collections import Counter, OrderedDict
 from db import db_session
-from sqlalchemy import exc
-from models import IPData
+from sqlalchemy import and_, bindparam, create_engine, exc, func, or_, text, tuple_
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import sessionmaker
+from address import address_key
+from geo import geo_cell
+from name_index import name_phonetic
+from models import IPData, IPDataDoc, DataVersion, AudienceSummary, SUMMARY_DIMENSIONS, ipdata_document, \
+    document_json, zip_area, city_area
 from datetime import datetime
 
 
+# default location of the vendor feed
+DEFAULT_FILEPATH = '/home/craigderington/Downloads/IPData.csv'
+
+# default number of rows per insert batch in bulk mode
+DEFAULT_BATCH_SIZE = 5000
+
+# IPData column name and position in the vendor CSV record
+COLUMNS = (
+    ('ip', 2),
+    ('country_name', 4),
+    ('geo_city', 5),
+    ('time_zone', 6),
+    ('latitude', 7),
+    ('longitude', 8),
+    ('metro_code', 9),
+    ('country_code', 10),
+    ('country_code3', 11),
+    ('dma_code', 12),
+    ('area_code', 13),
+    ('postal_code', 14),
+    ('region', 15),
+    ('region_name', 16),
+    ('first_name', 17),
+    ('last_name', 18),
+    ('email', 19),
+    ('home_phone', 20),
+    ('cell_phone', 21),
+    ('address1', 22),
+    ('address2', 23),
+    ('city', 24),
+    ('state', 25),
+    ('zip_code', 26),
+    ('credit_range', 27),
+    ('car_year', 28),
+    ('car_make', 29),
+    ('car_model', 30),
+    ('ppm_type', 31),
+    ('ppm_indicator', 32),
+    ('ppm_segment', 33),
+    ('auto_trans_date', 34),
+    ('last_seen', 35),
+    ('birth_year', 36),
+    ('income_range', 37),
+    ('home_owner_renter', 38),
+    ('auto_purchase_type', 39),
+)
+
+# integer columns stored as 0 when the CSV field is blank
+INTEGER_COLUMNS = ('car_year', 'birth_year')
+
+# float columns and their valid range
+FLOAT_COLUMNS = (('latitude', -90.0, 90.0), ('longitude', -180.0, 180.0))
+
+# phone columns stored as 10 digit national numbers
+PHONE_COLUMNS = ('home_phone', 'cell_phone')
+
+# every column produced by normalize_columns, in order
+NORMALIZED_COLUMNS = tuple(name for name, pos in COLUMNS) + (
+    'zip_4', 'ip_int', 'ip6', 'geo_cell', 'first_name_key', 'last_name_key', 'name_phonetic',
+    'addr_key', 'created_date', 'user_agent', 'processed', 'validated', 'row_hash'
+)
+
+# binary columns, written to the LOAD DATA file as hex
+BINARY_COLUMNS = ('ip6',)
+
+# a vendor record must have at least this many fields
+RECORD_WIDTH = max(pos for name, pos in COLUMNS) + 1
+
+# the raw vendor fields, in column order
+VENDOR_FIELDS = operator.itemgetter(*[pos for name, pos in COLUMNS])
+
+# USPS state, district and territory codes
+STATES = frozenset((
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA',
+    'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM',
+    'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA',
+    'WV', 'WI', 'WY', 'AS', 'GU', 'MP', 'PR', 'VI', 'AA', 'AE', 'AP',
+))
+
+# columns with their own coercion in normalize_columns
+TYPED_COLUMNS = frozenset(
+    INTEGER_COLUMNS + PHONE_COLUMNS + tuple(name for name, low, high in FLOAT_COLUMNS) + ('state', 'zip_code')
+)
+
+ZIP_RE = re.compile(r'^(\d{5})(?:-?(\d{4}))?$')
+NON_DIGITS_RE = re.compile(r'\D')
+
+# unpack a packed IPv4 address into an unsigned 32 bit integer
+IPV4_INT = struct.Struct('!I').unpack
+
+# errors raised by socket.inet_pton for invalid or missing addresses
+INET_ERRORS = (OSError, TypeError, ValueError)
+
+
+def row_hash(rec):
+    """
+    Content hash of the raw vendor fields, used to skip unchanged rows
+    :param rec: list
+    :return: string
+    """
+    return hashlib.sha1('\x1f'.join(VENDOR_FIELDS(rec)).encode('utf-8')).hexdigest()
+
+
+def ip_key(value):
+    """
+    The indexed forms of an IP address: an unsigned 32 bit integer
+    for IPv4 and the 16 byte packed address for IPv6
+    :param value: string
+    :return: tuple (ip_int, ip6), (None, None) when invalid
+    """
+    try:
+        return IPV4_INT(socket.inet_pton(socket.AF_INET, value))[0], None
+    except INET_ERRORS:
+        pass
+
+    try:
+        return None, socket.inet_pton(socket.AF_INET6, value)
+    except INET_ERRORS:
+        return None, None
+
+
+def to_int(value):
+    """
+    Integer column value, 0 when blank or invalid
+    :param value: string
+    :return: int
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def to_phone(value):
+    """
+    10 digit national phone number or None
+    :param value: string
+    :return: string
+    """
+    digits = NON_DIGITS_RE.sub('', value)
+    if len(digits) == 11 and digits[0] == '1':
+        digits = digits[1:]
+    return digits if len(digits) == 10 else None
+
+
+def to_state(value):
+    """
+    Upper case USPS state code or None
+    :param value: string
+    :return: string
+    """
+    value = value.upper()
+    return value if value in STATES else None
+
+
+def zip_code(value):
+    """
+    5 digit zip code from a zip or zip+4 value, or None
+    :param value: string
+    :return: string
+    """
+    match = ZIP_RE.match(value.strip())
+    return match.group(1) if match else None
+
+
+def float_column(values, low, high):
+    """
+    Parse a column of floats, None when blank or out of range
+    :param values: sequence of strings
+    :param low: float
+    :param high: float
+    :return: list
+    """
+    column = []
+    append = column.append
+    for value in values:
+        try:
+            number = float(value)
+            append(number if low <= number <= high else None)
+        except ValueError:
+            append(None)
+    return column
+
+
+def normalize_columns(records, created_date=None):
+    """
+    Columnar normalization of a batch of CSV records.  The batch is
+    transposed into one sequence per field and every type coercion,
+    validation and null fill runs over a whole column at a time
+    :param records: list of lists
+    :param created_date: datetime
+    :return: tuple (dict of column name to list, int errors)
+    """
+    valid = [rec for rec in records if len(rec) >= RECORD_WIDTH]
+    errors = len(records) - len(valid)
+    if not valid:
+        return {}, errors
+
+    fields = list(zip(*valid))
+    positions = dict(COLUMNS)
+    columns = OrderedDict()
+
+    # strip whitespace and null fill blank strings
+    for name, pos in COLUMNS:
+        if name in TYPED_COLUMNS:
+            columns[name] = None
+        else:
+            columns[name] = [value.strip() or None for value in fields[pos]]
+
+    for name in INTEGER_COLUMNS:
+        columns[name] = [to_int(value) if value else 0 for value in fields[positions[name]]]
+
+    for name, low, high in FLOAT_COLUMNS:
+        columns[name] = float_column(fields[positions[name]], low, high)
+
+    for name in PHONE_COLUMNS:
+        columns[name] = [
+            value if len(value) == 10 and value.isdigit() else to_phone(value) if value else None
+            for value in fields[positions[name]]
+        ]
+
+    columns['state'] = [to_state(value.strip()) if value else None for value in fields[positions['state']]]
+
+    zip_codes = [value.strip() for value in fields[positions['zip_code']]]
+    columns['zip_code'] = [
+        value if len(value) == 5 and value.isdigit() else zip_code(value) if value else None
+        for value in zip_codes
+    ]
+    columns['zip_4'] = [int(value[-4:]) if len(value) > 5 and zip_code(value) else None for value in zip_codes]
+    columns['ip_int'], columns['ip6'] = map(list, zip(*map(ip_key, columns['ip'])))
+    columns['geo_cell'] = list(map(geo_cell, columns['latitude'], columns['longitude']))
+    columns['first_name_key'] = [value.lower() if value else None for value in columns['first_name']]
+    columns['last_name_key'] = [value.lower() if value else None for value in columns['last_name']]
+    columns['name_phonetic'] = list(map(name_phonetic, columns['first_name'], columns['last_name']))
+    columns['addr_key'] = list(map(address_key, columns['address1'], columns['address2'], columns['zip_code']))
+
+    count = len(valid)
+    columns['created_date'] = [created_date or datetime.now()] * count
+    columns['user_agent'] = [''] * count
+    columns['processed'] = [False] * count
+    columns['validated'] = [False] * count
+    columns['row_hash'] = list(map(row_hash, valid))
+
+    return columns, errors
+
+
+def columns_to_rows(columns):
+    """
+    Transpose a column batch into the list of dicts executemany expects
+    :param columns: dict of column name to list
+    :return: list of dicts
+    """
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def row_to_dict(rec, created_date=None):
+    """
+    Map a CSV record to a dict of IPData column values, normalized
+    exactly as the batch import modes normalize a column batch
+    :param rec: list
+    :param created_date: datetime
+    :return: dict
+    """
+    columns, errors = normalize_columns([rec], created_date)
+    if errors:
+        raise IndexError('A vendor record has at least {} fields, not {}'.format(RECORD_WIDTH, len(rec)))
+
+    return columns_to_rows(columns)[0]
+
+
 def write_row(rec):
     """
     Write the record to the database
@@ -15,47 +305,7 @@ def write_row(rec):
     :return: none
     """
     try:
-        data = IPData(
-            created_date=datetime.now(),
-            ip=rec[2],
-            user_agent='',
-            country_name=rec[4],
-            geo_city=rec[5],
-            time_zone=rec[6],
-            latitude=rec[7],
-            longitude=rec[8],
-            metro_code=rec[9],
-            country_code=rec[10],
-            country_code3=rec[11],
-            dma_code=rec[12],
-            area_code=rec[13],
-            postal_code=rec[14],
-            region=rec[15],
-            region_name=rec[16],
-            first_name=rec[17],
-            last_name=rec[18],
-            email=rec[19],
-            home_phone=rec[20],
-            cell_phone=rec[21],
-            address1=rec[22],
-            address2=rec[23],
-            city=rec[24],
-            state=rec[25],
-            zip_code=rec[26],
-            credit_range=rec[27],
-            car_year=rec[28] or 0,
-            car_make=rec[29],
-            car_model=rec[30],
-            ppm_type=rec[31],
-            ppm_indicator=rec[32],
-            ppm_segment=rec[33],
-            auto_trans_date=rec[34],
-            last_seen=rec[35],
-            birth_year=rec[36] or 0,
-            income_range=rec[37],
-            home_owner_renter=rec[38],
-            auto_purchase_type=rec[39]
-        )
+        data = IPData(**row_to_dict(rec))
 
         db_session.add(data)
         db_session.commit()
@@ -76,7 +326,6 @@ def read_file(filepath):
     try:
         with open(filepath, 'r') as f1:
             reader = csv.reader(f1, delimiter=',')
-            # [next(reader) for _ in range(57085)]
             for row in reader:
                 write_row(row)
                 counter += 1
@@ -88,15 +337,846 @@ def read_file(filepath):
     return counter
 
 
+def write_batch(session, columns):
+    """
+    Insert a column batch with a single DBAPI executemany of
+    positional rows and commit the batch as one transaction
+    :param session: db session
+    :param columns: dict of column name to list
+    :return: int, None when the batch was rolled back
+    """
+    names = list(columns)
+    rows = list(zip(*columns.values()))
+
+    try:
+        connection = session.connection()
+        marker = '?' if connection.dialect.paramstyle == 'qmark' else '%s'
+        connection.execute(
+            'INSERT INTO {} ({}) VALUES ({})'.format(
+                IPData.__tablename__, ', '.join(names), ', '.join([marker] * len(names))),
+            rows
+        )
+        session.commit()
+        return len(rows)
+
+    except exc.SQLAlchemyError as db_err:
+        session.rollback()
+        print('Database error writing batch of {} rows: {}'.format(len(rows), str(db_err)))
+        return None
+
+
+def iter_records(f1, end=None):
+    """
+    Stream CSV records from a file opened in binary mode, starting
+    at the current position and stopping at the end byte offset
+    Yields each record with the byte offset just past it
+    :param f1: binary file object
+    :param end: int
+    :return: generator of (list, int)
+    """
+    position = [f1.tell()]
+
+    def lines():
+        while end is None or position[0] < end:
+            line = f1.readline()
+            if not line:
+                return
+            position[0] += len(line)
+            yield line.decode('utf-8', 'replace')
+
+    for record in csv.reader(lines(), delimiter=','):
+        yield record, position[0]
+
+
+def split_file(filepath, parts):
+    """
+    Split the file into byte ranges aligned to line boundaries
+    :param filepath:
+    :param parts: int
+    :return: list of (start, end) tuples
+    """
+    size = os.path.getsize(filepath)
+    offsets = [0]
+
+    with open(filepath, 'rb') as f1:
+        for part in range(1, parts):
+            f1.seek(size * part // parts)
+            f1.readline()
+            if offsets[-1] < f1.tell() < size:
+                offsets.append(f1.tell())
+
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if start < end]
+
+
+def checkpoint_path(filepath, shard=None, mode='bulk'):
+    """
+    The sidecar checkpoint file for an import of filepath.  Each
+    import mode has its own file so a delta import never resumes
+    from the offset of a bulk import, or the other way around
+    :param filepath:
+    :param shard: int
+    :param mode: string 'bulk' or 'delta'
+    :return: string
+    """
+    name = '{}.ckpt'.format(filepath) if mode == 'bulk' else '{}.{}.ckpt'.format(filepath, mode)
+    if shard is None:
+        return name
+    return '{}.{}'.format(name, shard)
+
+
+def file_signature(filepath):
+    """
+    Size and modified time, used to detect a changed input file
+    :param filepath:
+    :return: list
+    """
+    stat = os.stat(filepath)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def read_checkpoint(path, filepath, start, end, mode='bulk'):
+    """
+    Load a checkpoint if it belongs to this file, byte range and import mode
+    :param path: checkpoint file
+    :param filepath:
+    :param start: int
+    :param end: int
+    :param mode: string 'bulk' or 'delta'
+    :return: dict or None
+    """
+    try:
+        with open(path, 'r') as f1:
+            checkpoint = json.load(f1)
+
+    except (IOError, ValueError):
+        return None
+
+    if checkpoint.get('mode') != mode:
+        print('Not resuming from {}, it is the checkpoint of a {} import, not {}'.format(
+            path, checkpoint.get('mode') or 'unknown', mode))
+        return None
+
+    if checkpoint.get('file') != file_signature(filepath) or \
+            checkpoint.get('start') != start or checkpoint.get('end') != end:
+        print('Ignoring stale checkpoint {}'.format(path))
+        return None
+
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    """
+    Atomically replace the checkpoint file
+    :param path: checkpoint file
+    :param checkpoint: dict
+    :return: none
+    """
+    checkpoint['updated'] = datetime.now().isoformat()
+    tmp_path = '{}.tmp'.format(path)
+
+    with open(tmp_path, 'w') as f1:
+        json.dump(checkpoint, f1)
+
+    os.replace(tmp_path, path)
+
+
+def import_range(session, filepath, start=0, end=None, batch_size=DEFAULT_BATCH_SIZE,
+                 label='import', checkpoint=None, resume=False, writer=write_batch, mode='bulk'):
+    """
+    Stream a byte range of the csv file and insert the rows in batches
+    Each batch of raw records goes through normalize_columns before
+    it is written.  Only one batch is held in memory at a time.  When a checkpoint
+    file is given, the byte offset and record number are saved after
+    every committed batch and resume seeks straight to the last offset
+    A batch the writer fails to commit stops the range, leaving the
+    checkpoint at the last committed batch for --resume
+    :param session: db session
+    :param filepath:
+    :param start: int
+    :param end: int
+    :param batch_size: int
+    :param label: string
+    :param checkpoint: checkpoint file path
+    :param resume: bool
+    :param writer: function(session, columns) returning the rows written, None on a database error
+    :param mode: string 'bulk' or 'delta', recorded in the checkpoint
+    :return: tuple (rows, errors)
+    """
+    state = None
+    if checkpoint and resume:
+        state = read_checkpoint(checkpoint, filepath, start, end, mode)
+
+    if state:
+        print('[{}] Resuming at byte {}, record {}'.format(label, state['offset'], state['records']))
+    else:
+        state = {'mode': mode, 'file': file_signature(filepath), 'start': start, 'end': end,
+                 'offset': start, 'records': 0, 'rows': 0, 'errors': 0}
+
+    counter = state['rows']
+    errors = state['errors']
+    records = state['records']
+    batch = []
+    started = time.time()
+
+    def flush(offset):
+        columns, invalid = normalize_columns(batch)
+        if invalid:
+            print('[{}] Skipping {} short records'.format(label, invalid))
+        written = writer(session, columns) if columns else 0
+        if written is None:
+            return None
+        state['offset'] = offset
+        state['records'] = records
+        state['rows'] = counter + written
+        state['errors'] = errors + len(batch) - written
+        if checkpoint:
+            write_checkpoint(checkpoint, state)
+        return written
+
+    failed = False
+
+    with open(filepath, 'rb') as f1:
+        f1.seek(state['offset'])
+        offset = state['offset']
+        for record, offset in iter_records(f1, end):
+            records += 1
+            batch.append(record)
+
+            if len(batch) >= batch_size:
+                written = flush(offset)
+                if written is None:
+                    failed = True
+                    break
+                counter += written
+                errors += len(batch) - written
+                batch = []
+                print_rate(counter, started, label)
+
+        if batch and not failed:
+            written = flush(offset)
+            if written is None:
+                failed = True
+            else:
+                counter += written
+                errors += len(batch) - written
+                print_rate(counter, started, label)
+
+        elif checkpoint and not failed:
+            state.update(offset=offset, records=records, rows=counter, errors=errors)
+            write_checkpoint(checkpoint, state)
+
+    if failed:
+        print('[{}] Stopped after a failed batch, the checkpoint is at byte {}, rerun with --resume'.format(
+            label, state['offset']))
+
+    return counter, errors
+
+
+def bulk_import(filepath, batch_size=DEFAULT_BATCH_SIZE, resume=False):
+    """
+    Stream the csv file and insert the rows in batches
+    :param filepath:
+    :param batch_size: int
+    :param resume: bool
+    :return: int
+    """
+    counter = 0
+
+    try:
+        counter, errors = import_range(db_session, filepath, batch_size=batch_size,
+                                       checkpoint=checkpoint_path(filepath), resume=resume)
+        if errors:
+            print('Skipped {} invalid records'.format(errors))
+
+    except IOError as io_err:
+        print('Error accessing the CSV file: {}'.format(str(io_err)))
+
+    # return the row count
+    return counter
+
+
+def write_delta_batch(session, columns, stats):
+    """
+    Upsert a column batch on the natural key (ip, cell_phone), matched
+    through the integer or binary form of the IP address
+    New keys are inserted, rows whose content hash changed are
+    updated and unchanged rows are skipped.  A blank cell phone is
+    part of the key and matches a NULL or empty cell_phone.  Rows
+    without a valid IP address have no natural key and are skipped
+    :param session: db session
+    :param columns: dict of column name to list
+    :param stats: dict of inserted, updated, unchanged and skipped counters
+    :return: int, None when the batch was rolled back
+    """
+    table = IPData.__table__
+    batch = columns_to_rows(columns)
+    rows = OrderedDict()
+
+    # the last occurrence of a key in the batch wins
+    for data in batch:
+        if data['ip_int'] is not None or data['ip6'] is not None:
+            rows[(data['ip_int'], data['ip6'], data['cell_phone'])] = data
+
+    try:
+        existing = dict()
+        query = session.query(IPData.id, IPData.ip_int, IPData.ip6, IPData.cell_phone, IPData.row_hash)
+
+        for ip_column, index in ((IPData.ip_int, 0), (IPData.ip6, 1)):
+            keys = [(key[index], key[2]) for key in rows if key[index] is not None]
+            phones = [key for key in keys if key[1] is not None]
+            blanks = [ip for ip, cell_phone in keys if cell_phone is None]
+
+            # (ip, NULL) IN (...) never matches, so keys without a cell
+            # phone are matched on the ip and a NULL or empty cell_phone
+            lookups = []
+            if phones:
+                lookups.append(tuple_(ip_column, IPData.cell_phone).in_(phones))
+            if blanks:
+                lookups.append(and_(ip_column.in_(blanks), or_(IPData.cell_phone.is_(None), IPData.cell_phone == '')))
+
+            for lookup in lookups:
+                for match in query.filter(lookup).order_by(IPData.id):
+                    existing.setdefault((match.ip_int, match.ip6, match.cell_phone or None), match)
+
+        inserts = []
+        updates = []
+        for key, data in rows.items():
+            match = existing.get(key)
+            if match is None:
+                inserts.append(data)
+            elif match.row_hash != data['row_hash']:
+                values = {'b_{}'.format(name): value for name, value in data.items() if name != 'created_date'}
+                values['b_id'] = match.id
+                updates.append(values)
+
+        if inserts:
+            session.execute(table.insert(), inserts)
+
+        if updates:
+            names = [name for name in updates[0] if name != 'b_id']
+            session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    {name[2:]: bindparam(name) for name in names}
+                ),
+                updates
+            )
+
+        session.commit()
+
+    except exc.SQLAlchemyError as db_err:
+        session.rollback()
+        print('Database error writing delta batch of {} rows: {}'.format(len(batch), str(db_err)))
+        return None
+
+    skipped = len([data for data in batch if data['ip_int'] is None and data['ip6'] is None])
+    stats['inserted'] += len(inserts)
+    stats['updated'] += len(updates)
+    stats['skipped'] += skipped
+    stats['unchanged'] += len(batch) - len(inserts) - len(updates) - skipped
+
+    return len(batch)
+
+
+def delta_import(filepath, batch_size=DEFAULT_BATCH_SIZE, resume=False):
+    """
+    Incremental refresh.  Stream the csv file and upsert each
+    batch so only new and changed rows are written
+    :param filepath:
+    :param batch_size: int
+    :param resume: bool
+    :return: int
+    """
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    counter = 0
+
+    def writer(session, columns):
+        return write_delta_batch(session, columns, stats)
+
+    try:
+        counter, errors = import_range(db_session, filepath, batch_size=batch_size, label='delta',
+                                       checkpoint=checkpoint_path(filepath, mode='delta'), resume=resume,
+                                       writer=writer, mode='delta')
+        if errors:
+            print('Skipped {} invalid records'.format(errors))
+
+    except IOError as io_err:
+        print('Error accessing the CSV file: {}'.format(str(io_err)))
+
+    print('Inserted: {inserted}  Updated: {updated}  Unchanged: {unchanged}  Skipped: {skipped}'.format(**stats))
+
+    # return the row count
+    return counter
+
+
+def import_shard(task):
+    """
+    Process pool worker.  Import one byte range of the csv file
+    over the worker's own database connection
+    :param task: tuple (worker, filepath, start, end, batch_size, resume)
+    :return: dict
+    """
+    worker, filepath, start, end, batch_size, resume = task
+    started = time.time()
+
+    # connections must not be shared with the parent process
+    engine = create_engine(config.SQLALCHEMY_DATABASE_URI, pool_size=1, max_overflow=0)
+    session = sessionmaker(bind=engine)()
+    rows, errors = 0, 0
+
+    try:
+        rows, errors = import_range(session, filepath, start, end, batch_size, 'worker {}'.format(worker),
+                                    checkpoint_path(filepath, worker), resume)
+
+    except IOError as io_err:
+        print('[worker {}] Error accessing the CSV file: {}'.format(worker, str(io_err)))
+
+    finally:
+        session.close()
+        engine.dispose()
+
+    return {
+        'worker': worker,
+        'start': start,
+        'end': end,
+        'rows': rows,
+        'errors': errors,
+        'elapsed': time.time() - started
+    }
+
+
+def parallel_import(filepath, workers, batch_size=DEFAULT_BATCH_SIZE, resume=False):
+    """
+    Split the csv file into line aligned byte ranges and import
+    them concurrently with a pool of worker processes
+    Resuming requires the same number of workers as the original run
+    :param filepath:
+    :param workers: int
+    :param batch_size: int
+    :param resume: bool
+    :return: int
+    """
+    started = time.time()
+    shards = split_file(filepath, workers)
+    tasks = [(worker, filepath, start, end, batch_size, resume) for worker, (start, end) in enumerate(shards)]
+
+    pool = multiprocessing.Pool(len(tasks) or 1)
+    try:
+        results = pool.map(import_shard, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    print_summary(results, time.time() - started)
+
+    # return the row count
+    return sum(result['rows'] for result in results)
+
+
+def tsv_value(value):
+    """
+    Format a column value for LOAD DATA using the default
+    tab separated format with backslash escapes and \\N for NULL
+    Binary values are written as hex for UNHEX() on load
+    :param value:
+    :return: string
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def write_tsv(filepath, tsv_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Normalize the csv records a batch at a time and write them
+    to a tab separated file ready for LOAD DATA
+    :param filepath: vendor csv file
+    :param tsv_path: output file
+    :param batch_size: int
+    :return: tuple (rows, errors)
+    """
+    rows = 0
+    errors = 0
+    created_date = datetime.now()
+
+    def flush(batch):
+        columns, invalid = normalize_columns(batch, created_date)
+        if columns:
+            for values in zip(*[columns[name] for name in NORMALIZED_COLUMNS]):
+                f2.write('\t'.join(map(tsv_value, values)))
+                f2.write('\n')
+        return len(batch) - invalid, invalid
+
+    with open(filepath, 'rb') as f1, open(tsv_path, 'w', encoding='utf-8') as f2:
+        batch = []
+        for record, offset in iter_records(f1):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                written, invalid = flush(batch)
+                rows += written
+                errors += invalid
+                batch = []
+
+        if batch:
+            written, invalid = flush(batch)
+            rows += written
+            errors += invalid
+
+    return rows, errors
+
+
+def load_data(filepath):
+    """
+    Full refresh with MySQL LOAD DATA LOCAL INFILE.  The feed is
+    written to a normalized temporary TSV, loaded into a staging copy
+    of the table and swapped in with one atomic RENAME TABLE, so
+    readers see the old data until the new data is complete
+    :param filepath:
+    :return: int
+    """
+    table = IPData.__tablename__
+    staging = '{}_staging'.format(table)
+    old = '{}_old'.format(table)
+    started = time.time()
+
+    fd, tsv_path = tempfile.mkstemp(prefix='ipdata_', suffix='.tsv')
+    os.close(fd)
+
+    engine = create_engine(config.SQLALCHEMY_DATABASE_URI, connect_args={'local_infile': 1})
+    rows = 0
+
+    try:
+        rows, errors = write_tsv(filepath, tsv_path)
+        print('Wrote {} rows to {} in {:.1f}s, skipped {} invalid records'.format(
+            rows, tsv_path, time.time() - started, errors))
+
+        # never swap an empty table over the live data
+        if not rows:
+            print('No rows to load, {} left unchanged'.format(table))
+            return 0
+
+        with engine.connect() as conn:
+            conn.execute('DROP TABLE IF EXISTS {}'.format(staging))
+            conn.execute('CREATE TABLE {} LIKE {}'.format(staging, table))
+
+            # the TSV uses the LOAD DATA defaults: tab separated, backslash escaped, \N for NULL
+            result = conn.execute(
+                text('LOAD DATA LOCAL INFILE :path INTO TABLE {} CHARACTER SET utf8mb4 ({}) SET {}'.format(
+                    staging,
+                    ', '.join('@' + name if name in BINARY_COLUMNS else name for name in NORMALIZED_COLUMNS),
+                    ', '.join('{0} = UNHEX(@{0})'.format(name) for name in BINARY_COLUMNS))),
+                path=tsv_path
+            )
+            print('Loaded {} rows into {} in {:.1f}s'.format(result.rowcount, staging, time.time() - started))
+
+            conn.execute('DROP TABLE IF EXISTS {}'.format(old))
+            conn.execute('RENAME TABLE {0} TO {1}, {2} TO {0}'.format(table, old, staging))
+            conn.execute('DROP TABLE {}'.format(old))
+            print('Swapped {} into {}'.format(staging, table))
+
+    except exc.SQLAlchemyError as db_err:
+        rows = 0
+        print('Database error loading {}: {}'.format(staging, str(db_err)))
+
+    finally:
+        engine.dispose()
+        os.remove(tsv_path)
+
+    print_rate(rows, started, 'load data')
+
+    # return the row count
+    return rows
+
+
+def print_summary(results, elapsed):
+    """
+    Print the per worker rows, errors and elapsed time
+    :param results: list of dicts
+    :param elapsed: float
+    :return: none
+    """
+    print('{:>6} {:>14} {:>14} {:>12} {:>8} {:>10} {:>10}'.format(
+        'worker', 'start', 'end', 'rows', 'errors', 'elapsed', 'rows/sec'))
+
+    for result in results:
+        rate = result['rows'] / result['elapsed'] if result['elapsed'] > 0 else 0
+        print('{:>6} {:>14} {:>14} {:>12} {:>8} {:>9.1f}s {:>10.0f}'.format(
+            result['worker'], result['start'], result['end'], result['rows'],
+            result['errors'], result['elapsed'], rate))
+
+    rows = sum(result['rows'] for result in results)
+    errors = sum(result['errors'] for result in results)
+    rate = rows / elapsed if elapsed > 0 else 0
+    print('{:>6} {:>14} {:>14} {:>12} {:>8} {:>9.1f}s {:>10.0f}'.format(
+        'total', '', '', rows, errors, elapsed, rate))
+
+
+def build_docs(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Pre-render the append document of every IPData row whose document
+    is missing or stale, walking the table by id a batch at a time,
+    then drop the documents of ids past the end of the table, which
+    a LOAD DATA table swap leaves behind.  Rows without a row_hash
+    are skipped and served from the table
+    :param batch_size: int
+    :return: int
+    """
+    started = time.time()
+    docs = IPDataDoc.__table__
+    counter = 0
+    last_id = 0
+
+    stale = db_session.query(IPData).outerjoin(IPDataDoc, IPDataDoc.ipdata_id == IPData.id).filter(
+        IPData.row_hash.isnot(None),
+        or_(IPDataDoc.ipdata_id.is_(None), IPDataDoc.row_hash != IPData.row_hash)
+    ).order_by(IPData.id)
+
+    while True:
+        rows = stale.filter(IPData.id > last_id).limit(batch_size).all()
+        if not rows:
+            break
+
+        ids = [row.id for row in rows]
+        db_session.execute(docs.delete().where(docs.c.ipdata_id.in_(ids)))
+        db_session.execute(docs.insert(), [
+            {'ipdata_id': row.id, 'row_hash': row.row_hash, 'doc': document_json(ipdata_document(row))}
+            for row in rows
+        ])
+        db_session.commit()
+        db_session.expunge_all()
+
+        counter += len(rows)
+        last_id = ids[-1]
+        print_rate(counter, started, 'docs')
+
+    max_id = db_session.query(func.max(IPData.id)).scalar() or 0
+    db_session.execute(docs.delete().where(docs.c.ipdata_id > max_id))
+    db_session.commit()
+
+    # return the document count
+    return counter
+
+
+def build_summary(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Rebuild the audience summary of every zip code and city.  Each
+    count is one GROUP BY over the table, and the summary is replaced
+    in a single transaction so the API never sees a partial rebuild
+    :param batch_size: int rows per insert
+    :return: int summary rows
+    """
+    started = time.time()
+    counts = Counter()
+
+    # cities are grouped on the name_key and state normalization of
+    # city_area, so every spelling the city lookup matches is one area
+    areas = (
+        (zip_area, (IPData.zip_code,)),
+        (city_area, (func.lower(func.trim(IPData.city)), func.upper(func.trim(IPData.state)))),
+    )
+
+    for area, columns in areas:
+        present = [columns[0].isnot(None), columns[0] != '']
+
+        for row in db_session.query(*columns + (func.count(),)).filter(*present).group_by(*columns):
+            counts[(area(*row[:-1]), 'total', '')] += row[-1]
+
+        for dimension in SUMMARY_DIMENSIONS:
+            field = getattr(IPData, dimension)
+            query = db_session.query(*columns + (field, func.count())).filter(
+                field.isnot(None), field != '', *present
+            ).group_by(*columns + (field,))
+
+            for row in query:
+                counts[(area(*row[:-2]), dimension, row[-2])] += row[-1]
+
+    summary = AudienceSummary.__table__
+    db_session.execute(summary.delete())
+
+    rows = [
+        {'area': area, 'dimension': dimension, 'value': value, 'count': count}
+        for (area, dimension, value), count in counts.items()
+    ]
+    for start in range(0, len(rows), batch_size):
+        db_session.execute(summary.insert(), rows[start:start + batch_size])
+
+    db_session.commit()
+    print_rate(len(rows), started, 'summary')
+
+    # return the summary row count
+    return len(rows)
+
+
+def bump_data_version(session):
+    """
+    Increment the data version after an import so the API
+    processes drop their cached lookups
+    :param session:
+    :return: int: the new version or None
+    """
+    table = DataVersion.__table__
+
+    try:
+        updated = session.execute(
+            table.update().where(table.c.id == 1).values(version=table.c.version + 1, updated=datetime.now())
+        ).rowcount
+        if not updated:
+            session.execute(table.insert().values(id=1, version=1, updated=datetime.now()))
+        session.commit()
+
+        return session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+
+    except exc.SQLAlchemyError as db_err:
+        session.rollback()
+        print('Database error updating the data version: {}'.format(str(db_err)))
+
+
+def print_rate(counter, started, label='import'):
+    """
+    Print the running row count and throughput
+    :param counter: int
+    :param started: float
+    :param label: string
+    :return: none
+    """
+    elapsed = time.time() - started
+    rate = counter / elapsed if elapsed > 0 else 0
+    print('[{}] Imported {} rows in {:.1f}s ({:.0f} rows/sec)'.format(label, counter, elapsed, rate))
+
+
+def benchmark(filepath, limit=100000, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Compare the per row mapping used by write_row with the columnar
+    normalization used by the batch import modes, up to the parameters
+    handed to executemany.  No database access, the per-row parameters
+    are processed by an insert compiled for the MySQL dialect
+    :param filepath:
+    :param limit: number of records to read
+    :param batch_size: int
+    :return: int
+    """
+    records = []
+    with open(filepath, 'rb') as f1:
+        for record, offset in iter_records(f1):
+            records.append(record)
+            if len(records) >= limit:
+                break
+
+    created_date = datetime.now()
+    compiled = IPData.__table__.insert().compile(dialect=mysql.dialect(), column_keys=list(NORMALIZED_COLUMNS))
+
+    # per-row mapping into dicts, then the per-row parameter
+    # processing a Core insert executemany does for each dict
+    started = time.time()
+    for pos in range(0, len(records), batch_size):
+        batch = []
+        for rec in records[pos:pos + batch_size]:
+            try:
+                batch.append(row_to_dict(rec, created_date))
+            except IndexError:
+                pass
+        batch = [compiled.construct_params(data) for data in batch]
+    row_elapsed = time.time() - started
+
+    # columnar normalization into the positional rows write_batch sends
+    started = time.time()
+    for pos in range(0, len(records), batch_size):
+        columns, invalid = normalize_columns(records[pos:pos + batch_size], created_date)
+        batch = list(zip(*columns.values()))
+    column_elapsed = time.time() - started
+
+    row_rate = len(records) / row_elapsed if row_elapsed > 0 else 0
+    column_rate = len(records) / column_elapsed if column_elapsed > 0 else 0
+    print('{:<10} {:>10} {:>10} {:>12}'.format('path', 'rows', 'elapsed', 'rows/sec'))
+    print('{:<10} {:>10} {:>9.2f}s {:>12.0f}'.format('per-row', len(records), row_elapsed, row_rate))
+    print('{:<10} {:>10} {:>9.2f}s {:>12.0f}'.format('columnar', len(records), column_elapsed, column_rate))
+
+    return len(records)
+
+
+def parse_args():
+    """
+    Parse the command line options
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='M3 data import engine')
+    parser.add_argument('filepath', nargs='?', default=DEFAULT_FILEPATH,
+                        help='path to the vendor CSV file')
+    parser.add_argument('--bulk', action='store_true',
+                        help='stream the file and insert rows in batches')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per insert batch in bulk mode')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='import in parallel with N worker processes')
+    parser.add_argument('--load-data', action='store_true',
+                        help='full refresh with LOAD DATA into a staging table that is swapped in')
+    parser.add_argument('--delta', action='store_true',
+                        help='upsert on (ip, cell_phone) and skip unchanged rows')
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', default=0,
+                        help='time per-row against columnar normalization on the first ROWS records')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint of a bulk, delta or parallel import')
+    parser.add_argument('--build-docs', action='store_true',
+                        help='only pre-render the missing and stale append documents')
+    parser.add_argument('--summary', action='store_true',
+                        help='rebuild the zip code and city audience summary after the import')
+    parser.add_argument('--build-summary', action='store_true',
+                        help='only rebuild the zip code and city audience summary')
+    return parser.parse_args()
+
+
 def main():
     """
     Program entry point
     :return:
     """
-    filepath = '/home/craigderington/Downloads/IPData.csv'
+    args = parse_args()
 
     try:
-        print('Imported {} records successfully'.format(read_file(filepath)))
+        if args.build_docs:
+            counter = build_docs(max(args.batch_size, 1))
+            print('Rendered {} documents'.format(counter))
+            return
+
+        if args.build_summary:
+            counter = build_summary(max(args.batch_size, 1))
+            print('Built {} audience summary rows'.format(counter))
+            return
+
+        if args.benchmark > 0:
+            benchmark(args.filepath, args.benchmark, max(args.batch_size, 1))
+            return
+
+        if args.load_data:
+            counter = load_data(args.filepath)
+        elif args.delta:
+            counter = delta_import(args.filepath, max(args.batch_size, 1), args.resume)
+        elif args.workers > 0:
+            counter = parallel_import(args.filepath, args.workers, max(args.batch_size, 1), args.resume)
+        elif args.bulk or args.resume:
+            counter = bulk_import(args.filepath, max(args.batch_size, 1), args.resume)
+        else:
+            counter = read_file(args.filepath)
+
+        print('Imported {} records successfully'.format(counter))
+
+        if counter and getattr(config, 'RESPONSE_DOCS', False):
+            print('Rendered {} documents'.format(build_docs(max(args.batch_size, 1))))
+
+        # every count is a full table GROUP BY, so only on request
+        if counter and (args.summary or getattr(config, 'AUDIENCE_SUMMARY', False)):
+            print('Built {} audience summary rows'.format(build_summary(max(args.batch_size, 1))))
+
+        # invalidate the API lookup caches
+        if counter:
+            print('Data version is now {}'.format(bump_data_version(db_session)))
 
     except IOError as io_err:
         print('Error accessing the import file: {}'.format(str(io_err)))
@@ -0,0 +1,117 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import math
+
+# mean earth radius
+EARTH_RADIUS_KM = 6371.0088
+
+# grid cells per degree of latitude and longitude, 0.1 degree cells
+# are about 11 km high, so a radius search covers a few dozen cells
+CELLS_PER_DEGREE = 10
+
+# cells in one row of the grid, from -180 to 180 degrees longitude
+ROW_CELLS = 360 * CELLS_PER_DEGREE
+
+# rows in the grid, from -90 to 90 degrees latitude
+GRID_ROWS = 180 * CELLS_PER_DEGREE
+
+# km per degree of latitude
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def grid_row(lat):
+    """
+    The grid row of a latitude
+    :param lat: float
+    :return: int
+    """
+    return min(int(math.floor((lat + 90.0) * CELLS_PER_DEGREE)), GRID_ROWS - 1)
+
+
+def grid_column(lng):
+    """
+    The grid column of a longitude
+    :param lng: float
+    :return: int
+    """
+    return min(int(math.floor((lng + 180.0) * CELLS_PER_DEGREE)), ROW_CELLS - 1)
+
+
+def geo_cell(lat, lng):
+    """
+    The grid cell of a point, stored in the indexed IPData.geo_cell
+    Cells are numbered row by row, so the cells of one row of a
+    bounding box are a single range of integers
+    :param lat: float
+    :param lng: float
+    :return: int or None
+    """
+    if lat is None or lng is None:
+        return None
+
+    return grid_row(lat) * ROW_CELLS + grid_column(lng)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great circle distance between two points
+    :return: float km
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, km):
+    """
+    The latitude and longitude range holding every point within km
+    Boxes reaching a pole or crossing the antimeridian span all longitudes
+    :param lat: float
+    :param lng: float
+    :param km: float
+    :return: tuple (min_lat, max_lat, min_lng, max_lng)
+    """
+    d_lat = km / KM_PER_DEGREE
+    min_lat = max(lat - d_lat, -90.0)
+    max_lat = min(lat + d_lat, 90.0)
+
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    d_lng = math.degrees(math.asin(min(1.0, math.sin(km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lng = lng - d_lng
+    max_lng = lng + d_lng
+
+    if min_lng < -180.0 or max_lng > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def cell_ranges(box):
+    """
+    The geo_cell ranges covering a bounding box, one per grid row
+    Rows spanning every longitude are merged into a single range
+    :param box: tuple (min_lat, max_lat, min_lng, max_lng)
+    :return: list of tuples (first cell, last cell)
+    """
+    min_lat, max_lat, min_lng, max_lng = box
+    first_column = grid_column(min_lng)
+    last_column = grid_column(max_lng)
+    ranges = []
+
+    for row in range(grid_row(min_lat), grid_row(max_lat) + 1):
+        first = row * ROW_CELLS + first_column
+        last = row * ROW_CELLS + last_column
+
+        if ranges and ranges[-1][1] + 1 == first:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+
+    return ranges
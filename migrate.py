@@ -0,0 +1,272 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+from db import db_session
+from models import AppendJob, AudienceSummary, DataVersion, IPDataDoc, UsageRollup
+from address import address_key
+from name_index import name_phonetic
+from sqlalchemy import exc
+from datetime import datetime
+
+
+def create_tables(*tables):
+    """
+    A migration step that creates new tables if they do not exist
+    :param tables: sqlalchemy Table
+    :return: function(session)
+    """
+    def create_tables(session):
+        for table in tables:
+            table.create(session.get_bind(), checkfirst=True)
+    return create_tables
+
+
+def backfill(name, statement, batch_size=50000):
+    """
+    A migration step that runs an UPDATE of ipdata one id range at
+    a time, committing each range to keep row locks short
+    :param name: step name
+    :param statement: UPDATE with :start and :end id range parameters
+    :param batch_size: int
+    :return: function(session)
+    """
+    def backfill(session):
+        max_id = session.execute('SELECT MAX(id) FROM ipdata').scalar() or 0
+
+        for start in range(0, max_id, batch_size):
+            session.execute(statement, {'start': start, 'end': start + batch_size})
+            session.commit()
+
+    backfill.__name__ = name
+    return backfill
+
+
+def backfill_rows(name, columns, values, batch_size=10000):
+    """
+    A migration step for values only python can compute.  Each id
+    range of ipdata is read, and the values of its rows are written
+    back with one executemany UPDATE and committed
+    :param name: step name
+    :param columns: ipdata column names passed to values
+    :param values: function(row) returning a dict of column values
+    :param batch_size: int
+    :return: function(session)
+    """
+    def backfill(session):
+        max_id = session.execute('SELECT MAX(id) FROM ipdata').scalar() or 0
+        select = 'SELECT id, {} FROM ipdata WHERE id > :start AND id <= :end'.format(', '.join(columns))
+
+        for start in range(0, max_id, batch_size):
+            params = []
+            for row in session.execute(select, {'start': start, 'end': start + batch_size}):
+                params.append(dict(values(row), row_id=row.id))
+
+            if params:
+                session.execute('UPDATE ipdata SET {} WHERE id = :row_id'.format(
+                    ', '.join('{0} = :{0}'.format(column) for column in params[0] if column != 'row_id')
+                ), params)
+            session.commit()
+
+    backfill.__name__ = name
+    return backfill
+
+
+# schema changes for existing MySQL tables, applied in order
+# each step is a DDL statement or a function(session) for backfills
+# steps are recorded by position, so only ever append to a migration
+# that has not been released
+# ALGORITHM=INPLACE, LOCK=NONE keeps the table readable and writable
+MIGRATIONS = (
+    ('0001_ipdata_row_hash', (
+        'ALTER TABLE ipdata ADD COLUMN row_hash VARCHAR(40) NULL, '
+        'ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0002_append_jobs', (
+        create_tables(AppendJob.__table__),
+    )),
+    ('0003_data_version', (
+        create_tables(DataVersion.__table__),
+    )),
+    ('0004_ipdata_docs', (
+        create_tables(IPDataDoc.__table__),
+    )),
+    ('0005_ipdata_lookup_indexes', (
+        'ALTER TABLE ipdata ADD COLUMN first_name_key VARCHAR(255) NULL, '
+        'ADD COLUMN last_name_key VARCHAR(255) NULL, ALGORITHM=INPLACE, LOCK=NONE',
+        backfill(
+            'backfill_name_keys',
+            'UPDATE ipdata SET first_name_key = NULLIF(LOWER(TRIM(first_name)), \'\'), '
+            'last_name_key = NULLIF(LOWER(TRIM(last_name)), \'\') WHERE id > :start AND id <= :end'
+        ),
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_cell_phone (cell_phone), '
+        'ADD INDEX ix_ipdata_name_key (last_name_key, first_name_key), '
+        'ADD INDEX ix_ipdata_lat_lng (latitude, longitude), ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0006_ipdata_ip_int', (
+        'ALTER TABLE ipdata MODIFY ip VARCHAR(45) NULL, '
+        'ADD COLUMN ip_int INT UNSIGNED NULL, ADD COLUMN ip6 VARBINARY(16) NULL, ALGORITHM=INPLACE, LOCK=NONE',
+        backfill(
+            'backfill_ip_int',
+            'UPDATE ipdata SET ip_int = IF(IS_IPV4(TRIM(ip)), INET_ATON(TRIM(ip)), NULL), '
+            'ip6 = IF(IS_IPV6(TRIM(ip)), INET6_ATON(TRIM(ip)), NULL) WHERE id > :start AND id <= :end'
+        ),
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_ip_int (ip_int), ADD INDEX ix_ipdata_ip6 (ip6), '
+        'ALGORITHM=INPLACE, LOCK=NONE',
+        'ALTER TABLE ipdata DROP INDEX ix_ipdata_ip, ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0007_ipdata_geo_cell', (
+        'ALTER TABLE ipdata ADD COLUMN geo_cell INT NULL, ALGORITHM=INPLACE, LOCK=NONE',
+        backfill(
+            'backfill_geo_cell',
+            'UPDATE ipdata SET geo_cell = '
+            'LEAST(FLOOR((latitude + 90) * 10), 1799) * 3600 + LEAST(FLOOR((longitude + 180) * 10), 3599) '
+            'WHERE latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180 '
+            'AND id > :start AND id <= :end'
+        ),
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_geo_cell (geo_cell, latitude, longitude), '
+        'ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0008_audience_lookups', (
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_zip_code (zip_code), '
+        'ADD INDEX ix_ipdata_city_state (city, state), ALGORITHM=INPLACE, LOCK=NONE',
+        create_tables(AudienceSummary.__table__),
+    )),
+    ('0009_ipdata_name_phonetic', (
+        'ALTER TABLE ipdata ADD COLUMN name_phonetic VARCHAR(8) NULL, ALGORITHM=INPLACE, LOCK=NONE',
+        backfill_rows(
+            'backfill_name_phonetic', ('first_name', 'last_name'),
+            lambda row: {'name_phonetic': name_phonetic(row.first_name, row.last_name)}
+        ),
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_name_phonetic (name_phonetic), ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0010_ipdata_addr_key', (
+        'ALTER TABLE ipdata ADD COLUMN addr_key VARCHAR(40) NULL, ALGORITHM=INPLACE, LOCK=NONE',
+        backfill_rows(
+            'backfill_addr_key', ('address1', 'address2', 'zip_code'),
+            lambda row: {'addr_key': address_key(row.address1, row.address2, row.zip_code)}
+        ),
+        'ALTER TABLE ipdata ADD INDEX ix_ipdata_addr_key (addr_key), ALGORITHM=INPLACE, LOCK=NONE',
+    )),
+    ('0011_usage_rollups', (
+        'ALTER TABLE log ADD INDEX ix_log_log_date (log_date), ALGORITHM=INPLACE, LOCK=NONE',
+        create_tables(UsageRollup.__table__),
+        # hour and day buckets of the existing log, minute buckets start with the writer
+        'INSERT INTO usage_rollups (user_id, period, bucket, resource, count) '
+        'SELECT user_id, \'hour\', DATE(log_date) + INTERVAL HOUR(log_date) HOUR, resource, COUNT(*) '
+        'FROM log GROUP BY user_id, DATE(log_date) + INTERVAL HOUR(log_date) HOUR, resource',
+        'INSERT INTO usage_rollups (user_id, period, bucket, resource, count) '
+        'SELECT user_id, \'day\', DATE(log_date), resource, COUNT(*) '
+        'FROM log GROUP BY user_id, DATE(log_date), resource',
+    )),
+)
+
+
+def applied_migrations():
+    """
+    The names of the migrations and migration steps already applied
+    :return: set
+    """
+    db_session.execute(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'name VARCHAR(100) NOT NULL PRIMARY KEY, applied DATETIME NOT NULL)'
+    )
+    return set(row[0] for row in db_session.execute('SELECT name FROM schema_migrations'))
+
+
+def step_name(name, index):
+    """
+    The schema_migrations name recording one step of a migration
+    :param name: migration name
+    :param index: int position of the step
+    :return: string
+    """
+    return '{}/{}'.format(name, index)
+
+
+def record_migration(name):
+    """
+    Record a migration or migration step as applied
+    :param name: string
+    :return: none
+    """
+    db_session.execute(
+        'INSERT INTO schema_migrations (name, applied) VALUES (:name, :applied)',
+        {'name': name, 'applied': datetime.now()}
+    )
+    db_session.commit()
+
+
+def apply_migration(name, steps, applied=()):
+    """
+    Run each step of the migration and record it as applied.  MySQL
+    commits every DDL statement on its own, so each step is recorded
+    as it completes and a rerun after a failure skips the steps
+    already done instead of repeating their ADD COLUMN or ADD INDEX
+    :param name: string
+    :param steps: tuple
+    :param applied: set of the migrations and steps already applied
+    :return: none
+    """
+    for index, step in enumerate(steps):
+        if step_name(name, index) in applied:
+            continue
+
+        if callable(step):
+            print('[{}] {}'.format(name, step.__name__))
+            step(db_session)
+        else:
+            print('[{}] {}'.format(name, step))
+            db_session.execute(step)
+
+        record_migration(step_name(name, index))
+
+    record_migration(name)
+
+
+def index_sizes(table='ipdata'):
+    """
+    The on-disk size of each index of a table from the InnoDB
+    persistent statistics, refreshed with ANALYZE TABLE first
+    :param table: string
+    :return: list of (index name, bytes)
+    """
+    db_session.execute('ANALYZE TABLE {}'.format(table))
+    return [tuple(row) for row in db_session.execute(
+        'SELECT index_name, stat_value * @@innodb_page_size FROM mysql.innodb_index_stats '
+        'WHERE database_name = DATABASE() AND table_name = :table AND stat_name = \'size\' '
+        'ORDER BY index_name', {'table': table}
+    )]
+
+
+def main():
+    """
+    Program entry point
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='M3 schema migrations')
+    parser.add_argument('--list', action='store_true', help='list migrations and exit')
+    parser.add_argument('--index-sizes', action='store_true', help='print the size of each ipdata index and exit')
+    args = parser.parse_args()
+
+    try:
+        if args.index_sizes:
+            for name, size in index_sizes():
+                print('{:<32} {:>10.1f} MB'.format(name, size / 1048576.0))
+            return
+
+        applied = applied_migrations()
+
+        for name, steps in MIGRATIONS:
+            if args.list:
+                print('{} {}'.format('[x]' if name in applied else '[ ]', name))
+            elif name not in applied:
+                apply_migration(name, steps, applied)
+
+    except exc.SQLAlchemyError as db_err:
+        db_session.rollback()
+        print('Database error running migrations: {}'.format(str(db_err)))
+
+
+if __name__ == '__main__':
+    main()
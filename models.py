@@ -1,6 +1,11 @@
 from db import Base
+from collections import OrderedDict
+from address import format_address
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float
+from flask import json
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float, Index, LargeBinary, \
+    VARBINARY
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
@@ -65,7 +70,10 @@ class IPData(Base):
     __tablename__ = 'ipdata'
     id = Column(Integer, primary_key=True)
     created_date = Column(DateTime, onupdate=datetime.now)
-    ip = Column(String(15), index=True)
+    ip = Column(String(45))
+    ip_int = Column(Integer().with_variant(mysql.INTEGER(unsigned=True), 'mysql'))
+    ip6 = Column(VARBINARY(16))
+    geo_cell = Column(Integer)
     user_agent = Column(String(255))
     first_name = Column(String(255))
     last_name = Column(String(255))
@@ -106,6 +114,28 @@ class IPData(Base):
     auto_purchase_type = Column(String(100))
     processed = Column(Boolean, default=False)
     validated = Column(Boolean, default=False)
+    row_hash = Column(String(40))
+    first_name_key = Column(String(255))
+    last_name_key = Column(String(255))
+    name_phonetic = Column(String(8))
+    addr_key = Column(String(40))
+
+    # one index per lookup path in app.py.  IPv4 addresses are
+    # matched on ip_int and IPv6 addresses on ip6.  The few rows of an
+    # IP are enough for the (ip, cell_phone) key of delta imports, so
+    # the IP indexes carry no phone and stay as small as possible
+    __table_args__ = (
+        Index('ix_ipdata_ip_int', 'ip_int'),
+        Index('ix_ipdata_ip6', 'ip6'),
+        Index('ix_ipdata_cell_phone', 'cell_phone'),
+        Index('ix_ipdata_name_key', 'last_name_key', 'first_name_key'),
+        Index('ix_ipdata_name_phonetic', 'name_phonetic'),
+        Index('ix_ipdata_addr_key', 'addr_key'),
+        Index('ix_ipdata_lat_lng', 'latitude', 'longitude'),
+        Index('ix_ipdata_geo_cell', 'geo_cell', 'latitude', 'longitude'),
+        Index('ix_ipdata_zip_code', 'zip_code'),
+        Index('ix_ipdata_city_state', 'city', 'state'),
+    )
 
     def __repr__(self):
         return 'Visitor from {} on {}'.format(
@@ -122,10 +152,10 @@ class IPData(Base):
 
     def person_location(self):
         if self.address1:
-            return '{} {} {} {} {}'.format(
+            return format_address(
                 self.address1,
                 self.address2,
-                self.city, self.state, self.zip_code
+                self.city, self.state, self.zip_code, self.zip_4
             )
 
     def contact_info(self):
@@ -175,6 +205,142 @@ class IPData(Base):
         )
 
 
+def name_key(value):
+    """
+    The case-normalized lookup key of a first or last name
+    :param value: string
+    :return: string or None
+    """
+    if value:
+        return value.strip().lower() or None
+
+
+# IPData fields counted per zip code and city in the audience summary
+SUMMARY_DIMENSIONS = ('income_range', 'credit_range', 'car_make')
+
+
+def zip_area(zip_code):
+    """
+    The audience summary area of a zip code
+    :param zip_code: string
+    :return: string
+    """
+    return 'zip:{}'.format(zip_code)
+
+
+def city_area(city, state=None):
+    """
+    The audience summary area of a city.  The area of a city without
+    a state is the prefix of the areas of that city in every state
+    :param city: string
+    :param state: string
+    :return: string
+    """
+    return 'city:{}:{}'.format(name_key(city) or '', (state or '').strip().upper())
+
+
+# top level IPData fields of the append document
+DOCUMENT_FIELDS = ('created_date', 'last_seen', 'ip')
+
+# IPData fields in each section of the append document
+DOCUMENT_SECTIONS = (
+    ('person', (
+        'first_name', 'last_name', 'address1', 'address2', 'city', 'state', 'zip_code',
+        'home_phone', 'cell_phone', 'birth_year', 'credit_range', 'income_range', 'home_owner_renter'
+    )),
+    ('geo', (
+        'latitude', 'longitude', 'time_zone', 'metro_code', 'country_name', 'country_code',
+        'country_code3', 'dma_code', 'area_code', 'region', 'region_name'
+    )),
+    ('auto', (
+        'car_year', 'car_make', 'car_model', 'ppm_type', 'ppm_indicator', 'ppm_segment',
+        'auto_trans_date', 'auto_purchase_type'
+    )),
+)
+
+# column names of a flattened append document, section
+# fields are prefixed with the section name
+DOCUMENT_COLUMNS = DOCUMENT_FIELDS + tuple(
+    '{}_{}'.format(section, name) for section, fields in DOCUMENT_SECTIONS for name in fields
+)
+
+
+# names of the append document sections a response can be limited to
+DOCUMENT_PROFILES = tuple(section for section, fields in DOCUMENT_SECTIONS)
+
+
+def profile_columns(sections=None, extra=()):
+    """
+    The IPData columns needed to render an append document limited
+    to the named sections, plus any extra column names
+    :param sections: iterable of section names, None for all
+    :param extra: tuple of column names
+    :return: list of IPData columns
+    """
+    names = list(extra) + list(DOCUMENT_FIELDS)
+
+    for section, fields in DOCUMENT_SECTIONS:
+        if sections is None or section in sections:
+            names.extend(fields)
+
+    return [getattr(IPData, name) for name in OrderedDict.fromkeys(names)]
+
+
+def query_profile(session, sections=None, extra=()):
+    """
+    Query only the IPData columns of a response profile.  Rows are
+    returned as named tuples instead of instrumented IPData objects
+    :param session: sqlalchemy session
+    :param sections: iterable of section names, None for all
+    :param extra: tuple of column names
+    :return: sqlalchemy Query
+    """
+    return session.query(*profile_columns(sections, extra))
+
+
+def ipdata_document(data, sections=None):
+    """
+    The append document for an IPData row, shared by the API views
+    :param data: IPData or a named row from query_profile
+    :param sections: iterable of section names, None for all
+    :return: dict
+    """
+    doc = {name: getattr(data, name) for name in DOCUMENT_FIELDS}
+
+    for section, fields in DOCUMENT_SECTIONS:
+        if sections is None or section in sections:
+            doc[section] = {name: getattr(data, name) for name in fields}
+
+    if 'person' in doc and doc['person']['state']:
+        doc['person']['state'] = doc['person']['state'].upper()
+
+    return doc
+
+
+def flatten_document(doc):
+    """
+    Flatten an append document into a list of values
+    in the order of DOCUMENT_COLUMNS
+    :param doc: dict
+    :return: list
+    """
+    values = [doc[name] for name in DOCUMENT_FIELDS]
+
+    for section, fields in DOCUMENT_SECTIONS:
+        values.extend(doc[section][name] for name in fields)
+
+    return values
+
+
+def document_json(doc):
+    """
+    Serialize an append document the way the API renders it
+    :param doc: dict
+    :return: bytes
+    """
+    return json.dumps(doc, separators=(',', ':')).encode('utf-8')
+
+
 class APILog(Base):
     """
     The API access log
@@ -187,6 +353,11 @@ class APILog(Base):
     log_date = Column(DateTime, default=datetime.now())
     resource = Column(String(64), default='ipdata')
 
+    # rows past the retention window are pruned by log_date
+    __table_args__ = (
+        Index('ix_log_log_date', 'log_date'),
+    )
+
     def _repr__(self):
         if self.id and self.log_date:
             return 'ID: {}, Date: {}, User: {}, Resource: {}'.format(
@@ -195,3 +366,126 @@ class APILog(Base):
                 self.username,
                 self.resource
             )
+
+
+class UsageRollup(Base):
+    """
+    Access log counts per user and resource in minute, hour and day
+    buckets, kept up to date by the access log writer so usage reports
+    never scan the log table
+    """
+    __tablename__ = 'usage_rollups'
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    period = Column(String(6), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    resource = Column(String(64), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    # rollups past their retention window are pruned by period and bucket
+    __table_args__ = (
+        Index('ix_usage_rollups_period_bucket', 'period', 'bucket'),
+    )
+
+    def __repr__(self):
+        return '{} {} {} {}: {}'.format(
+            self.user_id,
+            self.resource,
+            self.period,
+            self.bucket,
+            self.count
+        )
+
+
+class AppendJob(Base):
+    """
+    An asynchronous list append job
+    """
+    __tablename__ = 'append_jobs'
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    username = relationship('User')
+    kind = Column(String(10), nullable=False)
+    key_columns = Column(String(255), nullable=False)
+    status = Column(String(20), default='pending')
+    filename = Column(String(255))
+    input_path = Column(String(1024))
+    output_path = Column(String(1024))
+    total_rows = Column(Integer, default=0)
+    processed_rows = Column(Integer, default=0)
+    matched_rows = Column(Integer, default=0)
+    error = Column(Text)
+    created_date = Column(DateTime, default=datetime.now)
+    finished_date = Column(DateTime)
+
+    def __repr__(self):
+        return 'Append job {} ({}) {}'.format(
+            self.id,
+            self.kind,
+            self.status
+        )
+
+
+class DataVersion(Base):
+    """
+    A single row counter bumped by the importer after every load
+    so the API processes know to drop their cached lookups
+    """
+    __tablename__ = 'data_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return 'Data version {} at {}'.format(
+            self.version,
+            self.updated
+        )
+
+
+class IPDataDoc(Base):
+    """
+    The pre-rendered append document of an IPData row, built by
+    converter.py --build-docs.  A document is only valid while its
+    row_hash matches the row it was rendered from
+    """
+    __tablename__ = 'ipdata_docs'
+
+    ipdata_id = Column(Integer, primary_key=True, autoincrement=False)
+    row_hash = Column(String(40), nullable=False)
+    doc = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return 'Document for ipdata {}'.format(
+            self.ipdata_id
+        )
+
+
+class AudienceSummary(Base):
+    """
+    Precomputed audience counts of each zip code and city, rebuilt by
+    converter.py --build-summary or after an import with --summary.  A row counts the IPData rows of
+    an area with one value of a SUMMARY_DIMENSIONS field, the 'total'
+    dimension counts every row of the area
+    """
+    __tablename__ = 'audience_summary'
+
+    id = Column(Integer, primary_key=True)
+    area = Column(String(300), nullable=False)
+    dimension = Column(String(20), nullable=False)
+    value = Column(String(255), nullable=False, default='')
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_audience_summary_area', 'area', 'dimension'),
+    )
+
+    def __repr__(self):
+        return '{} {} {}: {}'.format(
+            self.area,
+            self.dimension,
+            self.value,
+            self.count
+        )
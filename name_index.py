@@ -0,0 +1,249 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import unicodedata
+
+# given names and the nicknames that resolve to them
+NICKNAMES = {
+    'abigail': ('abby', 'abbie', 'gail'),
+    'albert': ('al', 'bert'),
+    'alexander': ('alex', 'xander', 'sandy'),
+    'alexandra': ('alexa', 'lexi', 'sandra'),
+    'andrew': ('andy', 'drew'),
+    'anthony': ('tony',),
+    'barbara': ('barb', 'babs'),
+    'benjamin': ('ben', 'benji', 'benny'),
+    'catherine': ('cathy', 'kate', 'katie', 'kathy', 'katherine', 'kathryn', 'cat'),
+    'charles': ('charlie', 'chuck', 'chas'),
+    'christopher': ('chris', 'topher'),
+    'christine': ('chris', 'christy', 'tina'),
+    'daniel': ('dan', 'danny'),
+    'david': ('dave', 'davey'),
+    'deborah': ('deb', 'debbie', 'debra'),
+    'donald': ('don', 'donnie'),
+    'dorothy': ('dot', 'dottie'),
+    'edward': ('ed', 'eddie', 'ned', 'ted'),
+    'elizabeth': ('liz', 'lizzie', 'beth', 'betty', 'betsy', 'eliza', 'libby'),
+    'frederick': ('fred', 'freddie'),
+    'gregory': ('greg',),
+    'henry': ('hank', 'harry'),
+    'james': ('jim', 'jimmy', 'jamie'),
+    'jennifer': ('jen', 'jenny'),
+    'jessica': ('jess', 'jessie'),
+    'john': ('jack', 'johnny', 'jon'),
+    'jonathan': ('jon', 'jonny'),
+    'joseph': ('joe', 'joey'),
+    'joshua': ('josh',),
+    'kenneth': ('ken', 'kenny'),
+    'lawrence': ('larry',),
+    'margaret': ('maggie', 'meg', 'peggy', 'marge', 'margie'),
+    'matthew': ('matt',),
+    'michael': ('mike', 'mikey', 'mick'),
+    'nicholas': ('nick', 'nicky'),
+    'patricia': ('pat', 'patty', 'tricia', 'trish'),
+    'patrick': ('pat', 'paddy'),
+    'peter': ('pete',),
+    'rebecca': ('becky', 'becca'),
+    'richard': ('rick', 'ricky', 'rich', 'dick'),
+    'robert': ('bob', 'bobby', 'rob', 'robbie', 'bert'),
+    'ronald': ('ron', 'ronnie'),
+    'samuel': ('sam', 'sammy'),
+    'stephen': ('steve', 'steven', 'stevie'),
+    'susan': ('sue', 'susie', 'suzanne'),
+    'theodore': ('ted', 'teddy', 'theo'),
+    'thomas': ('tom', 'tommy'),
+    'timothy': ('tim', 'timmy'),
+    'victoria': ('vicky', 'tori'),
+    'william': ('bill', 'billy', 'will', 'willy', 'liam'),
+}
+
+# nickname to given name, the first given name listed wins
+CANONICAL_NAMES = dict()
+for _name in sorted(NICKNAMES):
+    for _nickname in NICKNAMES[_name]:
+        CANONICAL_NAMES.setdefault(_nickname, _name)
+
+# generational suffixes dropped from the end of a name
+NAME_SUFFIXES = frozenset(('jr', 'sr', 'ii', 'iii', 'iv', 'v'))
+
+# soundex digit of each consonant, vowels and h, w, y have none
+SOUNDEX_CODES = dict(
+    (letter, str(code))
+    for code, letters in enumerate(('', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+    for letter in letters
+)
+
+NAME_SEPARATORS_RE = re.compile(r'[\s\-_.,/]+')
+NON_LETTERS_RE = re.compile(r'[^a-z ]')
+
+# weight of the last name in the score of a candidate
+LAST_NAME_WEIGHT = 0.6
+
+
+def normalize_name(value):
+    """
+    Fold a name to lower case ascii letters and single spaces, e.g.
+    "  O'Brien-Smith Jr. " -> "obrien smith"
+    :param value: string
+    :return: string, empty when nothing is left
+    """
+    if not value:
+        return ''
+
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char)).lower()
+    value = NON_LETTERS_RE.sub('', NAME_SEPARATORS_RE.sub(' ', value))
+    words = value.split()
+
+    while len(words) > 1 and words[-1] in NAME_SUFFIXES:
+        words.pop()
+
+    return ' '.join(words)
+
+
+def canonical_first_name(value):
+    """
+    The normalized given name of a first name or nickname
+    :param value: string
+    :return: string
+    """
+    name = normalize_name(value)
+    return CANONICAL_NAMES.get(name, name)
+
+
+def soundex(value):
+    """
+    American soundex code of a normalized name, e.g. smyth -> S530
+    :param value: string
+    :return: string, empty for an empty name
+    """
+    letters = value.replace(' ', '')
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    last = SOUNDEX_CODES.get(letters[0], '')
+
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code
+        if letter not in 'hw':
+            last = digit
+
+    return code.ljust(4, '0')
+
+
+def name_phonetic(first_name, last_name):
+    """
+    The indexed phonetic key of a name, stored in IPData.name_phonetic
+    The soundex of the last name comes first, so the candidates
+    sharing only a last name are a prefix range of the index
+    :param first_name: string
+    :param last_name: string
+    :return: string or None without a last name
+    """
+    last = soundex(normalize_name(last_name))
+    if not last:
+        return None
+
+    return last + soundex(canonical_first_name(first_name))
+
+
+def last_name_phonetic(last_name):
+    """
+    The name_phonetic prefix of every name with this last name
+    :param last_name: string
+    :return: string
+    """
+    return soundex(normalize_name(last_name))
+
+
+def trigrams(value):
+    """
+    The character trigrams of a normalized name, padded so
+    the first and last letters count as much as the others
+    :param value: string
+    :return: frozenset
+    """
+    padded = '  {} '.format(value)
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2)) if value else frozenset()
+
+
+def similarity(a, b):
+    """
+    Jaccard similarity of two trigram sets
+    :param a: frozenset
+    :param b: frozenset
+    :return: float 0..1
+    """
+    if not a or not b:
+        return 0.0
+
+    return float(len(a & b)) / len(a | b)
+
+
+class NameQuery(object):
+    """
+    A name to rank candidates against, normalized once
+    """
+
+    def __init__(self, first_name, last_name):
+        self.first = normalize_name(first_name)
+        self.last = normalize_name(last_name)
+        self.first_canonical = CANONICAL_NAMES.get(self.first, self.first)
+        self.first_trigrams = trigrams(self.first)
+        self.last_trigrams = trigrams(self.last)
+        self.phonetic = name_phonetic(first_name, last_name)
+        self.last_phonetic = soundex(self.last)
+
+    def score(self, first_name, last_name):
+        """
+        Similarity of a candidate name.  First names resolving to
+        the same given name, e.g. Bob and Robert, match fully
+        :param first_name: string
+        :param last_name: string
+        :return: float 0..1
+        """
+        last = normalize_name(last_name)
+        first = normalize_name(first_name)
+
+        last_score = 1.0 if last == self.last else similarity(self.last_trigrams, trigrams(last))
+
+        if first == self.first or CANONICAL_NAMES.get(first, first) == self.first_canonical:
+            first_score = 1.0
+        else:
+            first_score = similarity(self.first_trigrams, trigrams(first))
+
+        return LAST_NAME_WEIGHT * last_score + (1 - LAST_NAME_WEIGHT) * first_score
+
+
+def rank_candidates(query, candidates, limit=10, min_score=0.6, deadline=None):
+    """
+    Score candidate rows against a name, best first.  Scoring stops
+    at the deadline, so a very common name answers within its budget
+    from the candidates scored so far
+    :param query: NameQuery
+    :param candidates: iterable of rows with id, first_name and last_name
+    :param limit: int
+    :param min_score: float
+    :param deadline: time.time() to stop scoring at, None for no limit
+    :return: tuple (list of (score, id), bool every candidate was scored)
+    """
+    scored = []
+
+    for count, row in enumerate(candidates):
+        # checking the clock every 64 rows keeps its cost out of the loop
+        if deadline is not None and count % 64 == 0 and time.time() > deadline:
+            return sorted(scored, key=lambda item: (-item[0], item[1]))[:limit], False
+
+        score = query.score(row.first_name, row.last_name)
+        if score >= min_score:
+            scored.append((score, row.id))
+
+    return sorted(scored, key=lambda item: (-item[0], item[1]))[:limit], True
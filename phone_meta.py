@@ -0,0 +1,210 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import array
+import os
+import pickle
+import sys
+import tempfile
+import time
+import phonenumbers
+from phonenumbers import geocoder, carrier, timezone
+from phonenumbers.carrierdata import CARRIER_DATA
+from phonenumbers.geodata import GEOCODE_DATA
+from phonenumbers.tzdata import TIMEZONE_DATA
+
+# bump when the layout of the saved table changes
+TABLE_VERSION = 1
+
+# NANP area codes and exchanges, NPA-NXX is the first 6 digits of a number
+NPA_RANGE = range(200, 1000)
+NXX_RANGE = range(0, 1000)
+
+# line numbers checked for each NPA-NXX, an exchange goes in the table
+# only when the library gives every one of them the same metadata
+SAMPLE_LINES = (0, 5555, 9999)
+
+
+def library_metadata(phone):
+    """
+    Geocode, carrier and timezone of a parsed phone number from the
+    phonenumbers library, three prefix lookups and a validity check
+    :param phone: phonenumbers.PhoneNumber
+    :return: tuple (geocode, carrier, timezones)
+    """
+    return (
+        geocoder.description_for_number(phone, "en"),
+        carrier.name_for_number(phone, "en"),
+        tuple(timezone.time_zones_for_number(phone))
+    )
+
+
+def split_exchanges():
+    """
+    The NPA-NXX whose metadata depends on more digits than the exchange,
+    because the library has a longer +1 prefix inside it
+    :return: set of ints NPA * 1000 + NXX
+    """
+    split = set()
+
+    for data in (GEOCODE_DATA, CARRIER_DATA, TIMEZONE_DATA):
+        for prefix in data:
+            if prefix.startswith('1') and len(prefix) > 7:
+                split.add(int(prefix[1:7]))
+
+    return split
+
+
+class PhoneMetaTable(object):
+    """
+    Phone metadata of every NANP exchange, NPA-NXX, precomputed from
+    the phonenumbers library.  Each distinct (geocode, carrier,
+    timezones) record and string is stored once, and a flat array
+    indexed by NPA-NXX holds the record number, so a lookup is one
+    array probe.  Exchanges not in the table are left to the library
+    """
+
+    def __init__(self, records, index, library_version=None):
+        self.records = records
+        self.index = index
+        self.library_version = library_version or phonenumbers.__version__
+
+    def __len__(self):
+        return sum(1 for entry in self.index if entry)
+
+    def get(self, phone):
+        """
+        Metadata of a parsed phone number
+        :param phone: phonenumbers.PhoneNumber
+        :return: dict like phone_metadata, or None when not in the table
+        """
+        if phone.country_code != 1 or not 2000000000 <= phone.national_number <= 9999999999:
+            return None
+
+        entry = self.index[phone.national_number // 10000]
+        if not entry:
+            return None
+
+        geocode, name, timezones = self.records[entry - 1]
+        return {'geocode': geocode, 'carrier': name, 'timezone': timezones}
+
+    @classmethod
+    def build(cls, progress=None):
+        """
+        Compute the table from the phonenumbers metadata
+        :param progress: function(npa) called as each area code is done
+        :return: PhoneMetaTable
+        """
+        split = split_exchanges()
+        records = []
+        numbers = dict()
+        index = array.array('I', bytes(4 * 1000000))
+
+        for npa in NPA_RANGE:
+            for nxx in NXX_RANGE:
+                exchange = npa * 1000 + nxx
+                if exchange in split:
+                    continue
+
+                samples = set(
+                    library_metadata(phonenumbers.PhoneNumber(country_code=1, national_number=exchange * 10000 + line))
+                    for line in SAMPLE_LINES
+                )
+                if len(samples) != 1:
+                    continue
+
+                geocode, name, timezones = samples.pop()
+                record = (sys.intern(geocode), sys.intern(name), tuple(sys.intern(zone) for zone in timezones))
+
+                if record not in numbers:
+                    records.append(record)
+                    numbers[record] = len(records)
+                index[exchange] = numbers[record]
+
+            if progress is not None:
+                progress(npa)
+
+        # two bytes an exchange while the record numbers fit
+        if len(records) < 0xffff:
+            index = array.array('H', index)
+
+        return cls(records, index)
+
+    def save(self, path):
+        """
+        Write the table to path, replacing it atomically
+        :param path: string
+        :return: none
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.phone_meta-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({
+                'version': TABLE_VERSION,
+                'phonenumbers': self.library_version,
+                'records': self.records,
+                'index': self.index
+            }, f, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a saved table.  A table built by another version of the
+        phonenumbers library is stale and not used
+        :param path: string
+        :return: PhoneMetaTable or None
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+
+        except (IOError, OSError):
+            return None
+
+        except (pickle.UnpicklingError, EOFError, ValueError) as err:
+            print('Error reading phone metadata table {}: {}'.format(path, str(err)))
+            return None
+
+        if data.get('version') != TABLE_VERSION or data.get('phonenumbers') != phonenumbers.__version__:
+            print('Phone metadata table {} is stale, rebuild it with phone_meta.py'.format(path))
+            return None
+
+        return cls(data['records'], data['index'], data['phonenumbers'])
+
+
+def main():
+    """
+    Program entry point
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Build the NPA-NXX phone metadata table')
+    parser.add_argument('path', nargs='?', help='table file, defaults to PHONE_META_PATH')
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        import config
+        path = getattr(config, 'PHONE_META_PATH', os.path.join(tempfile.gettempdir(), 'm3data_phone_meta.pickle'))
+
+    start = time.time()
+
+    def progress(npa):
+        if npa % 100 == 99:
+            print('[phone_meta] Area codes up to {} done in {:.1f}s'.format(npa, time.time() - start))
+
+    table = PhoneMetaTable.build(progress)
+    table.save(path)
+
+    print('[phone_meta] {} exchanges, {} distinct records, written to {} in {:.1f}s'.format(
+        len(table), len(table.records), path, time.time() - start
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from sqlalchemy import exc
+from access_log import AccessLogWriter
+
+
+class FakeWriter(AccessLogWriter):
+    """
+    AccessLogWriter collecting its rows in memory instead of a database
+    """
+
+    def __init__(self, spill_dir, **kwargs):
+        super(FakeWriter, self).__init__(None, None, spill_dir=spill_dir, interval=60, **kwargs)
+        self.rows = []
+        self.down = False
+
+    def write(self, rows):
+        if self.down:
+            raise exc.SQLAlchemyError('database is down')
+        self.rows.extend(rows)
+
+
+class AccessLogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.writer = FakeWriter(self.spill_dir, max_queue=5)
+
+    def files(self, prefix):
+        return [name for name in os.listdir(self.spill_dir) if name.startswith(prefix)]
+
+    def test_journals_records_until_written(self):
+        self.writer.log(1, 'sms')
+        self.writer.log(2, 'ipdata', 3)
+
+        self.assertEqual(len(self.files('journal-')), 1)
+        self.assertEqual(self.writer.flush(), 4)
+        self.assertEqual(len(self.files('journal-')), 1)
+        self.assertEqual(self.files('spill-'), [])
+
+    def test_spills_a_full_queue_and_replays_it(self):
+        self.writer.down = True
+        for i in range(5):
+            self.writer.log(1, 'sms')
+
+        self.assertEqual(len(self.writer._queue), 0)
+        self.assertEqual(len(self.files('spill-')), 1)
+
+        self.writer.down = False
+        self.assertEqual(self.writer.replay(), 5)
+        self.assertEqual(self.files('spill-'), [])
+
+    def test_replays_the_journal_of_a_killed_process(self):
+        code = (
+            'import os, sys; sys.path[:0] = {!r}; from access_log import AccessLogWriter; '
+            'AccessLogWriter(None, None, spill_dir={!r}, interval=60).log(9, "name", 2); os._exit(1)'
+        ).format(sys.path, self.spill_dir)
+        subprocess.call([sys.executable, '-c', code])
+
+        self.writer.log(1, 'sms')
+
+        self.assertEqual(self.writer.replay(), 2)
+        self.assertEqual([row['user_id'] for row in self.writer.rows], [9, 9])
+        self.assertEqual(len(self.files('journal-')), 1)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.spill_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+from address import address_key, standardize_street
+
+
+class StandardizeStreetTest(unittest.TestCase):
+    def test_splits_the_unit_after_the_suffix(self):
+        self.assertEqual(standardize_street('12 Main Street Apartment 4'), ('12 MAIN ST', 'APT', '4'))
+        self.assertEqual(standardize_street('12 Main St N Apt 4'), ('12 MAIN ST N', 'APT', '4'))
+        self.assertEqual(standardize_street('12 Main #4'), ('12 MAIN', '#', '4'))
+        self.assertEqual(standardize_street('123 Broadway Apt 4'), ('123 BROADWAY', 'APT', '4'))
+
+    def test_keeps_street_names_starting_with_a_designator(self):
+        self.assertEqual(standardize_street('5 Pier Avenue'), ('5 PIER AVE', '', ''))
+        self.assertEqual(standardize_street('1001 Space Center Blvd'), ('1001 SPACE CENTER BLVD', '', ''))
+        self.assertEqual(standardize_street('12 N Pier Rd'), ('12 N PIER RD', '', ''))
+        self.assertEqual(standardize_street('5 Lake Pier Rd'), ('5 LAKE PIER RD', '', ''))
+
+    def test_splits_the_unit_of_a_designator_street(self):
+        self.assertEqual(standardize_street('1001 Space Center Blvd Ste 100'), ('1001 SPACE CENTER BLVD', 'STE', '100'))
+
+    def test_unit_on_either_line(self):
+        self.assertEqual(standardize_street('12 Main St', 'Unit 4'), standardize_street('12 Main St Unit 4'))
+
+
+class AddressKeyTest(unittest.TestCase):
+    def test_spellings_share_a_key(self):
+        self.assertEqual(address_key('5 Pier Ave', None, '32801'), address_key('5 Pier Avenue', None, '32801-1234'))
+        self.assertEqual(
+            address_key('123 North Main Street Apartment 4', None, '32801'),
+            address_key('123 N Main St #4', None, '32801')
+        )
+
+    def test_designators_without_a_suffix_share_a_key(self):
+        self.assertEqual(
+            address_key('123 Broadway Apt 4', None, '10001'),
+            address_key('123 Broadway #4', None, '10001')
+        )
+
+    def test_requires_a_street_and_zip(self):
+        self.assertIsNone(address_key('', None, '32801'))
+        self.assertIsNone(address_key('12 Main St', None, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from cache import LRUCache, RedisCache, TokenCache
+
+
+class FakeRedis(object):
+    """
+    In memory stand in for the redis commands used by RedisCache
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self.lock:
+            held, expires = self.data.get(key, (None, None))
+            if nx and held is not None and (expires is None or expires > time.time()):
+                return None
+            ttl = ex if ex is not None else (px / 1000.0 if px is not None else None)
+            self.data[key] = (value, time.time() + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            return 1 if self.data.pop(key, None) else 0
+
+    def eval(self, script, numkeys, key, token):
+        # only the compare and delete UNLOCK_SCRIPT is used
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+            if value != token or (expires is not None and expires <= time.time()):
+                return 0
+            del self.data[key]
+            return 1
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append((self.client.get, (key,), {}))
+
+    def set(self, key, value, **kwargs):
+        self.commands.append((self.client.set, (key, value), kwargs))
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2, ttl=60)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_expires_entries(self):
+        self.cache.set('a', 1, ttl=0)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_counts_hits_and_misses(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+class RedisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = RedisCache(FakeRedis(), lock_timeout=1, poll_interval=0.01)
+
+    def test_round_trips_entries(self):
+        self.cache.set('ip:1.2.3.4', (True, '{"ip": "1.2.3.4"}'))
+        self.cache.set('ip:1.2.3.5', (False, b'{}'))
+
+        self.assertEqual(self.cache.get('ip:1.2.3.4'), (True, b'{"ip": "1.2.3.4"}'))
+        self.assertEqual(self.cache.get('ip:1.2.3.5'), (False, b'{}'))
+
+    def test_get_many(self):
+        self.cache.set_many({'a': (True, b'1'), 'b': (False, b'2')})
+
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': (True, b'1'), 'b': (False, b'2')})
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_version_invalidates_entries(self):
+        self.cache.set('a', (True, b'1'))
+        self.cache.version = 2
+
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_fills_a_cold_key_once(self):
+        calls = []
+
+        def fill():
+            calls.append(1)
+            time.sleep(0.1)
+            return True, b'filled'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get_or_fill('a', fill))) for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(True, b'filled')] * 5)
+
+    def test_keeps_the_lock_of_another_process_after_expiry(self):
+        self.cache.lock_timeout = 0.05
+        lock = self.cache.key('a') + ':lock'
+
+        def fill():
+            # the fill outlives its lock and another process takes it
+            time.sleep(0.1)
+            self.cache.client.set(lock, b'other', nx=True, px=10000)
+            return True, b'filled'
+
+        self.assertEqual(self.cache.get_or_fill('a', fill), (True, b'filled'))
+        self.assertEqual(self.cache.client.get(lock), b'other')
+
+    def test_releases_its_own_lock(self):
+        self.cache.get_or_fill('a', lambda: (True, b'filled'))
+
+        self.assertIsNone(self.cache.client.get(self.cache.key('a') + ':lock'))
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=10, ttl=60)
+
+    def test_holds_tokens_until_they_expire(self):
+        self.cache.set('valid', ('alice', 1), time.time() + 30)
+        self.cache.set('expired', ('alice', 1), time.time() - 1)
+
+        self.assertEqual(self.cache.get('valid'), ('alice', 1))
+        self.assertIsNone(self.cache.get('expired'))
+
+    def test_revokes_the_tokens_of_a_user(self):
+        self.cache.set('a', ('alice', 1), time.time() + 30)
+        self.cache.set('b', ('alice', 1), time.time() + 30)
+        self.cache.set('c', ('bob', 2), time.time() + 30)
+        self.cache.revoke(1)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), ('bob', 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
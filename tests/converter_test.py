@@ -0,0 +1,121 @@
+#!.env/bin/python
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from converter import RECORD_WIDTH, checkpoint_path, import_range, normalize_columns, read_checkpoint, \
+    row_to_dict, write_checkpoint, write_delta_batch
+from models import IPData
+
+
+def feed_record(number, cell_phone):
+    """
+    A vendor CSV record with an IP address and cell phone
+    """
+    rec = [''] * RECORD_WIDTH
+    rec[2] = '10.0.{}.{}'.format(number // 256, number % 256)
+    rec[17] = 'First{}'.format(number)
+    rec[18] = 'Last{}'.format(number)
+    rec[21] = cell_phone
+    return rec
+
+
+class NormalizeColumnsTest(unittest.TestCase):
+    def test_strips_zip_plus_4(self):
+        records = [feed_record(number, '') for number in range(3)]
+        for rec, value in zip(records, (' 32801-1234 ', '32801 ', '')):
+            rec[26] = value
+
+        columns, errors = normalize_columns(records)
+
+        self.assertEqual(columns['zip_code'], ['32801', '32801', None])
+        self.assertEqual(columns['zip_4'], [1234, None, None])
+
+
+class RowToDictTest(unittest.TestCase):
+    def test_normalizes_like_a_batch(self):
+        rec = feed_record(1, '+1 (407) 555-0101')
+        rec[25] = 'fl'
+        rec[26] = '32801-1234'
+
+        data = row_to_dict(rec)
+
+        self.assertEqual((data['cell_phone'], data['state'], data['zip_code'], data['zip_4']),
+                         ('4075550101', 'FL', '32801', 1234))
+
+    def test_rejects_a_short_record(self):
+        self.assertRaises(IndexError, row_to_dict, ['1.2.3.4'])
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filepath = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+
+    def test_modes_do_not_share_a_checkpoint(self):
+        self.assertNotEqual(checkpoint_path(self.filepath), checkpoint_path(self.filepath, mode='delta'))
+
+    def test_refuses_the_checkpoint_of_another_mode(self):
+        path = checkpoint_path(self.filepath)
+        write_checkpoint(path, {'mode': 'bulk', 'file': [0, int(os.stat(self.filepath).st_mtime)],
+                                'start': 0, 'end': None, 'offset': 10, 'records': 1, 'rows': 1, 'errors': 0})
+
+        self.assertEqual(read_checkpoint(path, self.filepath, 0, None, 'bulk')['offset'], 10)
+        self.assertIsNone(read_checkpoint(path, self.filepath, 0, None, 'delta'))
+
+    def tearDown(self):
+        for path in (self.filepath, checkpoint_path(self.filepath)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class DeltaImportTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        IPData.__table__.create(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        fd, self.filepath = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f1:
+            writer = csv.writer(f1)
+            for number in range(30):
+                writer.writerow(feed_record(number, '' if number % 3 == 0 else '407555{:04d}'.format(number)))
+
+    def delta(self):
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+
+        def writer(session, columns):
+            return write_delta_batch(session, columns, stats)
+
+        import_range(self.session, self.filepath, batch_size=7, label='delta', writer=writer)
+        return stats
+
+    def test_rerun_inserts_nothing(self):
+        first = self.delta()
+        second = self.delta()
+
+        self.assertEqual(first['inserted'], 30)
+        self.assertEqual((second['inserted'], second['unchanged']), (0, 30))
+        self.assertEqual(self.session.query(IPData).count(), 30)
+
+    def test_blank_phone_matches_empty_string(self):
+        self.delta()
+        self.session.query(IPData).filter(IPData.cell_phone.is_(None)).update(
+            {'cell_phone': ''}, synchronize_session=False)
+        self.session.commit()
+
+        self.assertEqual(self.delta()['inserted'], 0)
+        self.assertEqual(self.session.query(IPData).count(), 30)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.filepath)
+
+
+if __name__ == '__main__':
+    unittest.main()